@@ -0,0 +1,111 @@
+"""
+Measure how responsive the Qt event loop stays while picket fence analyses run
+in the background, once with one QThread per analysis and once with the process
+backend.
+
+Usage: python benchmarks/event_loop_latency.py [--jobs 3] [--interval 10]
+"""
+import argparse
+import os
+import os.path as osp
+import statistics
+import sys
+import time
+from tempfile import TemporaryDirectory
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide6.QtCore import QCoreApplication, QThread, QTimer
+from pylinac.core.image_generator import AS1200Image, FilteredFieldLayer, GaussianFilterLayer
+
+from core.analysis.picket_fence import QPicketFenceWorker
+from core.analysis.compute.picket_fence import generate_picket_fence
+from core.analysis.worker import ProcessBridge
+
+def run_jobs(app: QCoreApplication, start_job, jobs: int, interval_ms: int) -> dict:
+    """
+    Start ``jobs`` analyses with ``start_job`` and record how late a periodic timer
+    fires until all of them have finished.
+    """
+    delays = []
+    finished = []
+    start = time.perf_counter()
+    last_tick = [start]
+
+    def tick():
+        now = time.perf_counter()
+        delays.append(max((now - last_tick[0]) * 1000 - interval_ms, 0))
+        last_tick[0] = now
+
+    def job_done(*args):
+        finished.append(time.perf_counter() - start)
+        if len(finished) == jobs:
+            app.quit()
+
+    timer = QTimer()
+    timer.setInterval(interval_ms)
+    timer.timeout.connect(tick)
+
+    timer.start()
+    keep_alive = [start_job(job_done) for _ in range(jobs)]
+    app.exec()
+    timer.stop()
+
+    # Let the analysis threads wind down before they are garbage collected
+    for job in keep_alive:
+        if isinstance(job, QThread):
+            job.wait()
+
+    return {"wall time (s)": max(finished),
+            "mean delay (ms)": statistics.mean(delays),
+            "p95 delay (ms)": statistics.quantiles(delays, n=20)[-1],
+            "max delay (ms)": max(delays)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--jobs", type=int, default=3, help="number of concurrent analyses")
+    parser.add_argument("--interval", type=int, default=10, help="timer interval in ms")
+    args = parser.parse_args()
+
+    app = QCoreApplication(sys.argv)
+
+    with TemporaryDirectory() as tmp:
+        pf_file = osp.join(tmp, "pf.dcm")
+        generate_picket_fence(AS1200Image(1000), FilteredFieldLayer, pf_file,
+                              final_layers=[GaussianFilterLayer(sigma_mm=1)])
+
+        def start_thread_job(done):
+            worker = QPicketFenceWorker(pf_file)
+            qthread = QThread()
+            worker.moveToThread(qthread)
+            worker.thread_finished.connect(qthread.quit)
+            worker.thread_finished.connect(done)
+            qthread.started.connect(worker.analyze)
+            qthread.start()
+            qthread.worker = worker
+            return qthread
+
+        bridge = ProcessBridge(max_workers=args.jobs)
+
+        def start_process_job(done):
+            worker = QPicketFenceWorker(pf_file)
+            worker.thread_finished.connect(done)
+            bridge.submit(worker)
+            return worker
+
+        # Start the worker processes before measuring
+        run_jobs(app, start_process_job, args.jobs, args.interval)
+
+        results = {"QThread": run_jobs(app, start_thread_job, args.jobs, args.interval),
+                   "process": run_jobs(app, start_process_job, args.jobs, args.interval)}
+
+        bridge.shutdown()
+
+    print(f"{args.jobs} concurrent picket fence analyses, {args.interval} ms timer\n")
+    print(f"{'backend':<10}" + "".join(f"{name:>18}" for name in results["QThread"]))
+    for backend, stats in results.items():
+        print(f"{backend:<10}" + "".join(f"{value:>18.2f}" for value in stats.values()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Measure the time of a field analysis, of its profile plots in the worksheet (pyqtgraph)
+and of its report plots (matplotlib), with the profile metrics of pylinac computed on
+every call and with the memoized metrics of FAAnalysis. Each mode runs in a fresh
+process.
+
+Usage: python benchmarks/field_profile_metrics.py [--edge "Inflection Hill"] [--fff] [--repeat 5]
+"""
+import argparse
+import os
+import os.path as osp
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from tempfile import TemporaryDirectory
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import matplotlib
+matplotlib.use("agg")
+import matplotlib.pyplot as plt
+
+from pylinac.core.image_generator import (AS1200Image, FilteredFieldLayer, FilterFreeFieldLayer,
+                                          GaussianFilterLayer, RandomNoiseLayer)
+from pylinac.field_analysis import FieldAnalysis
+
+from core.analysis.compute.field_analysis import FAAnalysis
+
+def generate_field(file_out: str, fff: bool):
+    simulator = AS1200Image(1000)
+    simulator.add_layer((FilterFreeFieldLayer if fff else FilteredFieldLayer)(field_size_mm = (150, 150)))
+    simulator.add_layer(GaussianFilterLayer(sigma_mm = 2))
+    simulator.add_layer(RandomNoiseLayer(sigma = 0.01))
+    simulator.generate_dicom(file_out)
+
+def measure(path: str, mode: str, edge: str, fff: bool, repeat: int) -> dict:
+    from PySide6.QtWidgets import QApplication
+    from core.analysis.field_analysis import QFieldAnalysis
+
+    app = QApplication.instance() or QApplication([])
+    analysis_class = FieldAnalysis if mode == "pylinac" else FAAnalysis
+    times = {"analyze (s)": 0.0, "worksheet plot (s)": 0.0, "report plot (s)": 0.0}
+
+    for _ in range(repeat):
+        fa = analysis_class(path)
+
+        start = time.perf_counter()
+        fa.analyze(edge_detection_method = edge, is_FFF = fff)
+        times["analyze (s)"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        QFieldAnalysis(fa).qplot_analyzed_image()
+        times["worksheet plot (s)"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        figures, _ = fa.plot_analyzed_image(show = False, split_plots = True)
+        times["report plot (s)"] += time.perf_counter() - start
+        for figure in figures:
+            plt.close(figure)
+
+    return {name: value / repeat for name, value in times.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--edge", default="Inflection Hill",
+                        choices=["FWHM", "Inflection Derivative", "Inflection Hill"],
+                        help="edge detection method")
+    parser.add_argument("--fff", action="store_true", help="flattening filter free field")
+    parser.add_argument("--repeat", type=int, default=5, help="analyses per mode")
+    args = parser.parse_args()
+
+    results = {}
+
+    with TemporaryDirectory() as tmp:
+        path = osp.join(tmp, "field.dcm")
+        generate_field(path, args.fff)
+
+        for mode in ("pylinac", "memoized"):
+            with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+                results[mode] = pool.submit(measure, path, mode, args.edge, args.fff, args.repeat).result()
+
+    print(f"{args.edge} edges, {'FFF' if args.fff else 'flat'} field, mean of {args.repeat} analyses\n")
+    print(f"{'metrics':<12}" + "".join(f"{name:>20}" for name in results["pylinac"]))
+    for mode, stats in results.items():
+        print(f"{mode:<12}" + "".join(f"{value:>20.3f}" for value in stats.values()))
+
+if __name__ == "__main__":
+    main()
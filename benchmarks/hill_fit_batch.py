@@ -0,0 +1,95 @@
+"""
+Measure the time of the Hill fits of field edges (Inflection Hill edge detection), with
+pylinac's Hill.fit on one edge at a time and with fit_hill_edges on all the edges at
+once, against the number of images (four edges each), and the largest difference of
+the inflection points found. The edges come from simulated flat and FFF fields of
+several sizes, reused to reach the number of images. Each mode runs in a fresh process.
+
+Usage: python benchmarks/hill_fit_batch.py [--images 1 10 50 200] [--repeat 3]
+"""
+import argparse
+import itertools
+import os
+import os.path as osp
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from tempfile import TemporaryDirectory
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import numpy as np
+from pylinac.core.hill import Hill
+from pylinac.core.image_generator import (AS1200Image, FilteredFieldLayer, FilterFreeFieldLayer,
+                                          GaussianFilterLayer, RandomNoiseLayer)
+
+from core.analysis.compute.field_analysis import FAAnalysis, hill_edge_windows
+from core.analysis.compute.hill import fit_hill_edges
+
+FIELDS = [(layer, size) for layer in (FilteredFieldLayer, FilterFreeFieldLayer)
+          for size in ((50, 50), (100, 200), (250, 250))]
+
+def field_edges(tmp: str) -> list[list[tuple[np.ndarray, np.ndarray]]]:
+    """
+    The Hill fit windows of the four edges of each simulated field.
+    """
+    edges = []
+
+    for index, (layer, size) in enumerate(FIELDS):
+        path = osp.join(tmp, f"field_{index}.dcm")
+        simulator = AS1200Image(1000)
+        simulator.add_layer(layer(field_size_mm = size))
+        simulator.add_layer(GaussianFilterLayer(sigma_mm = 2))
+        simulator.add_layer(RandomNoiseLayer(sigma = 0.01))
+        simulator.generate_dicom(path)
+
+        fa = FAAnalysis(path)
+        fa.analyze(edge_detection_method = "Inflection Hill", is_FFF = layer is FilterFreeFieldLayer)
+        edges.append(hill_edge_windows(fa.horiz_profile) + hill_edge_windows(fa.vert_profile))
+
+    return edges
+
+def measure(edges: list[tuple[np.ndarray, np.ndarray]], mode: str, repeat: int) -> tuple[float, np.ndarray]:
+    start = time.perf_counter()
+
+    for _ in range(repeat):
+        if mode == "per edge":
+            hills = [Hill.fit(x, y) for x, y in edges]
+        else:
+            hills = fit_hill_edges(edges)
+
+    inflections = np.array([hill.inflection_idx()["index (exact)"] for hill in hills])
+
+    return (time.perf_counter() - start) / repeat, inflections
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--images", type=int, nargs="+", default=[1, 10, 50, 200],
+                        help="numbers of images whose edges are fit")
+    parser.add_argument("--repeat", type=int, default=3, help="fits per mode")
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as tmp:
+        image_edges = field_edges(tmp)
+
+    results = {}
+
+    for images in args.images:
+        edges = [edge for pair in itertools.islice(itertools.cycle(image_edges), images) for edge in pair]
+
+        for mode in ("per edge", "batched"):
+            with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+                results[images, mode] = pool.submit(measure, edges, mode, args.repeat).result()
+
+    print(f"Mean of {args.repeat} fits, inflection difference against the per edge fits\n")
+    print(f"{'images':<8}{'edges':>8}{'per edge (ms)':>16}{'batched (ms)':>16}{'speedup':>10}{'max diff (px)':>16}")
+    for images in args.images:
+        per_edge_time, per_edge = results[images, "per edge"]
+        batched_time, batched = results[images, "batched"]
+        print(f"{images:<8}{len(per_edge):>8}{per_edge_time * 1000:>16.1f}{batched_time * 1000:>16.1f}"
+              f"{per_edge_time / batched_time:>10.1f}{np.max(np.abs(per_edge - batched)):>16.2e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Measure the peak and retained resident memory of a picket fence analysis merged from
+several high resolution EPID images, with the DICOM image cache decoding the images
+into memory and with it memory-mapping them. Each mode runs in a fresh process.
+
+Usage: python benchmarks/image_memory.py [--images 4] [--sid 1200]
+"""
+import argparse
+import os
+import os.path as osp
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from tempfile import TemporaryDirectory
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from pylinac.core.image_generator import AS1200Image, FilteredFieldLayer, GaussianFilterLayer
+
+import core.image.dicom as dicom
+from core.analysis.compute.memory import PeakRSSMonitor, current_rss
+from core.analysis.compute.picket_fence import PFAnalysis, generate_picket_fence
+
+def measure(files: list[str], memory_map: bool) -> dict:
+    dicom._dicom_cache = dicom.DicomImageCache(memory_map = memory_map)
+    start_rss = current_rss()
+
+    with PeakRSSMonitor() as monitor:
+        analysis = PFAnalysis(files)
+        analysis.analyze()
+
+    return {"peak (MB)": (monitor.peak_rss - start_rss) / 2**20,
+            "retained (MB)": (current_rss() - start_rss) / 2**20,
+            "cached (MB)": dicom.dicom_cache().stats().size_bytes / 2**20,
+            "max error (mm)": analysis.max_error}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--images", type=int, default=4, help="number of merged images")
+    parser.add_argument("--sid", type=int, default=1200, help="simulated source to image distance in mm")
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as tmp:
+        files = []
+        for index in range(args.images):
+            files.append(osp.join(tmp, f"pf_{index}.dcm"))
+            generate_picket_fence(AS1200Image(args.sid), FilteredFieldLayer, files[-1],
+                                  final_layers=[GaussianFilterLayer(sigma_mm=1)],
+                                  pickets=11, picket_spacing_mm=15)
+
+        file_size = osp.getsize(files[0]) / 2**20
+        results = {}
+        for memory_map in (False, True):
+            with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+                results["mapped" if memory_map else "decoded"] = pool.submit(measure, files, memory_map).result()
+
+    print(f"{args.images} images of {file_size:.1f} MB, memory above the process baseline\n")
+    print(f"{'images':<10}" + "".join(f"{name:>16}" for name in results["decoded"]))
+    for mode, stats in results.items():
+        print(f"{mode:<10}" + "".join(f"{value:>16.3f}" if name == "max error (mm)" else f"{value:>16.1f}"
+                                      for name, value in stats.items()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Measure how long it takes to draw the MLC marker lines of an analyzed picket fence
+and how many scene items they leave behind, once with one curve per marker line (the
+previous implementation) and once with one curve per colour.
+
+Usage: python benchmarks/pf_marker_rendering.py [--pickets 11] [--separate-leaves]
+"""
+import argparse
+import os
+import os.path as osp
+import sys
+import time
+from tempfile import TemporaryDirectory
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide6.QtCore import QCoreApplication
+from PySide6.QtWidgets import QApplication
+from pylinac.core.image_generator import AS1200Image, FilteredFieldLayer, GaussianFilterLayer
+
+import pyqtgraph as pg
+
+from core.analysis.picket_fence import QPicketFence
+from core.analysis.compute.picket_fence import PFAnalysis, generate_picket_fence
+
+def draw_per_marker(pf: QPicketFence, plot_item: pg.PlotItem):
+    for mlc_meas in pf.mlc_meas:
+        for idx, line in enumerate(mlc_meas.marker_lines):
+            curve = pg.PlotCurveItem(x=[line.point1.x, line.point2.x], y=[line.point1.y, line.point2.y],
+                                     pen=pg.mkPen(color = mlc_meas.bg_color[idx], width = 2.0),
+                                     skipFiniteCheck=False)
+            plot_item.addItem(curve)
+            QCoreApplication.processEvents()
+
+def draw_per_colour(pf: QPicketFence, plot_item: pg.PlotItem):
+    for curve in pf.marker_curves():
+        plot_item.addItem(curve)
+
+def measure(app: QApplication, pf: QPicketFence, draw) -> dict:
+    """
+    Draw the markers over the image with ``draw`` and time it until the scene has
+    been painted once. The widget is painted off screen with grab().
+    """
+    widget = pg.GraphicsLayoutWidget()
+    widget.resize(1000, 800)
+
+    plot_item = widget.addPlot()
+    plot_item.addItem(pg.ImageItem(pf.image.array))
+    app.processEvents()
+
+    items_before = len(widget.scene().items())
+    plot_item.disableAutoRange()
+
+    start = time.perf_counter()
+    draw(pf, plot_item)
+    plot_item.enableAutoRange()
+    widget.grab()
+    elapsed = time.perf_counter() - start
+
+    results = {"render time (s)": elapsed,
+               "plot items": len(plot_item.items) - 1,
+               "scene items": len(widget.scene().items()) - items_before}
+
+    widget.deleteLater()
+    app.processEvents()
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pickets", type=int, default=11, help="number of pickets")
+    parser.add_argument("--separate-leaves", action="store_true",
+                        help="analyze the A and B leaves separately")
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+
+    with TemporaryDirectory() as tmp:
+        pf_file = osp.join(tmp, "pf.dcm")
+        generate_picket_fence(AS1200Image(1000), FilteredFieldLayer, pf_file,
+                              final_layers=[GaussianFilterLayer(sigma_mm=1)],
+                              pickets=args.pickets, picket_spacing_mm=15)
+
+        analysis = PFAnalysis(pf_file)
+        analysis.analyze(separate_leaves=args.separate_leaves)
+        pf = QPicketFence(analysis)
+
+    results = {"per marker": measure(app, pf, draw_per_marker),
+               "per colour": measure(app, pf, draw_per_colour)}
+
+    print(f"{len(pf.mlc_meas)} MLC measurements, {len(pf.measurements.error)} marker lines\n")
+    print(f"{'markers':<12}" + "".join(f"{name:>18}" for name in results["per marker"]))
+    for name, stats in results.items():
+        print(f"{name:<12}" + "".join(f"{value:>18.3f}" if isinstance(value, float)
+                                      else f"{value:>18}" for value in stats.values()))
+
+if __name__ == "__main__":
+    main()
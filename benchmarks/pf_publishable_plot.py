@@ -0,0 +1,96 @@
+"""
+Measure the render time and size of the picket fence plot saved in reports, and of the
+report itself, with the full vector plot of pylinac and with the plot complexity budget
+(rasterized image, one path per colour, markers rasterized beyond the segment budget).
+
+Usage: python benchmarks/pf_publishable_plot.py [--pickets 15] [--separate-leaves] [--dpi 150]
+"""
+import argparse
+import os
+import os.path as osp
+import re
+import sys
+import time
+import zlib
+from tempfile import TemporaryDirectory
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import matplotlib
+matplotlib.use("agg")
+
+from pylinac.core.image_generator import (AS1200Image, FilteredFieldLayer, GaussianFilterLayer,
+                                          RandomNoiseLayer)
+
+from core.analysis.compute.picket_fence import PFAnalysis, generate_picket_fence
+from core.tools.report import PicketFenceReport
+
+def stroked_paths(pdf: bytes) -> int:
+    """
+    Number of stroke operators in the content streams of ``pdf`` (images are skipped).
+    """
+    count = 0
+
+    for pdf_object in pdf.split(b"endobj"):
+        header, separator, stream = pdf_object.partition(b"stream")
+        if not separator or b"/Subtype /Image" in header:
+            continue
+
+        stream = stream.strip(b"\r\n").removesuffix(b"endstream").rstrip(b"\r\n")
+
+        try:
+            stream = zlib.decompress(stream)
+        except zlib.error:
+            pass
+        count += len(re.findall(rb"(?:^|\s)[Ss](?=\s|$)", stream))
+
+    return count
+
+def measure(pf: PFAnalysis, report_file: str, **plot_kwargs) -> dict:
+    start = time.perf_counter()
+    plot = pf.get_publishable_plot(**plot_kwargs)
+    plot_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    PicketFenceReport(report_file, summary_plot = plot, mlc_type = pf.mlc_type,
+                      analysis_summary = {"Max Error": [f"{pf.max_error:2.3f} mm", ""]},
+                      max_error = pf.max_error).save_report()
+    report_time = time.perf_counter() - start
+
+    return {"plot (s)": plot_time,
+            "plot (kB)": len(plot.getvalue()) / 1024,
+            "vector paths": stroked_paths(plot.getvalue()),
+            "report (s)": report_time,
+            "report (kB)": osp.getsize(report_file) / 1024}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pickets", type=int, default=15, help="number of pickets")
+    parser.add_argument("--separate-leaves", action="store_true",
+                        help="analyze the A and B leaves separately")
+    parser.add_argument("--dpi", type=int, default=150, help="raster resolution of the budgeted plot")
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as tmp:
+        pf_file = osp.join(tmp, "pf.dcm")
+        generate_picket_fence(AS1200Image(1000), FilteredFieldLayer, pf_file,
+                              final_layers=[GaussianFilterLayer(sigma_mm=1), RandomNoiseLayer(sigma=0.02)],
+                              pickets=args.pickets, picket_spacing_mm=15)
+
+        pf = PFAnalysis(pf_file)
+        pf.analyze(separate_leaves=args.separate_leaves)
+
+        report_file = osp.join(tmp, "report.pdf")
+        results = {"full vector": measure(pf, report_file, full_vector=True, raster_dpi=args.dpi),
+                   "budget": measure(pf, report_file, raster_dpi=args.dpi),
+                   "rasterized": measure(pf, report_file, raster_dpi=args.dpi, max_vector_segments=0)}
+
+    print(f"{len(pf.measurements.error)} marker lines, {len(pf.pickets)} pickets, {args.dpi} dpi\n")
+    print(f"{'plot':<14}" + "".join(f"{name:>14}" for name in results["budget"]))
+    for name, stats in results.items():
+        print(f"{name:<14}" + "".join(f"{value:>14}" if isinstance(value, int) else f"{value:>14.2f}"
+                                      for value in stats.values()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Measure the peak resident memory of a starshot analysis combined from separate
+single-spoke EPID images, against the number of spokes: with pylinac's
+Starshot.from_multiple_images, which loads every image before combining them, and
+with the images streamed into one array, decoded or memory-mapped. Each mode runs in
+a fresh process.
+
+Usage: python benchmarks/starshot_memory.py [--spokes 4 8 12] [--sid 1000]
+"""
+import argparse
+import os
+import os.path as osp
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from tempfile import TemporaryDirectory
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import numpy as np
+from pylinac.core.image_generator import AS1200Image
+
+from core.analysis.compute.memory import PeakRSSMonitor, current_rss
+from core.analysis.compute.starshot import StarshotAnalysis, StarshotRunner
+
+def generate_spoke(file_out: str, angle: float, sid: float, width_mm: float = 3.0):
+    """
+    Single-spoke image: a line of ``width_mm`` (FWHM) through the centre of the panel at
+    ``angle`` degrees, with some noise.
+    """
+    simulator = AS1200Image(sid)
+    rows, columns = np.indices(simulator.shape, dtype = float)
+    rows -= (simulator.shape[0] - 1) / 2
+    columns -= (simulator.shape[1] - 1) / 2
+
+    theta = np.radians(angle)
+    distance = np.abs(columns * np.sin(theta) - rows * np.cos(theta)) * simulator.pixel_size / simulator.mag_factor
+    sigma = width_mm / 2.355
+    spoke = np.exp(-distance**2 / (2 * sigma**2))
+
+    noise = np.random.default_rng(int(angle * 10)).normal(0, 0.01, spoke.shape)
+    simulator.image = (np.clip(spoke + noise + 0.05, 0, 1) * 30000).astype(np.uint16)
+    simulator.generate_dicom(file_out)
+
+def measure(files: list[str], mode: str) -> dict:
+    start_rss = current_rss()
+    start = time.perf_counter()
+
+    with PeakRSSMonitor() as monitor:
+        if mode == "pylinac":
+            starshot = StarshotAnalysis.from_multiple_images(files)
+            starshot.analyze()
+        else:
+            starshot = StarshotRunner(files, memory_map = mode == "mapped").run().starshot
+
+    return {"peak (MB)": (monitor.peak_rss - start_rss) / 2**20,
+            "time (s)": time.perf_counter() - start,
+            "wobble (mm)": starshot.wobble.radius_mm * 2}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--spokes", type=int, nargs="+", default=[4, 8, 12],
+                        help="numbers of single-spoke images to combine")
+    parser.add_argument("--sid", type=int, default=1000, help="simulated source to image distance in mm")
+    args = parser.parse_args()
+
+    results = {}
+
+    with TemporaryDirectory() as tmp:
+        for spokes in args.spokes:
+            files = []
+            for index in range(spokes):
+                files.append(osp.join(tmp, f"spoke_{spokes}_{index}.dcm"))
+                # Spokes of opposite gantry angles overlap, spread them over half a turn
+                generate_spoke(files[-1], 180 * index / spokes, args.sid)
+
+            file_size = osp.getsize(files[0]) / 2**20
+
+            for mode in ("pylinac", "streamed", "mapped"):
+                with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+                    results[spokes, mode] = pool.submit(measure, files, mode).result()
+
+    print(f"Images of {file_size:.1f} MB, memory above the process baseline\n")
+    print(f"{'spokes':<8}{'mode':<10}" + "".join(f"{name:>14}" for name in results[next(iter(results))]))
+    for (spokes, mode), stats in results.items():
+        print(f"{spokes:<8}{mode:<10}" + "".join(f"{value:>14.3f}" if name == "wobble (mm)" else f"{value:>14.1f}"
+                                                 for name, value in stats.items()))
+
+if __name__ == "__main__":
+    main()
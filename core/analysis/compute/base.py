@@ -0,0 +1,115 @@
+import threading
+from typing import Any, Callable
+
+from core.analysis.compute.cache import result_cache
+
+ProgressCallback = Callable[[Any], None]
+
+class AnalysisCancelled(Exception):
+    """
+    Raised inside an analysis when its cancellation token has been cancelled.
+    """
+
+class CancellationToken():
+    """
+    Flag used to stop a running analysis between two of its stages.
+
+    The flag is a ``threading.Event`` by default. Analyses that run in a worker process
+    receive a token wrapping a shared event (e.g. from a multiprocessing manager) instead.
+    """
+
+    def __init__(self, event = None):
+        self._event = event if event is not None else threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def check(self):
+        """
+        Raise AnalysisCancelled if the token has been cancelled.
+        """
+        if self._event.is_set():
+            raise AnalysisCancelled()
+
+class AnalysisRunner():
+    """
+    Base class for the Qt-free analysis runners.
+
+    A runner only holds the plain parameters of an analysis, so it can be pickled
+    and executed in a worker process or on a headless server. Calling ``run()``
+    loads the images, performs the analysis and returns a plain result dataclass.
+    ``run_cached()`` returns the stored result instead when the same images were
+    already analyzed with the same parameters.
+    """
+
+    cacheable = True
+
+    # Parameters that only change how the analysis runs (e.g. its number of worker
+    # processes), not its results
+    execution_parameters: tuple[str, ...] = ()
+
+    def run(self, progress: ProgressCallback | None = None,
+            cancel: CancellationToken | None = None):
+        """
+        Perform the analysis and return its result.
+
+        Parameters
+        ----------
+        progress
+            Optional callable that receives progress updates (a message or a counter,
+            depending on the analysis).
+        cancel
+            Optional token checked between the stages of the analysis. AnalysisCancelled
+            is raised once it has been cancelled.
+        """
+        raise NotImplementedError
+
+    def run_cached(self, progress: ProgressCallback | None = None,
+                   cancel: CancellationToken | None = None):
+        """
+        Same as ``run()``, through the shared result cache.
+        """
+        cache = result_cache() if self.cacheable else None
+        key = cache.key(type(self).__qualname__, self.cache_parameters()) if cache is not None else None
+
+        if key is not None:
+            result = cache.get(key)
+
+            if result is not None:
+                # The analysis is already in the results database
+                if hasattr(result, "record"):
+                    result.record = None
+                return result
+
+        result = self.run(progress = progress, cancel = cancel)
+
+        if key is not None:
+            cache.put(key, result)
+
+        return result
+
+    def parameters(self) -> dict[str, Any]:
+        """
+        The parameters of the analysis, as stored with its results.
+        """
+        return {name.lstrip("_"): value for name, value in vars(self).items()}
+
+    def cache_parameters(self) -> dict[str, Any]:
+        """
+        The parameters that identify the results of the analysis in the result cache,
+        without the ``execution_parameters``.
+        """
+        return {name: value for name, value in self.parameters().items()
+                if name not in self.execution_parameters}
+
+    def _report_progress(self, progress: ProgressCallback | None, value: Any):
+        if progress is not None:
+            progress(value)
+
+    def _check_cancelled(self, cancel: CancellationToken | None):
+        if cancel is not None:
+            cancel.check()
@@ -0,0 +1,189 @@
+import enum
+import hashlib
+import os
+import pickle
+import threading
+import traceback
+from pathlib import Path
+from typing import Any
+
+import pylinac
+
+from core.configuration.config import SettingsConfig
+
+# Change whenever the result dataclasses change, so older entries are not loaded
+CACHE_VERSION = 1
+
+class NotCacheable(Exception):
+    """
+    Raised while hashing the parameters of an analysis that can't be cached, e.g.
+    because it reads an image from a stream.
+    """
+
+def file_digest(path: str | Path) -> str:
+    file_hash = hashlib.blake2b(digest_size = 20)
+
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(2**20), b""):
+            file_hash.update(chunk)
+
+    return file_hash.hexdigest()
+
+def directory_digest(path: str | Path) -> list[tuple[str, str]]:
+    """
+    The paths (relative to ``path``) and content hashes of the files under ``path``,
+    sorted by path.
+    """
+    files = []
+
+    for root, _, names in os.walk(path):
+        for name in names:
+            file_path = os.path.join(root, name)
+            relative_path = os.path.relpath(file_path, path).replace(os.sep, "/")
+            files.append((relative_path, file_digest(file_path)))
+
+    return sorted(files)
+
+def canonical_value(value: Any) -> Any:
+    """
+    A representation of an analysis parameter that is the same in every session. Paths
+    of existing files are replaced by a hash of their content, and directories by the
+    names and hashes of their files, so a key follows the images rather than their
+    location.
+    """
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+
+    if isinstance(value, (str, Path)):
+        if os.path.isfile(value):
+            return ("file", file_digest(value))
+
+        if os.path.isdir(value):
+            return ("directory", directory_digest(value))
+
+        return str(value)
+
+    if isinstance(value, enum.Enum):
+        return f"{type(value).__name__}.{value.name}"
+
+    if isinstance(value, (list, tuple)):
+        return [canonical_value(item) for item in value]
+
+    if isinstance(value, dict):
+        return sorted((str(key), canonical_value(item)) for key, item in value.items())
+
+    if value is Ellipsis:
+        return "..."
+
+    # Streams and other objects may change without their representation changing
+    raise NotCacheable(f"{type(value).__name__} parameters can't be cached")
+
+class ResultCache:
+    """
+    On-disk cache of analysis results, pickled in one file per key. The least recently
+    used results are deleted once the directory holds more than ``max_bytes``.
+    """
+
+    def __init__(self, directory: str | Path, max_bytes: int = 1024 * 2**20):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def key(self, name: str, parameters: dict[str, Any]) -> str | None:
+        """
+        Key of the analysis ``name`` with ``parameters`` (including its input files), or
+        None if the analysis can't be cached.
+        """
+        try:
+            canonical = canonical_value(parameters)
+        except (NotCacheable, OSError):
+            return None
+
+        key_data = repr((CACHE_VERSION, pylinac.__version__, name, canonical))
+        return hashlib.blake2b(key_data.encode(), digest_size = 20).hexdigest()
+
+    def get(self, key: str):
+        entry = self.directory / f"{key}.pickle"
+
+        try:
+            with entry.open("rb") as file:
+                result = pickle.load(file)
+        except FileNotFoundError:
+            return None
+        except Exception as err:
+            # Written by an incompatible version, or damaged
+            traceback.print_exception(err)
+            entry.unlink(missing_ok = True)
+            return None
+
+        # The modification time orders the entries for eviction
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+
+        return result
+
+    def put(self, key: str, result):
+        entry = self.directory / f"{key}.pickle"
+
+        try:
+            self.directory.mkdir(parents = True, exist_ok = True)
+            temp_entry = entry.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+
+            with temp_entry.open("wb") as file:
+                pickle.dump(result, file, protocol = pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_entry, entry)
+
+        except (OSError, pickle.PicklingError) as err:
+            # The cache only saves time, the result is still returned
+            traceback.print_exception(err)
+            return
+
+        self._evict()
+
+    def clear(self):
+        for entry in self.directory.glob("*.pickle"):
+            entry.unlink(missing_ok = True)
+
+    def size_bytes(self) -> int:
+        return sum(entry.stat().st_size for entry in self.directory.glob("*.pickle"))
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+
+            for entry in self.directory.glob("*.pickle"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry))
+
+            size_bytes = sum(size for _, size, _ in entries)
+
+            for _, size, entry in sorted(entries, key = lambda item: item[0]):
+                if size_bytes <= self.max_bytes:
+                    break
+
+                entry.unlink(missing_ok = True)
+                size_bytes -= size
+
+_result_cache = None
+
+def result_cache() -> ResultCache | None:
+    """
+    The shared result cache, None if it is disabled in the settings.
+    """
+    global _result_cache
+
+    settings = SettingsConfig().getConfig().get("result_cache", {})
+
+    if not settings.get("enabled", True):
+        return None
+
+    if _result_cache is None:
+        directory = settings.get("directory") or Path.home() / ".pybeam_qa" / "results_cache"
+        _result_cache = ResultCache(directory, int(settings.get("max_megabytes", 1024) * 2**20))
+
+    return _result_cache
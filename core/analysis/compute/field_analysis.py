@@ -0,0 +1,596 @@
+import csv
+import inspect
+import io
+import os
+import traceback
+from contextlib import closing
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, BinaryIO, Sequence, Tuple
+
+import numpy as np
+from pydicom.misc import is_dicom
+from pylinac.core.profile import Edge, Interpolation, MultiProfile, Normalization, SingleProfile
+from pylinac.core.exceptions import NotAnalyzed
+from pylinac.field_analysis import Centering, FieldAnalysis, Protocol
+from scipy.ndimage import gaussian_filter1d
+
+from core.analysis.compute.base import (AnalysisCancelled, AnalysisRunner, CancellationToken,
+                                        ProgressCallback)
+from core.analysis.compute.hill import fit_hill_edges
+from core.analysis.compute.process import WorkerPool, pool_workers
+from core.database.results import AnalysisRecord, image_identity
+from core.image.dicom import load_image
+
+class ProfileMetric():
+    """
+    A metric method of a SingleProfile (e.g. ``field_data``) that computes its result
+    once per set of arguments, see memoize_profile_metrics.
+    """
+
+    def __init__(self, profile: SingleProfile, name: str):
+        self.profile = profile
+        self.name = name
+        self.results = {}
+
+    def key(self, *args, **kwargs) -> tuple:
+        # Positional and keyword arguments give the same key
+        method = getattr(type(self.profile), self.name)
+        arguments = inspect.signature(method).bind(self.profile, *args, **kwargs)
+        arguments.apply_defaults()
+
+        return tuple(arguments.arguments.values())[1:]
+
+    def set(self, result: Any, *args, **kwargs):
+        """
+        Use ``result``, computed elsewhere, for the arguments ``args`` and ``kwargs``.
+        """
+        self.results[self.key(*args, **kwargs)] = result
+
+    def __call__(self, *args, **kwargs):
+        method = getattr(type(self.profile), self.name)
+        key = self.key(*args, **kwargs)
+
+        try:
+            if key in self.results:
+                return self.results[key]
+        except TypeError:
+            # Arguments that can't be hashed are not memoized
+            return method(self.profile, *args, **kwargs)
+
+        self.results[key] = method(self.profile, *args, **kwargs)
+
+        return self.results[key]
+
+# The metrics pylinac computes again and again from the same profile: the field data
+# alone finds the field edges, and so fits the Hill functions, on every call
+PROFILE_METRICS = ("field_data", "penumbra", "inflection_data", "fwxm_data",
+                   "beam_center", "geometric_center")
+
+def memoize_profile_metrics(profile: SingleProfile) -> SingleProfile:
+    """
+    Make the metrics of ``profile`` compute their results once per set of arguments.
+    They are set on the profile itself, so the metrics pylinac uses inside the others
+    are memoized too. The profile values must not change afterwards, and the returned
+    results must not be modified since they are shared.
+    """
+    for name in PROFILE_METRICS:
+        setattr(profile, name, ProfileMetric(profile, name))
+
+    return profile
+
+def hill_edge_windows(profile: SingleProfile) -> list[tuple[np.ndarray, np.ndarray]]:
+    """
+    The (x, y) data of the left and right edges of ``profile`` that pylinac fits with Hill
+    functions (see SingleProfile.inflection_data): windows of ``hill_window_ratio`` of
+    the field width around the edges found with the derivative of the profile.
+    """
+    derivative = np.gradient(gaussian_filter1d(profile.values,
+                                               sigma = profile._edge_smoothing_ratio * len(profile.values)))
+    peak_indices, _ = MultiProfile(derivative).find_peaks(threshold = 0.8)
+    valley_indices, _ = MultiProfile(derivative).find_valleys(threshold = 0.8)
+    left_index = profile._x_interp_to_original(peak_indices[0])
+    right_index = profile._x_interp_to_original(valley_indices[-1])
+
+    half_window = int(round(profile._hill_window_ratio * abs(right_index - left_index) / 2))
+    left_x = np.arange(left_index - half_window, left_index + half_window)
+    right_x = np.arange(right_index - half_window, right_index + half_window)
+    left_x = left_x[left_x >= 0]
+    right_x = right_x[right_x < len(derivative)]
+
+    return [(left_x, profile._y_original_to_interp(left_x)),
+            (right_x, profile._y_original_to_interp(right_x))]
+
+def fit_profile_edges(profiles: Sequence[SingleProfile]):
+    """
+    Fit the Hill functions of the edges of all ``profiles`` together (see fit_hill_edges)
+    and give each profile its inflection data, in place of the separate fits of
+    pylinac. The profiles must have memoized metrics and Inflection Hill edges. Profiles
+    whose edges can't be found are left to pylinac, which reports the error.
+    """
+    edges = []
+
+    for profile in profiles:
+        try:
+            edges.append(hill_edge_windows(profile))
+        except (IndexError, ValueError):
+            edges.append(None)
+
+    hills = iter(fit_hill_edges([edge for pair in edges if pair is not None for edge in pair]))
+
+    for profile, pair in zip(profiles, edges):
+        if pair is None:
+            continue
+
+        left_hill, right_hill = next(hills), next(hills)
+        left = left_hill.inflection_idx()
+        right = right_hill.inflection_idx()
+
+        profile.inflection_data.set({"left index (rounded)": left["index (rounded)"],
+                                     "left index (exact)": left["index (exact)"],
+                                     "right index (rounded)": right["index (rounded)"],
+                                     "right index (exact)": right["index (exact)"],
+                                     "left value (@exact)": left_hill.y(left["index (exact)"]),
+                                     "right value (@exact)": right_hill.y(right["index (exact)"]),
+                                     "left Hill params": left_hill.params,
+                                     "right Hill params": right_hill.params})
+
+class FAAnalysis(FieldAnalysis):
+    """
+    Field analysis without any Qt dependencies. The metrics of the profiles are
+    computed once, for the analysis, its results and its plots alike. With Inflection
+    Hill edges, the four edges are fit together (see fit_profile_edges).
+    """
+
+    def __init__(self, path: str | BinaryIO, filter: int | None = None,
+                 image_kwargs: dict | None = None):
+        super().__init__(load_image(path, **(image_kwargs or {})), filter)
+        # The results report the file path, not the loaded image
+        self._path = path
+
+    def _extract_profiles(self, *args, **kwargs):
+        super()._extract_profiles(*args, **kwargs)
+
+        memoize_profile_metrics(self.horiz_profile)
+        memoize_profile_metrics(self.vert_profile)
+
+        if self._edge_detection == Edge.INFLECTION_HILL:
+            fit_profile_edges([self.horiz_profile, self.vert_profile])
+
+    def results(self, as_str=True) -> str:
+        """Get the results of the analysis.
+
+        Parameters
+        ----------
+        as_str
+            If True, return a simple string. If False, return a list of each line of text.
+        """
+        if not self._is_analyzed:
+            raise NotAnalyzed("Image is not analyzed yet. Use analyze() first.")
+
+        results = [
+            "Field Analysis Results",
+            "-----" * 10,
+            f"File: {self._path}",
+            f"Protocol: {self._protocol.name}",
+        ]
+        if not self._from_device:
+            results += [
+                f"Centering method: {self._centering.value}",
+            ]
+        results += [
+            f"Normalization method: {self.horiz_profile._norm_method.value}",
+            f"Interpolation: {self.horiz_profile._interp_method.value}",
+            f"Edge detection method: {self.horiz_profile._edge_method.value}",
+            "",
+            f"Penumbra width ({self._penumbra[0]}/{self._penumbra[1]}):",
+            "-----" * 10,
+            f"Left: {self._results['left_penumbra_mm']:3.1f} mm",
+            f"Right: {self._results['right_penumbra_mm']:3.1f} mm",
+            f"Top: {self._results['top_penumbra_mm']:3.1f} mm",
+            f"Bottom: {self._results['bottom_penumbra_mm']:3.1f} mm",
+            "",
+        ]
+        if self._edge_detection == Edge.INFLECTION_HILL:
+            results += [
+                "Penumbra gradients:",
+                "-----" * 10,
+                f"Left gradient: {self._results['left_penumbra_percent_mm']:3.2f}% /mm",
+                f"Right gradient: {self._results['right_penumbra_percent_mm']:3.2f}% /mm",
+                f"Top gradient: {self._results['top_penumbra_percent_mm']:3.2f}% /mm",
+                f"Bottom gradient: {self._results['bottom_penumbra_percent_mm']:3.2f}% /mm",
+                "",
+            ]
+        results += [
+            "Field Size:",
+            "-----" * 10,
+            f"Horizontal: {self._results['field_size_horizontal_mm']:3.1f} mm",
+            f"Vertical: {self._results['field_size_vertical_mm']:3.1f} mm",
+            "",
+            "CAX to edge distances:",
+            "-----" * 10,
+            f"CAX -> Top edge: {self._results['cax_to_top_mm']:3.1f} mm",
+            f"CAX -> Bottom edge: {self._results['cax_to_bottom_mm']:3.1f} mm",
+            f"CAX -> Left edge: {self._results['cax_to_left_mm']:3.1f} mm",
+            f"CAX -> Right edge: {self._results['cax_to_right_mm']:3.1f} mm",
+            "",
+        ]
+        if not self._from_device:
+            results += [
+                "Central ROI stats:",
+                "-----" * 10,
+                f"Mean: {self.central_roi.mean:3.3f}",
+                f"Max: {self.central_roi.max:3.3f}",
+                f"Min: {self.central_roi.min:3.3f}",
+                f"Standard deviation: {self.central_roi.std:3.3f}",
+                "",
+            ]
+        if self._is_FFF:
+            results += [
+                "'Top' vertical distance from CAX: {:3.1f} mm".format(
+                    self._results["top_vertical_distance_from_cax_mm"]
+                ),
+                "'Top' horizontal distance from CAX: {:3.1f} mm".format(
+                    self._results["top_horizontal_distance_from_cax_mm"]
+                ),
+                "'Top' vertical distance from beam center: {:3.1f} mm".format(
+                    self._results["top_vertical_distance_from_beam_center_mm"]
+                ),
+                "'Top' horizontal distance from beam center: {:3.1f} mm".format(
+                    self._results["top_horizontal_distance_from_beam_center_mm"]
+                ),
+                "",
+            ]
+        results += [
+            f"Top slope: {self._results['top_slope_percent_mm']:3.3f}% /mm",
+            f"Bottom slope: {self._results['bottom_slope_percent_mm']:3.3f}% /mm",
+            f"Left slope: {self._results['left_slope_percent_mm']:3.3f}% /mm",
+            f"Right slope: {self._results['right_slope_percent_mm']:3.3f}% /mm",
+            "",
+            "Protocol data:",
+            "-----" * 10,
+        ]
+
+        for name, item in self._protocol.value.items():
+            results.append(
+                f"Vertical {name}: {self._extra_results[name + '_vertical']:3.3f}{item['unit']}"
+            )
+            results.append(
+                f"Horizontal {name}: {self._extra_results[name + '_horizontal']:3.3f}{item['unit']}"
+            )
+            results.append("")
+
+        if as_str:
+            results = "\n".join(result for result in results)
+        return results
+
+    def get_publishable_results(self) -> dict:
+        results = {}
+
+        results[f"Penumbra widths ({self._penumbra[0]}/{self._penumbra[1]}):"] = [
+            ["Left width", f"{self._results['left_penumbra_mm']:3.1f} mm"],
+            ["Right width", f"{self._results['right_penumbra_mm']:3.1f} mm"],
+            ["Top width", f"{self._results['top_penumbra_mm']:3.1f} mm"],
+            ["Bottom width", f"{self._results['bottom_penumbra_mm']:3.1f} mm"]
+        ]
+
+        if self._edge_detection == Edge.INFLECTION_HILL:
+            
+            results["Penumbra gradients:"] = [
+                ["Left gradient",f"{self._results['left_penumbra_percent_mm']:3.2f}% /mm"],
+                ["Right gradient", f"{self._results['right_penumbra_percent_mm']:3.2f}% /mm"],
+                ["Top gradient", f"{self._results['top_penumbra_percent_mm']:3.2f}% /mm"],
+                ["Bottom gradient", f"{self._results['bottom_penumbra_percent_mm']:3.2f}% /mm"],
+            ]
+        
+        results["Field Size:"] = [
+            ["Horizontal", f"{self._results['field_size_horizontal_mm']:3.1f} mm"],
+            ["Vertical", f"{self._results['field_size_vertical_mm']:3.1f} mm"]
+        ]
+
+        results["CAX to edge distances:"] = [
+            ["CAX to top edge", f"{self._results['cax_to_top_mm']:3.1f} mm"],
+            ["CAX to bottom edge", f"{self._results['cax_to_bottom_mm']:3.1f} mm"],
+            ["CAX to left edge", f"{self._results['cax_to_left_mm']:3.1f} mm"],
+            ["CAX to right edge", f"{self._results['cax_to_right_mm']:3.1f} mm"],
+        ]
+
+        if not self._from_device:
+            results["Central ROI statistics:"] = [
+                ["Mean", f"{self.central_roi.mean:3.3f}"],
+                ["Max", f"{self.central_roi.max:3.3f}"],
+                ["Min", f"{self.central_roi.min:3.3f}"],
+                ["Standard deviation", f"{self.central_roi.std:3.3f}"],
+            ]
+
+        if self._is_FFF:
+            results["Central ROI statistics:"].extend([
+                ["", ""],
+                ["Top vertical distance from CAX", "{:3.1f} mm".format(
+                    self._results["top_vertical_distance_from_cax_mm"]
+                )],
+                ["Top horizontal distance from CAX", "{:3.1f} mm".format(
+                    self._results["top_horizontal_distance_from_cax_mm"]
+                )],
+                ["Top vertical distance from beam center", "{:3.1f} mm".format(
+                    self._results["top_vertical_distance_from_beam_center_mm"]
+                )],
+                ["Top horizontal distance from beam center", "{:3.1f} mm".format(
+                    self._results["top_horizontal_distance_from_beam_center_mm"]
+                )],
+            ])
+
+        results["Central ROI statistics:"].extend([
+            ["", ""],
+            ["Top slope", f"{self._results['top_slope_percent_mm']:3.3f}% /mm"],
+            ["Bottom slope", f"{self._results['bottom_slope_percent_mm']:3.3f}% /mm"],
+            ["Left slope", f"{self._results['left_slope_percent_mm']:3.3f}% /mm"],
+            ["Right slope", f"{self._results['right_slope_percent_mm']:3.3f}% /mm"]
+        ])
+
+        results["Protocol data:"] = []
+
+        for name, item in self._protocol.value.items():
+            results["Protocol data:"].extend([
+                [f"Vertical {name}", f"{self._extra_results[name + '_vertical']:3.3f}{item['unit']}"],
+                [f"Horizontal {name}", f"{self._extra_results[name + '_horizontal']:3.3f}{item['unit']}"]
+            ])
+
+        return results
+
+
+    def get_publishable_plots(self) -> list[io.BytesIO]:
+        # set files for the vertical and horizontal profile plots
+        # setting figsize = (4.5, 4.5) seems to do wonders on the produced pdf
+        # TODO code does not apply for device analysis
+        files = [io.BytesIO(), io.BytesIO()]
+        figs, names = self.plot_analyzed_image(
+            show = False, split_plots=True, figsize = (4.5 ,4.5)
+        )
+
+        figs[1].savefig(files[0], format = "pdf") # vertical profile
+        figs[2].savefig(files[1], format = "pdf") # horizontal profile
+
+        return files
+
+@dataclass
+class FieldAnalysisResult:
+    summary_text: str
+    field_analysis: FAAnalysis
+    record: AnalysisRecord | None = None
+
+class FieldAnalysisRunner(AnalysisRunner):
+
+    def __init__(self,
+                 path: str,
+                 protocol: Protocol = Protocol.VARIAN,
+                 centering: Centering | str = Centering.BEAM_CENTER,
+                 vert_position: float = 0.5,
+                 horiz_position: float = 0.5, 
+                 vert_width: float = 0, 
+                 horiz_width: float = 0, 
+                 in_field_ratio: float = 0.8,
+                 slope_exclusion_ratio: float = 0.2, 
+                 invert: bool = False, 
+                 is_FFF: bool = False, 
+                 penumbra: Tuple[float, float] = ..., 
+                 interpolation: Interpolation | str | None = Interpolation.LINEAR, 
+                 interpolation_resolution_mm: float = 0.1, 
+                 ground: bool = True,
+                 normalization_method: Normalization | str = Normalization.BEAM_CENTER, 
+                 edge_detection_method: Edge | str = Edge.INFLECTION_DERIVATIVE, 
+                 edge_smoothing_ratio: float = 0.003, 
+                 hill_window_ratio: float = 0.15):
+        
+        self._path = path
+        self._protocol = protocol
+        self._centering = centering
+        self._vert_position = vert_position
+        self._horiz_position = horiz_position
+        self._vert_width = vert_width
+        self._horiz_width = horiz_width
+        self._in_field_ratio = in_field_ratio
+        self._slope_exclusion_ratio = slope_exclusion_ratio
+        self._invert = invert
+        self._is_FFF = is_FFF
+        self._penumbra = penumbra
+        self._interpolation = interpolation
+        self._interpolation_res_mm = interpolation_resolution_mm
+        self._ground = ground
+        self._normalization_method = normalization_method
+        self._edge_detection_method = edge_detection_method
+        self._edge_smoothing_ratio = edge_smoothing_ratio
+        self._hill_window_ratio = hill_window_ratio
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def run(self, progress: ProgressCallback | None = None,
+            cancel: CancellationToken | None = None) -> FieldAnalysisResult:
+        self._report_progress(progress, "Loading field image")
+        fa = FAAnalysis(self._path)
+
+        self._check_cancelled(cancel)
+        self._report_progress(progress, "Analyzing field")
+        fa.analyze(protocol = self._protocol,
+                   centering = self._centering,
+                   vert_position = self._vert_position,
+                   horiz_position = self._horiz_position,
+                   vert_width = self._vert_width,
+                   horiz_width = self._horiz_width,
+                   in_field_ratio = self._in_field_ratio,
+                   slope_exclusion_ratio = self._slope_exclusion_ratio,
+                   invert = self._invert,
+                   is_FFF = self._is_FFF,
+                   interpolation = self._interpolation,
+                   interpolation_resolution_mm = self._interpolation_res_mm,
+                   normalization_method = self._normalization_method,
+                   ground = self._ground,
+                   edge_detection_method = self._edge_detection_method,
+                   edge_smoothing_ratio = self._edge_smoothing_ratio,
+                   hill_window_ratio = self._hill_window_ratio)
+
+        record = AnalysisRecord.from_results("field_analysis", fa.results_data(as_dict = True),
+                                             getattr(fa.image, "metadata", None),
+                                             parameters = self.parameters())
+
+        return FieldAnalysisResult(summary_text = fa.results(), field_analysis = fa, record = record)
+
+# Columns of the combined table of a batch, with the keys of their values in FieldBatchEntry.values
+FIELD_BATCH_COLUMNS = (("Field size X (mm)", "field_size_horizontal_mm"),
+                       ("Field size Y (mm)", "field_size_vertical_mm"),
+                       ("Flatness X (%)", "flatness_horizontal"),
+                       ("Flatness Y (%)", "flatness_vertical"),
+                       ("Symmetry X (%)", "symmetry_horizontal"),
+                       ("Symmetry Y (%)", "symmetry_vertical"),
+                       ("Left penumbra (mm)", "left_penumbra_mm"),
+                       ("Right penumbra (mm)", "right_penumbra_mm"),
+                       ("Top penumbra (mm)", "top_penumbra_mm"),
+                       ("Bottom penumbra (mm)", "bottom_penumbra_mm"))
+
+@dataclass
+class FieldBatchEntry:
+    """
+    One image of a batch. ``values`` hold the results of its analysis, ``error`` is set
+    instead when the image could not be analyzed.
+    """
+    path: str
+    linac: str | None = None
+    beam: str | None = None
+    values: dict[str, Any] = field(default_factory = dict)
+    record: AnalysisRecord | None = None
+    error: str | None = None
+
+    @property
+    def filename(self) -> str:
+        return os.path.basename(self.path)
+
+@dataclass
+class FieldBatchResult:
+    entries: list[FieldBatchEntry] = field(default_factory = list)
+
+    @property
+    def failed(self) -> list[FieldBatchEntry]:
+        return [entry for entry in self.entries if entry.error is not None]
+
+    def table(self) -> tuple[list[str], list[list[str]]]:
+        """
+        The headers and rows of the combined results table, one row per image. The values
+        of an image that failed are empty and its error is in the last column.
+        """
+        headers = ["File", "Treatment unit", "Beam",
+                   *(header for header, _ in FIELD_BATCH_COLUMNS), "Error"]
+        rows = []
+
+        for entry in self.entries:
+            values = [f"{entry.values[key]:.2f}" if key in entry.values else ""
+                      for _, key in FIELD_BATCH_COLUMNS]
+            rows.append([entry.filename, entry.linac or "", entry.beam or "", *values, entry.error or ""])
+
+        return headers, rows
+
+    def save_csv(self, filename: str):
+        headers, rows = self.table()
+
+        with open(filename, "w", newline = "", encoding = "utf-8") as file:
+            writer = csv.writer(file)
+            writer.writerow(headers)
+            writer.writerows(rows)
+
+def field_batch_paths(paths: str | Sequence[str]) -> list[str]:
+    """
+    The images of a batch: ``paths`` as they are, or the DICOM files found in the folder
+    ``paths`` and its subfolders, sorted by path.
+    """
+    if isinstance(paths, (str, Path)):
+        return [str(path) for path in sorted(Path(paths).rglob("*"))
+                if path.is_file() and is_dicom(str(path))]
+
+    return [str(path) for path in paths]
+
+# Pool for the images of a batch, kept between batches of the same process so the
+# worker processes only pay the pylinac import once
+_batch_pool = WorkerPool()
+
+def _analyze_batch_image(runner: FieldAnalysisRunner,
+                         cancel: CancellationToken | None = None) -> FieldBatchEntry:
+    entry = FieldBatchEntry(runner.path)
+
+    try:
+        result = runner.run_cached(cancel = cancel)
+    except AnalysisCancelled:
+        raise
+    except Exception as err:
+        traceback.print_exception(err)
+        entry.error = str(err) or type(err).__name__
+        return entry
+
+    # Only the values travel back from a worker process, not the analysis
+    fa = result.field_analysis
+    results_data = fa.results_data(as_dict = True)
+    entry.values = {**results_data, **results_data["protocol_results"]}
+    entry.linac, entry.beam, _ = image_identity(getattr(fa.image, "metadata", None))
+    entry.record = result.record
+
+    return entry
+
+class FieldAnalysisBatchRunner(AnalysisRunner):
+    """
+    Analyzes many field images with the same parameters (the keyword arguments of
+    FieldAnalysisRunner), concurrently in a pool of worker processes. ``paths`` is a list
+    of images or a folder (see field_batch_paths). An image that fails is listed as such
+    in the result and does not stop the others.
+    """
+
+    cacheable = False
+
+    def __init__(self, paths: str | Sequence[str], max_workers: int | None = None, **kwargs):
+        self._paths = paths
+        self._max_workers = max_workers
+        self._kwargs = kwargs
+
+    def run(self, progress: ProgressCallback | None = None,
+            cancel: CancellationToken | None = None) -> FieldBatchResult:
+        self._report_progress(progress, "Finding images")
+        runners = [FieldAnalysisRunner(path, **self._kwargs) for path in field_batch_paths(self._paths)]
+
+        if not runners:
+            raise ValueError("No DICOM images to analyze")
+
+        max_workers = min(pool_workers(self._max_workers), len(runners))
+        entries = []
+
+        if max_workers <= 1:
+            for count, runner in enumerate(runners, start = 1):
+                self._check_cancelled(cancel)
+                entries.append(_analyze_batch_image(runner, cancel))
+                self._report_progress(progress, f"{count}/{len(runners)} images")
+
+        else:
+            self._check_cancelled(cancel)
+            entries = self._analyze_in_pool(runners, max_workers, progress, cancel)
+
+        return FieldBatchResult(entries)
+
+    def _analyze_in_pool(self, runners: list[FieldAnalysisRunner], max_workers: int,
+                         progress: ProgressCallback | None,
+                         cancel: CancellationToken | None) -> list[FieldBatchEntry]:
+        entries = [None] * len(runners)
+        results = _batch_pool.run_all(max_workers, _analyze_batch_image,
+                                      [(runner,) for runner in runners])
+
+        with closing(results):
+            for count, (index, future) in enumerate(results, start = 1):
+                try:
+                    entries[index] = future.result()
+                except Exception as err:
+                    # The image killed its worker process on its own (e.g. out of memory)
+                    traceback.print_exception(err)
+                    entries[index] = FieldBatchEntry(runners[index].path,
+                                                     error = str(err) or type(err).__name__)
+
+                self._check_cancelled(cancel)
+                self._report_progress(progress, f"{count}/{len(runners)} images")
+
+        return entries
@@ -0,0 +1,123 @@
+from typing import Sequence
+
+import numpy as np
+from pylinac.core.hill import Hill
+
+# Same convergence tolerances as scipy's curve_fit
+HILL_FTOL = 1.49012e-8
+HILL_XTOL = 1.49012e-8
+
+def hill_initial_guess(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """
+    Starting parameters (low, high, inflection, slope) of the Hill fit of an edge, with
+    the inflection at the centre of the window (the derivative edge the window is built
+    around) and the slope of the data there. The slope is positive for a rising edge
+    and negative for a falling one.
+    """
+    low, high = np.min(y), np.max(y)
+    inflection = np.median(x)
+    gradient = np.interp(inflection, x, np.gradient(y, x))
+
+    # At its inflection, a Hill function rises by (high - low) * slope / (4 * inflection)
+    slope = 4 * inflection * gradient / (high - low) if high > low else 0.0
+
+    return np.array([low, high, inflection, slope])
+
+def _hill_values(params: np.ndarray, x: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    low, high, inflection, slope = (params[:, i, None] for i in range(4))
+
+    with np.errstate(all = "ignore"):
+        log_ratio = np.log(inflection / x)
+        power = np.exp(np.clip(slope * log_ratio, -700, 700))
+        values = low + (high - low) / (1 + power)
+
+    return values, power, log_ratio
+
+def _hill_costs(params: np.ndarray, x: np.ndarray, y: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    values, _, _ = _hill_values(params, x)
+    costs = np.sum((weights * (values - y))**2, axis = 1)
+
+    # Steps that leave the domain of the Hill function are never taken
+    costs[~np.isfinite(costs) | (params[:, 2] <= 0)] = np.inf
+
+    return costs
+
+def fit_hill_edges(edges: Sequence[tuple[np.ndarray, np.ndarray]],
+                   max_iterations: int = 100) -> list[Hill]:
+    """
+    Fit a Hill function to each edge, given as the (x, y) data of its window, like
+    pylinac's Hill.fit but as one least-squares problem: the Levenberg-Marquardt steps of
+    all the edges are computed together, on windows padded to the same length. Edges
+    start from hill_initial_guess; those that don't converge are fit again one by one
+    with Hill.fit.
+    """
+    if not edges:
+        return []
+
+    count = len(edges)
+    length = max(len(x) for x, _ in edges)
+
+    # Padded points have no weight, and x = 1 keeps the model finite there
+    x = np.ones((count, length))
+    y = np.zeros((count, length))
+    weights = np.zeros((count, length))
+
+    for index, (x_data, y_data) in enumerate(edges):
+        x[index, :len(x_data)] = x_data
+        y[index, :len(y_data)] = y_data
+        weights[index, :len(x_data)] = 1
+
+    params = np.array([hill_initial_guess(np.asarray(x_data, float), np.asarray(y_data, float))
+                       for x_data, y_data in edges])
+    costs = _hill_costs(params, x, y, weights)
+    damping = np.full(count, 1e-3)
+    active = np.isfinite(costs)
+    converged = np.zeros(count, bool)
+
+    for _ in range(max_iterations):
+        if not active.any():
+            break
+
+        values, power, log_ratio = _hill_values(params, x)
+        low, high, inflection, slope = (params[:, i, None] for i in range(4))
+        fraction = 1 / (1 + power)
+        falloff = (high - low) * power * fraction**2
+
+        jacobian = np.stack([1 - fraction, fraction, -falloff * slope / inflection,
+                             -falloff * log_ratio], axis = -1) * weights[..., None]
+        residuals = weights * (values - y)
+
+        transposed = jacobian.transpose(0, 2, 1)
+        normal = transposed @ jacobian
+        gradient = (transposed @ residuals[..., None])[..., 0]
+
+        # Marquardt's scaling of the damping by the diagonal of the normal matrix
+        diagonal = np.maximum(np.einsum("kii->ki", normal), 1e-12)
+        damped = normal + np.eye(4) * (damping[:, None] * diagonal)[:, :, None]
+
+        try:
+            steps = -np.linalg.solve(damped, gradient[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            break
+
+        candidates = params + steps
+        candidate_costs = _hill_costs(candidates, x, y, weights)
+        improved = active & (candidate_costs < costs)
+
+        small_step = np.all(np.abs(steps) <= HILL_XTOL * (np.abs(params) + HILL_XTOL), axis = 1)
+        converged |= improved & ((costs - candidate_costs <= HILL_FTOL * costs) | small_step)
+
+        params = np.where(improved[:, None], candidates, params)
+        costs = np.where(improved, candidate_costs, costs)
+        damping = np.where(improved, damping / 10, damping * 10)
+        active &= ~converged & (damping < 1e16)
+
+    hills = []
+
+    for index, (x_data, y_data) in enumerate(edges):
+        if converged[index] and np.all(np.isfinite(params[index])):
+            hills.append(Hill.from_params(params[index].copy()))
+        else:
+            hills.append(Hill.fit(x_data, y_data))
+
+    return hills
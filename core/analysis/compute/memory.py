@@ -0,0 +1,106 @@
+import os
+import sys
+import threading
+
+def current_rss() -> int | None:
+    """
+    Resident set size of the current process in bytes, or None if it can't be read on
+    this platform.
+    """
+    if sys.platform.startswith("linux"):
+        try:
+            with open("/proc/self/statm", encoding="ascii") as file:
+                return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError):
+            return None
+
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD),
+                        ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t),
+                        ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t),
+                        ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+
+    return None
+
+def max_rss() -> int | None:
+    """
+    Largest resident set size of the current process since it started, in bytes.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes, except on macOS
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+class PeakRSSMonitor():
+    """
+    Samples the resident set size of the current process in a background thread, to
+    find its peak while some work runs::
+
+        with PeakRSSMonitor() as monitor:
+            result = runner.run()
+        monitor.peak_rss
+
+    The whole process is measured, which includes other analyses running in threads of
+    the same process. Short spikes between two samples can be missed; where the RSS
+    can't be sampled, the peak of the process lifetime is used instead.
+    """
+
+    INTERVAL_S = 0.02
+
+    def __init__(self):
+        self.peak_rss: int | None = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self) -> "PeakRSSMonitor":
+        self.peak_rss = current_rss()
+
+        if self.peak_rss is not None:
+            self._thread = threading.Thread(target = self._sample, name = "peak-rss", daemon = True)
+            self._thread.start()
+
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._thread is None:
+            self.peak_rss = max_rss()
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self._update(current_rss())
+
+    def _sample(self):
+        while not self._stop.wait(self.INTERVAL_S):
+            self._update(current_rss())
+
+    def _update(self, rss: int | None):
+        if rss is not None and rss > self.peak_rss:
+            self.peak_rss = rss
+
+def format_bytes(size: int | None) -> str:
+    if size is None:
+        return ""
+
+    return f"{size / 2**20:.0f} MB"
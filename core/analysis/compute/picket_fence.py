@@ -0,0 +1,572 @@
+import io
+from collections import defaultdict
+from dataclasses import dataclass
+from pylinac.core.image_generator.simulators import Simulator
+from pylinac.core.image_generator.layers import (FilteredFieldLayer,
+                                                 FilterFreeFieldLayer,
+                                                 PerfectFieldLayer, 
+                                                 Layer)
+from pylinac.picketfence import PicketFence, PFDicomImage, MLC, MLCArrangement, Orientation
+from pylinac.core.image import get_dicom_cmap
+
+import matplotlib.pyplot as plt
+import numpy as np
+from scipy import ndimage
+from pathlib import Path
+from typing import BinaryIO, Optional, Union, Sequence
+
+from core.analysis.compute.base import (AnalysisRunner, AnalysisCancelled,
+                                        CancellationToken, ProgressCallback)
+from core.analysis.compute.plotting import (add_merged_lines, publishable_plot_settings,
+                                            segment_points)
+from core.database.results import AnalysisRecord
+from core.image.dicom import dicom_cache
+
+@dataclass
+class PFMeasurements:
+    """
+    Array-backed table of the MLC measurements of a picket fence analysis. There is one
+    row per leaf pair, or one per leaf when the leaves are analyzed separately, in the
+    order of ``PicketFence.mlc_meas``. Per-leaf values are grouped reductions over the
+    rows, so they don't need a scan of all measurements for every leaf.
+    """
+
+    meas_index: np.ndarray   # index of the measurement in mlc_meas
+    leaf_num: np.ndarray
+    leaf_name: np.ndarray    # leaf number, or bank + leaf number for separate leaves
+    picket: np.ndarray
+    error: np.ndarray        # mm
+    position: np.ndarray     # MLC position along the leaf travel (pixels)
+    leaf_center: np.ndarray  # leaf centre across the leaf travel (pixels)
+    marker_width: np.ndarray # width of the analyzed part of the leaf (pixels)
+    passed: np.ndarray
+    passed_action: np.ndarray
+
+    def __post_init__(self):
+        # Rows sorted by leaf and the start of each leaf's group, shared by all reductions
+        self._order = np.argsort(self.leaf_num, kind = "stable")
+        self._leaves, self._starts, self._inverse, self._counts = np.unique(
+            self.leaf_num[self._order], return_index = True, return_inverse = True,
+            return_counts = True)
+
+    @classmethod
+    def from_mlc_meas(cls, mlc_meas: list, tolerance: float,
+                      action_tolerance: float | None = None) -> "PFMeasurements":
+        rows = []
+
+        for index, meas in enumerate(mlc_meas):
+            # MLCValue.error fits the picket again on every access, read it only once
+            for tip, error in enumerate(meas.error):
+                rows.append((index, meas.leaf_num, meas.full_leaf_nums[tip], meas.picket_num,
+                             error, meas.position[tip], meas.leaf_center_px,
+                             meas.leaf_width_px * meas._analysis_ratio))
+
+        meas_index, leaf_num, leaf_name, picket, error, position, leaf_center, marker_width = (
+            zip(*rows) if rows else [()] * 8)
+        error = np.array(error, dtype = float)
+
+        if action_tolerance is None:
+            passed_action = np.ones(len(error), dtype = bool)
+        else:
+            passed_action = np.abs(error) < action_tolerance
+
+        return cls(meas_index = np.array(meas_index, dtype = int),
+                   leaf_num = np.array(leaf_num, dtype = int),
+                   leaf_name = np.array(leaf_name, dtype = object),
+                   picket = np.array(picket, dtype = int),
+                   error = error,
+                   position = np.array(position, dtype = float),
+                   leaf_center = np.array(leaf_center, dtype = float),
+                   marker_width = np.array(marker_width, dtype = float),
+                   passed = np.abs(error) < tolerance,
+                   passed_action = passed_action)
+
+    def leaf_numbers(self) -> np.ndarray:
+        """
+        The measured leaf numbers, sorted.
+        """
+        return self._leaves
+
+    def leaf_position(self) -> np.ndarray:
+        """
+        The centre of each leaf across the leaf travel (pixels).
+        """
+        return np.add.reduceat(self.leaf_center[self._order], self._starts) / self._counts
+
+    def leaf_max_abs_error(self) -> np.ndarray:
+        return np.maximum.reduceat(np.abs(self.error[self._order]), self._starts)
+
+    def leaf_std_error(self) -> np.ndarray:
+        errors = self.error[self._order]
+        mean = np.add.reduceat(errors, self._starts) / self._counts
+        deviation = errors - mean[self._inverse]
+
+        return np.sqrt(np.add.reduceat(deviation**2, self._starts) / self._counts)
+
+    def leaf_median_abs_error(self) -> np.ndarray:
+        groups = np.split(np.abs(self.error[self._order]), self._starts[1:])
+        return np.array([np.median(group) for group in groups])
+
+@dataclass
+class PFLeafProfiles:
+    """
+    Median pixel profiles across the pickets of all MLC measurements, stored as rows
+    of one NaN-padded array in the order of ``PicketFence.mlc_meas``. A (leaf name,
+    picket) index gives the row of a measurement without searching the measurements.
+    """
+
+    index: dict[tuple[int | str, int], int]
+    values: np.ndarray   # one profile per measurement, padded with NaN
+    lengths: np.ndarray  # number of values of each profile
+    offsets: np.ndarray  # pixel position of the first value of each profile
+
+    @classmethod
+    def from_mlc_meas(cls, mlc_meas: list) -> "PFLeafProfiles":
+        index = {(leaf, meas.picket_num): row
+                 for row, meas in enumerate(mlc_meas) for leaf in meas.full_leaf_nums}
+
+        # The profile runs across the picket, i.e. along the leaf travel
+        axes = [0 if meas._orientation == Orientation.UP_DOWN else 1 for meas in mlc_meas]
+        lengths = np.array([meas._image_window.shape[1 - axis]
+                            for meas, axis in zip(mlc_meas, axes)], dtype = int)
+        offsets = np.array([max(meas._approximate_idx - meas._spacing / 2, 0)
+                            for meas in mlc_meas], dtype = float)
+
+        values = np.full((len(mlc_meas), lengths.max(initial = 0)), np.nan, dtype = np.float32)
+
+        # Windows of the same shape are stacked so their medians take a single call
+        same_shape = defaultdict(list)
+        for row, (meas, axis) in enumerate(zip(mlc_meas, axes)):
+            same_shape[(meas._image_window.shape, axis)].append(row)
+
+        for (_, axis), rows in same_shape.items():
+            windows = np.stack([mlc_meas[row]._image_window for row in rows])
+            values[rows, :lengths[rows[0]]] = np.median(windows, axis = axis + 1)
+
+        return cls(index, values, lengths, offsets)
+
+    def profile(self, leaf: int | str, picket: int) -> tuple[int, np.ndarray, np.ndarray]:
+        """
+        The measurement row, pixel positions and median pixel values of a leaf profile.
+        """
+        row = self.index[(leaf, picket)]
+        length = self.lengths[row]
+
+        return row, np.arange(length) + self.offsets[row], self.values[row, :length]
+
+class PFCachedImage(PFDicomImage):
+    """
+    PFDicomImage decoded through the shared DICOM image cache.
+    """
+
+    def __init__(self, path: str | Path | BinaryIO, **kwargs):
+        crop_mm = kwargs.pop("crop_mm", 3)
+        self._central_axis = kwargs.pop("central_axis", None)
+        dicom_cache().load_into(self, path, **kwargs)
+
+        self._prepare(crop_mm)
+
+    def _prepare(self, crop_mm: int):
+        # Same post-processing as PFDicomImage
+        self.crop(pixels = int(round(crop_mm * self.dpmm)))
+        self._check_for_noise()
+        self.check_inversion(box_size = 10, position = (0.01, 0.01))
+
+class PFMergedImage(PFCachedImage):
+    """
+    Picket fence image superimposed in memory from several DICOM images, like
+    ``image.load_multiples`` with the mean method. The first image provides the
+    metadata. Each image is stretched to the range of ``dtype`` and added to a single
+    preallocated array, so only one source image is held in memory at a time.
+    """
+
+    def __init__(self, paths: Sequence[str | Path], dtype: np.dtype = np.uint16, **kwargs):
+        crop_mm = kwargs.pop("crop_mm", 3)
+        self._central_axis = kwargs.pop("central_axis", None)
+        dicom_cache().load_into(self, paths[0], **kwargs)
+
+        merged = np.zeros(self.shape, dtype = float)
+        _add_stretched(merged, self.array, dtype)
+
+        for path in paths[1:]:
+            frame = dicom_cache().load(path, raw_pixels = self._raw_pixels)
+
+            if frame.shape != self.shape:
+                raise ValueError("Images were not the same shape")
+
+            _add_stretched(merged, frame.array, dtype)
+            del frame
+
+        merged /= len(paths)
+        self.array = merged
+
+        self._prepare(crop_mm)
+
+def _add_stretched(merged: np.ndarray, array: np.ndarray, dtype: np.dtype):
+    # Stretch the array over the full range of dtype, as load_multiples does. A uniform
+    # image stretches to zeros there (a NaN cast to the integer dtype), so it adds nothing
+    low, high = array.min(), array.max()
+
+    if high > low:
+        merged += ((array - low) / (high - low) * np.iinfo(dtype).max).astype(dtype)
+
+class PFAnalysis(PicketFence):
+    """
+    Picket fence analysis without any Qt dependencies. Images are decoded through the
+    shared DICOM cache and a list of files is combined in memory into a single image
+    (see PFMergedImage) before the analysis.
+    """
+
+    def __init__(self, filename: Union[str, list[str], Path, BinaryIO],
+                 filter: int | None = None,
+                 log: str | None = None,
+                 use_filename: bool = False,
+                 mlc: Union[MLC, MLCArrangement, str] = MLC.MILLENNIUM,
+                 crop_mm: int = 3,
+                 image_kwargs: Optional[dict] = None):
+
+        # MLC members hold MLCArrangement objects and cannot be unpickled in another
+        # process, so keep the MLC by name
+        if isinstance(mlc, MLC):
+            mlc = mlc.value["name"]
+
+        self.mlc_type = mlc
+        self._cancel = None
+        self._measurements = None
+        self._leaf_profiles = None
+
+        # Same loading steps as PicketFence.__init__, with the image decoded through the
+        # shared cache. The log is loaded by PicketFence once the image is ready.
+        image_type = PFMergedImage if isinstance(filename, list) else PFCachedImage
+        self.image = image_type(filename, use_filenames = use_filename,
+                                crop_mm = crop_mm, **(image_kwargs or {}))
+
+        if isinstance(filter, int):
+            self.image.filter(size = filter)
+        self.image.ground()
+        self.image.normalize()
+
+        super().__init__(None, log = log, mlc = mlc)
+
+    def analyze(self, *args, cancel: CancellationToken | None = None, **kwargs):
+        """
+        Analyze the picket fence image. If a cancellation token is given, it is checked
+        once the pickets are found and again before each leaf row is measured.
+        """
+        # The token is only needed while analyzing and must not be pickled with the results
+        self._cancel = cancel
+
+        try:
+            super().analyze(*args, **kwargs)
+        finally:
+            self._cancel = None
+
+        self._measurements = PFMeasurements.from_mlc_meas(self.mlc_meas, self.tolerance,
+                                                          self.action_tolerance)
+        self._leaf_profiles = PFLeafProfiles.from_mlc_meas(self.mlc_meas)
+
+    @property
+    def measurements(self) -> PFMeasurements:
+        """
+        Table of the MLC measurements, used for all error statistics.
+        """
+        if self._measurements is None:
+            self._measurements = PFMeasurements.from_mlc_meas(self.mlc_meas, self.tolerance,
+                                                              self.action_tolerance)
+
+        return self._measurements
+
+    @property
+    def leaf_profiles(self) -> PFLeafProfiles:
+        """
+        Median profiles of all MLC measurements, indexed by leaf and picket.
+        """
+        if self._leaf_profiles is None:
+            self._leaf_profiles = PFLeafProfiles.from_mlc_meas(self.mlc_meas)
+
+        return self._leaf_profiles
+
+    def _flattened_errors(self) -> list[float]:
+        return self.measurements.error.tolist()
+
+    def failed_leaves(self) -> list[int] | list[str]:
+        """
+        A list of the failed leaves. Either the leaf number or the bank+leaf number if
+        using separate leaves.
+        """
+        if not self._is_analyzed:
+            raise ValueError(
+                "It appears the PF image has not been analyzed yet. Use .analyze() first."
+            )
+
+        # pylinac's distinct() goes through a set and gives no particular order, sort
+        # the leaves by number (then name, for the banks of separate leaves) instead
+        meas = self.measurements
+        failed = set(zip(meas.leaf_num[~meas.passed].tolist(), meas.leaf_name[~meas.passed].tolist()))
+
+        return [leaf_name for _, leaf_name in sorted(failed)]
+
+    @property
+    def max_error(self) -> float:
+        return float(np.max(np.abs(self.measurements.error)))
+
+    @property
+    def abs_median_error(self) -> float:
+        return float(np.median(np.abs(self.measurements.error)))
+
+    @property
+    def percent_passing(self) -> float:
+        return float(100 * np.mean(self.measurements.passed))
+
+    def _max_error_rows(self) -> np.ndarray:
+        # rows of the first measurement that holds the maximum error
+        meas = self.measurements
+        max_meas = meas.meas_index[np.argmax(np.abs(meas.error))]
+
+        return np.flatnonzero(meas.meas_index == max_meas)
+
+    @property
+    def max_error_picket(self) -> int:
+        return int(self.measurements.picket[self._max_error_rows()[0]])
+
+    @property
+    def max_error_leaf(self) -> int | str:
+        meas = self.measurements
+        rows = self._max_error_rows()
+
+        if len(rows) > 1 and not abs(meas.error[rows[0]]) > abs(meas.error[rows[1]]):
+            return meas.leaf_name[rows[1]]
+
+        return meas.leaf_name[rows[0]]
+
+    def _leaves_in_view(self, analysis_width):
+        # pylinac calls this right after the picket detection, so it is used as the hook
+        # between picket detection and leaf measurement
+        leaves = super()._leaves_in_view(analysis_width)
+
+        if self._cancel is None:
+            return leaves
+
+        return self._iter_leaves_cancellable(leaves)
+
+    def _iter_leaves_cancellable(self, leaves: list):
+        for leaf in leaves:
+            self._cancel.check()
+            yield leaf
+
+    def release_images(self):
+        """
+        Drop the image arrays so the memory is freed right away. The MLC measurements
+        and pickets keep references to the image, so they are dropped as well.
+        """
+        self.image = None
+        self.mlc_meas = []
+        self.pickets = []
+
+    def get_publishable_plot(self, full_vector: bool = False, raster_dpi: int | None = None,
+                             max_vector_segments: int | None = None) -> io.BytesIO:
+        """
+        Custom plot implementation to get smaller, high quality pdf images. The image is
+        rasterized at ``raster_dpi``, the guard rails and leaf markers are drawn as one
+        path per colour and the markers are rasterized too beyond ``max_vector_segments``
+        (see publishable_plot_settings for the defaults). ``full_vector`` draws the plot
+        of pylinac instead, with one path per marker.
+        """
+        settings = publishable_plot_settings()
+        raster_dpi = raster_dpi or settings["raster_dpi"]
+        if max_vector_segments is None:
+            max_vector_segments = settings["max_vector_segments"]
+
+        pf_plot_data = io.BytesIO()
+
+        if full_vector:
+            self.plot_analyzed_image(
+                True,
+                True,
+                False,
+                False,
+                False,
+                figure_size = (4.5 ,4.5)
+            )
+            fig = plt.gcf()
+
+        else:
+            fig = self._plot_publishable(max_vector_segments)
+
+        fig.savefig(pf_plot_data, format = "pdf", dpi = raster_dpi, pad_inches = 0.0,
+                    bbox_inches='tight')
+        plt.close(fig)
+
+        return pf_plot_data
+
+    def _plot_publishable(self, max_vector_segments: int) -> plt.Figure:
+        # Same content as plot_analyzed_image with the guard rails and MLC peaks, without
+        # an artist per marker
+        fig, ax = plt.subplots(figsize = (4.5, 4.5))
+        ax.imshow(self.image.array, cmap = get_dicom_cmap())
+
+        up_down = self.orientation == Orientation.UP_DOWN
+        length = self.image.shape[0] if up_down else self.image.shape[1]
+
+        guard_rails = []
+        for picket in self.pickets:
+            for guard in (*picket.left_guard_separated, *picket.right_guard_separated):
+                # Straight guard rails only need their ends
+                along = np.linspace(0, length - 1, 2 if guard.order <= 1 else 64)
+                across = guard(along)
+                guard_rails.append(np.column_stack((across, along) if up_down else (along, across)))
+
+        add_merged_lines(ax, guard_rails, color = "g")
+
+        meas = self.measurements
+        position = np.column_stack((meas.position, meas.position))
+        span = np.column_stack((meas.leaf_center - meas.marker_width / 2,
+                                meas.leaf_center + meas.marker_width / 2))
+        x, y = (position, span) if up_down else (span, position)
+
+        colors = np.where(~meas.passed, "r", np.where(meas.passed_action, "b", "m"))
+        rasterized = len(colors) > max_vector_segments
+
+        # Failing leaves last, so they are drawn on top
+        for color in ("b", "m", "r"):
+            selected = colors == color
+
+            if selected.any():
+                add_merged_lines(ax, [segment_points(x[selected], y[selected])], color = color,
+                                 linewidth = 1.5, rasterized = rasterized)
+
+        # plot CAX
+        ax.plot(self.image.center.x, self.image.center.y, "r+", ms = 12, markeredgewidth = 3)
+        ax.axis("off")
+
+        return fig
+
+@dataclass
+class PicketFenceResult:
+    summary_text: list[list[str]]
+    picket_fence: PFAnalysis
+    record: AnalysisRecord | None = None
+
+class PicketFenceRunner(AnalysisRunner):
+
+    def __init__(self, filename: Union[str, list[str], Path, BinaryIO],
+                 filter: Optional[int] = None,
+                 log: Optional[str] = None,
+                 use_filename: bool = False,
+                 invert: bool = False,
+                 mlc: Union[MLC, MLCArrangement, str] = MLC.MILLENNIUM,
+                 crop_mm: int = 3,
+                 nominal_gap: float = 3.0,
+                 tolerance: float = 0.5,
+                 separate_leaves: bool = False,
+                 num_pickets: int | None = None,
+                 image_kwargs: Optional[dict] = None):
+
+        self._filename = filename
+        self._filter = filter
+        self._log = log
+        self._use_filename = use_filename
+        self._invert = invert
+        self._mlc = mlc.value["name"] if isinstance(mlc, MLC) else mlc
+        self._tolerance = tolerance
+        self._crop_mm = crop_mm
+        self._nominal_gap = nominal_gap
+        self._num_pickets = num_pickets
+        self._separate_leaves = separate_leaves
+        self._image_kwargs = image_kwargs
+
+    def run(self, progress: ProgressCallback | None = None,
+            cancel: CancellationToken | None = None) -> PicketFenceResult:
+        """
+        Perform an analysis of a picket fence image or series of picket fence images
+        """
+        self._report_progress(progress, "Loading picket fence image(s)")
+        pf = PFAnalysis(self._filename,
+                        self._filter,
+                        self._log,
+                        self._use_filename,
+                        self._mlc,
+                        self._crop_mm,
+                        image_kwargs = self._image_kwargs)
+
+        try:
+            self._check_cancelled(cancel)
+            self._report_progress(progress, "Analyzing picket fence")
+            pf.analyze(tolerance=self._tolerance, invert=self._invert, 
+                       separate_leaves=self._separate_leaves, num_pickets=self._num_pickets, 
+                       nominal_gap_mm=self._nominal_gap, cancel=cancel)
+
+        except AnalysisCancelled:
+            # The traceback keeps this frame alive, free the image before leaving
+            pf.release_images()
+            raise
+
+        summary_text = [["Gantry angle:", f"{pf.image.gantry_angle:2.2f}°"],
+                        ["Collimator angle:", f"{pf.image.collimator_angle:2.2f}°"],
+                        ["Number of leaves failing:", str(len(pf.failed_leaves()))],
+                        ["Absolute median error:", f"{pf.abs_median_error:2.2f} mm"],
+                        ["Mean picket spacing:", f"{pf.mean_picket_spacing:2.2f} mm"]]
+        
+        if self._separate_leaves:
+            leaf_name = pf.max_error_leaf[0] + f"-{(int(pf.max_error_leaf[1:]) + 1)}"
+            summary_text.append(["Max Error:", f"{pf.max_error:2.3f} mm " \
+             f"(Picket: {pf.max_error_picket + 1}, Leaf: {leaf_name})"])
+
+        else:
+            summary_text.append(["Max Error:", f"{pf.max_error:2.3f} mm " \
+             f"(Picket: {pf.max_error_picket + 1}, Leaf: {pf.max_error_leaf + 1})"])
+
+        measurements = pf.measurements
+        record = AnalysisRecord.from_results("picket_fence", pf.results_data(as_dict = True),
+                                             pf.image.metadata,
+                                             parameters = self.parameters(),
+                                             arrays = {"leaf_num": measurements.leaf_num,
+                                                       "picket": measurements.picket,
+                                                       "error": measurements.error,
+                                                       "passed": measurements.passed})
+
+        return PicketFenceResult(summary_text = summary_text, picket_fence = pf, record = record)
+
+def generate_picket_fence(
+        simulator: Simulator,
+        field_layer: type[FilterFreeFieldLayer | FilteredFieldLayer | PerfectFieldLayer],
+        file_out: str,
+        final_layers: list[Layer] = None,
+        pickets: int = 11,
+        picket_spacing_mm: int = 20,
+        picket_width_mm: int = 2,
+        picket_height_mm: int = 300,
+        gantry_angle: int = 0,
+        orientation: Orientation = Orientation.UP_DOWN,
+        picket_offset_error: Sequence | None = None,
+        image_rotation: float = 0.0
+    ):
+
+    picket_pos_mm = range(
+        -int((pickets - 1) * picket_spacing_mm / 2),
+        int((pickets - 1) * picket_spacing_mm / 2) + 1,
+        picket_spacing_mm,
+    )
+    for idx, pos in enumerate(picket_pos_mm):
+        if picket_offset_error is not None:
+            if len(picket_offset_error) != pickets:
+                raise ValueError(
+                    "The length of the error array must be the same as the number of pickets."
+                )
+            pos += picket_offset_error[idx]
+        if orientation == orientation.UP_DOWN:
+            position = (0, pos)
+            layout = (picket_height_mm, picket_width_mm)
+        else:
+            position = (pos, 0)
+            layout = (picket_width_mm, picket_height_mm)
+        simulator.add_layer(field_layer(layout, cax_offset_mm=position))
+    if final_layers is not None:
+        for layer in final_layers:
+            simulator.add_layer(layer)
+
+    # Rotate the image before DICOM generation
+    simulator.image = ndimage.rotate(simulator.image, -image_rotation,
+                                     reshape = False, mode = 'nearest')
+
+    simulator.generate_dicom(file_out, gantry_angle=gantry_angle)
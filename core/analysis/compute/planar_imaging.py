@@ -0,0 +1,200 @@
+import io
+import enum
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO
+
+from pylinac.planar_imaging import (ImagePhantomBase, LeedsTOR, LeedsTORBlue, LasVegas,
+                                  SNCkV, SNCMV, SNCMV12510, PTWEPIDQC, IBAPrimusA,
+                                  DoselabMC2kV, DoselabMC2MV, StandardImagingQC3,
+                                  StandardImagingQCkV, ElektaLasVegas)
+from pylinac.core.contrast import Contrast
+
+from core.analysis.compute.base import AnalysisRunner, CancellationToken, ProgressCallback
+from core.database.results import AnalysisRecord
+from core.image.dicom import load_image
+
+class PHANTOM(enum.Enum):
+    DOSELAB_MC2_KV = "Doselab MC2 kV"
+    DOSELAB_MC2_MV = "Doselab MC2 MV"
+    IBA_PRIMUS_A = "IBA Primus A"
+    LAS_VEGAS = "Las Vegas"
+    ELEKTA_LAS_VEGAS = "Elekta Las Vegas"
+    LEEDS_TOR_RED = "Leeds TOR 18 (Red)"
+    LEEDS_TOR_BLUE = "Leeds TOR 18 (Blue)"
+    PTW_EPID_QC = "PTW EPID QC"
+    SNC_MV = "SNC MV"
+    SNC_MV_12510 = "SNC MV (12510)"
+    SNC_KV = "SNC kV"
+    STANDARD_IMAGING_QC3 = "Standard Imaging QC-3 MV"
+    STANDARD_IMAGING_QC_KV = "Standard Imaging QC kV"
+
+def load_phantom(phantom_name: str,
+                 filepath: str | BinaryIO | Path,
+                 normalize: bool = True,
+                 image_kwargs: dict | None = None) -> ImagePhantomBase:
+    """
+    Create the pylinac phantom object that matches the given phantom name.
+    """
+    if phantom_name == PHANTOM.LEEDS_TOR_RED.value:
+        phantom = LeedsTOR(filepath, normalize, image_kwargs)
+        phantom.common_name = PHANTOM.LEEDS_TOR_RED.value
+
+    elif phantom_name == PHANTOM.LEEDS_TOR_BLUE.value:
+        phantom = LeedsTORBlue(filepath, normalize, image_kwargs)
+        phantom.common_name = PHANTOM.LEEDS_TOR_BLUE.value
+
+    elif phantom_name == PHANTOM.STANDARD_IMAGING_QC3.value:
+        phantom = StandardImagingQC3(filepath, normalize, image_kwargs)
+        phantom.common_name = PHANTOM.STANDARD_IMAGING_QC3.value
+
+    elif phantom_name == PHANTOM.STANDARD_IMAGING_QC_KV.value:
+        phantom = StandardImagingQCkV(filepath, normalize, image_kwargs)
+        phantom.common_name = PHANTOM.STANDARD_IMAGING_QC_KV.value
+
+    elif phantom_name == PHANTOM.DOSELAB_MC2_MV.value:
+        phantom = DoselabMC2MV(filepath, normalize, image_kwargs)
+        phantom.common_name = PHANTOM.DOSELAB_MC2_MV.value
+
+    elif phantom_name == PHANTOM.DOSELAB_MC2_KV.value:
+        phantom =  DoselabMC2kV(filepath, normalize, image_kwargs)
+        phantom.common_name = PHANTOM.DOSELAB_MC2_KV.value
+
+    elif phantom_name == PHANTOM.SNC_MV.value:
+        phantom = SNCMV(filepath, normalize, image_kwargs)
+        phantom.common_name = PHANTOM.SNC_MV.value
+    
+    elif phantom_name == PHANTOM.SNC_MV_12510.value:
+        phantom = SNCMV12510(filepath, normalize, image_kwargs)
+        phantom.common_name = PHANTOM.SNC_MV_12510.value
+
+    elif phantom_name == PHANTOM.SNC_KV.value:
+        phantom = SNCkV(filepath, normalize, image_kwargs)
+        phantom.common_name = PHANTOM.SNC_KV.value
+
+    elif phantom_name == PHANTOM.IBA_PRIMUS_A.value:
+        phantom = IBAPrimusA(filepath, normalize, image_kwargs)
+        phantom.common_name = PHANTOM.IBA_PRIMUS_A.value
+
+    elif phantom_name == PHANTOM.PTW_EPID_QC.value:
+        phantom = PTWEPIDQC(filepath, normalize, image_kwargs)
+        phantom.common_name = PHANTOM.PTW_EPID_QC.value
+
+    elif phantom_name == PHANTOM.LAS_VEGAS.value:
+        phantom = LasVegas(filepath, normalize, image_kwargs)
+        phantom.common_name = PHANTOM.LAS_VEGAS.value
+        phantom.mtf = None
+
+    elif phantom_name == PHANTOM.ELEKTA_LAS_VEGAS.value:
+        phantom = ElektaLasVegas(filepath, normalize, image_kwargs)
+        phantom.common_name = PHANTOM.ELEKTA_LAS_VEGAS.value
+        phantom.mtf = None
+
+    else:
+        raise ValueError("Invalid phantom name passsed. Pass one of the following: " +
+                         str.join(", ", [x for x in PHANTOM]))
+
+    return phantom
+
+class PIAnalysis():
+    """
+    Planar imaging analysis without any Qt dependencies. Wraps the pylinac phantom object.
+    """
+
+    def __init__(self, phantom: ImagePhantomBase):
+        self.phantom = phantom
+
+    def get_publishable_plots(self) -> list[io.BytesIO()]:
+        """
+        Custom plot implementation to get smaller, high quality pdf images
+        """
+        figs, names = self.phantom.plot_analyzed_image(
+            show=False, split_plots=True, figsize = (4.5 ,4.5)
+        )
+
+        filenames = [io.BytesIO() for _ in names]
+        for fig, name in zip(figs, filenames):
+            fig.savefig(name, format = "pdf", pad_inches = 0.0, bbox_inches='tight', dpi=200)
+
+        return filenames
+
+@dataclass
+class PlanarImagingResult:
+    summary_text: list[list[str]]
+    planar_imaging: PIAnalysis
+    record: AnalysisRecord | None = None
+
+class PlanarImagingRunner(AnalysisRunner):
+
+    def __init__(self, phantom_name: str,
+                 filepath: str | BinaryIO | Path,
+                 normalize: bool = True,
+                 low_contrast_threshold: float = 0.05,
+                 high_contrast_threshold: float = 0.5,
+                 invert: bool = False,
+                 angle_override: float | None = None,
+                 center_override: tuple | None = None,
+                 size_override: float | None = None,
+                 ssd: float = 1000,
+                 low_contrast_method: str = Contrast.MICHELSON,
+                 visibility_threshold: float = 100,
+                 image_kwargs: dict | None = None):
+
+        self._phantom_name = phantom_name
+        self._filepath = filepath
+        self._normalize = normalize
+        self._image_kwargs = image_kwargs
+        self._angle_override = angle_override
+        self._size_override = size_override
+        self._center_override = center_override
+        self._high_contrast_threshold = high_contrast_threshold
+        self._low_contrast_threshold = low_contrast_threshold
+        self._low_contrast_method = low_contrast_method
+        self._invert = invert
+        self._visibility_threshold = visibility_threshold
+        self._ssd = ssd
+
+    def run(self, progress: ProgressCallback | None = None,
+            cancel: CancellationToken | None = None) -> PlanarImagingResult:
+        """
+        Perform an analysis of a phantom image from a 2D kV or MV linac imager.
+        """
+        self._report_progress(progress, "Loading phantom image")
+        phantom = load_phantom(self._phantom_name,
+                               load_image(self._filepath, **(self._image_kwargs or {})),
+                               self._normalize)
+
+        self._check_cancelled(cancel)
+        self._report_progress(progress, "Analyzing phantom image")
+        phantom.analyze(low_contrast_method=self._low_contrast_method,
+                        low_contrast_threshold=self._low_contrast_threshold,
+                        high_contrast_threshold=self._high_contrast_threshold,
+                        visibility_threshold=self._visibility_threshold,
+                        invert=self._invert,
+                        center_override=self._center_override,
+                        angle_override=self._angle_override,
+                        size_override=self._size_override,
+                        ssd=self._ssd
+                        )
+        
+        results_data = phantom.results_data()
+        
+        summary_text = [["No. of low contrast ROIs visible:", str(results_data.num_contrast_rois_seen)],
+                        ["Phantom center (X):", f"{results_data.phantom_center_x_y[0]}"],
+                        ["Phantom center (Y):", f"{results_data.phantom_center_x_y[1]}"],
+                        ["Median contrast:", f"{results_data.median_contrast: 2.2f}"],
+                        ["Median CNR:", f"{results_data.median_cnr: 2.2f}"]
+        ]
+
+        if phantom.mtf is not None:
+            summary_text.append(["MTF 80% (lp/mm):", f"{results_data.mtf_lp_mm[0][80]: 2.2f}"])
+            summary_text.append(["MTF 50% (lp/mm):", f"{results_data.mtf_lp_mm[1][50]: 2.2f}"])
+            summary_text.append(["MTF 30% (lp/mm):", f"{results_data.mtf_lp_mm[2][30]: 2.2f}"])
+
+        record = AnalysisRecord.from_results("planar_imaging", phantom.results_data(as_dict = True),
+                                             getattr(phantom.image, "metadata", None),
+                                             parameters = self.parameters())
+
+        return PlanarImagingResult(summary_text = summary_text,
+                                 planar_imaging = PIAnalysis(phantom),
+                                 record = record)
@@ -0,0 +1,172 @@
+import io
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable
+
+import numpy as np
+from matplotlib.axes import Axes
+from matplotlib.lines import Line2D
+
+from core.analysis.compute.base import AnalysisRunner, CancellationToken, ProgressCallback
+from core.analysis.compute.cache import result_cache
+from core.configuration.config import SettingsConfig
+
+PLOT_POLICIES = ("lazy", "background", "disk")
+
+# pyplot keeps a global current figure, plots rendered in threads take turns
+plot_lock = threading.RLock()
+
+def publishable_plot_settings() -> dict:
+    """
+    Settings of the plots saved in reports. Images are rasterized at ``raster_dpi``;
+    annotations stay vector paths up to ``max_vector_segments`` line segments per
+    plot, more are rasterized with the image. ``policy`` tells when the plots are
+    rendered, see PublishablePlots.
+    """
+    settings = {"raster_dpi": 150, "max_vector_segments": 5000, "policy": "background"}
+    settings.update(SettingsConfig().getConfig().get("publishable_plots", {}))
+
+    if settings["policy"] not in PLOT_POLICIES:
+        settings["policy"] = "lazy"
+
+    return settings
+
+def copy_plots(plots: Any) -> Any:
+    """
+    Copy of the rendered ``plots`` (a BytesIO or a list of them), so each report reads
+    its own streams from the start.
+    """
+    if isinstance(plots, io.BytesIO):
+        return io.BytesIO(plots.getvalue())
+
+    if isinstance(plots, (list, tuple)):
+        return [copy_plots(plot) for plot in plots]
+
+    return plots
+
+class PublishablePlots():
+    """
+    The plots of an analysis for its report, rendered once by ``render`` (e.g. the
+    bound method ``get_publishable_plot`` of the analysis) and copied for every report.
+
+    The policy of the settings tells when ``render`` is called:
+
+    - ``lazy``: when a report is first built, analyses without a report never render.
+    - ``background``: right after the analysis, at a low priority (see QPlotWorker),
+      so the report has its plots ready.
+    - ``disk``: same as ``background``, and the plots are also kept in the result
+      cache for the next analysis of the same images with the same parameters.
+    """
+
+    def __init__(self, render: Callable[[], Any] | None, name: str,
+                 parameters: dict[str, Any] | None = None,
+                 policy: str | None = None):
+
+        self.name = name
+        self.policy = policy or publishable_plot_settings()["policy"]
+        self._render = render
+        self._parameters = parameters or {}
+        self._plots = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._plots is not None
+
+    def set(self, plots: Any):
+        """
+        Use ``plots``, rendered elsewhere (e.g. in a worker process).
+        """
+        self._plots = plots
+
+    def __call__(self) -> Any:
+        with self._lock:
+            if self._plots is None:
+                self._plots = self._load_or_render()
+
+        return copy_plots(self._plots)
+
+    def _load_or_render(self) -> Any:
+        cache = result_cache() if self.policy == "disk" else None
+        key = None
+
+        if cache is not None:
+            settings = publishable_plot_settings()
+            del settings["policy"]
+            key = cache.key(f"{self.name}.plots", {**self._parameters, "plot_settings": settings})
+
+        if key is not None:
+            plots = cache.get(key)
+            if plots is not None:
+                return plots
+
+        with plot_lock:
+            plots = self._render()
+
+        if key is not None:
+            cache.put(key, plots)
+
+        return plots
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+
+        # Once rendered, the analysis doesn't need to travel with the plots
+        if self._plots is not None:
+            state["_render"] = None
+
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+@dataclass
+class PlotResult:
+    plots: Any
+
+class PlotRunner(AnalysisRunner):
+    """
+    Renders the PublishablePlots of an analysis as a job of its own, ahead of the report.
+    """
+
+    cacheable = False
+
+    def __init__(self, plots: PublishablePlots):
+        self._plots = plots
+
+    def run(self, progress: ProgressCallback | None = None,
+            cancel: CancellationToken | None = None) -> PlotResult:
+        self._check_cancelled(cancel)
+        self._report_progress(progress, "Rendering plots")
+
+        return PlotResult(self._plots())
+
+def add_merged_lines(ax: Axes, lines: list[np.ndarray], **kwargs) -> Line2D | None:
+    """
+    Draw ``lines`` (arrays of (x, y) points) as a single Line2D with NaN between them,
+    so a PDF holds one path instead of one per line. The keyword arguments go to
+    the Line2D.
+    """
+    if not lines:
+        return None
+
+    separator = np.full((1, 2), np.nan)
+    points = np.concatenate([part for line in lines for part in (np.asarray(line, float), separator)])
+
+    line = Line2D(points[:-1, 0], points[:-1, 1], **kwargs)
+    ax.add_line(line)
+
+    return line
+
+def segment_points(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """
+    The straight segments from (x[:, 0], y[:, 0]) to (x[:, 1], y[:, 1]) as the points of
+    a single line, with NaN between the segments.
+    """
+    points = np.full((len(x), 3, 2), np.nan)
+    points[:, :2, 0] = x
+    points[:, :2, 1] = y
+
+    return points.reshape(-1, 2)[:-1]
@@ -0,0 +1,278 @@
+import multiprocessing as mp
+import os
+import queue
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import util
+from typing import Any, Callable, Iterator, Sequence
+
+from core.analysis.compute.base import AnalysisRunner, CancellationToken
+from core.analysis.compute.memory import PeakRSSMonitor
+from core.image.dicom import share_dicom_cache
+
+# Progress queue shared by every job of a worker process, set by the pool initializer
+_progress_queue = None
+
+# Number of analyses running on the machine, shared with the worker processes of the
+# ProcessExecutor by the pool initializer
+_running_analyses = None
+
+def _running_counter():
+    global _running_analyses
+
+    if _running_analyses is None:
+        _running_analyses = mp.get_context("spawn").Value("i", 0)
+
+    return _running_analyses
+
+def _init_process(progress_queue, running_analyses, max_workers: int):
+    global _progress_queue, _running_analyses
+    _progress_queue = progress_queue
+    _running_analyses = running_analyses
+
+    # The worker processes split the image cache budget between them
+    share_dicom_cache(max_workers)
+
+def _init_pool_process(initializer: Callable | None):
+    # The work inside an analysis reads its images once, a cache in every worker
+    # process would only add to the caches of the analyses
+    share_dicom_cache(0)
+
+    if initializer is not None:
+        initializer()
+
+@contextmanager
+def running_analysis():
+    """
+    Count the analysis run in this block as running, see ``pool_workers``.
+    """
+    counter = _running_counter()
+
+    with counter.get_lock():
+        counter.value += 1
+
+    try:
+        yield
+    finally:
+        with counter.get_lock():
+            counter.value -= 1
+
+def _run_analysis(job_id: int, runner: AnalysisRunner, cancel_event):
+    def progress(value: Any):
+        _progress_queue.put((job_id, value))
+
+    with PeakRSSMonitor() as monitor, running_analysis():
+        result = runner.run_cached(progress = progress, cancel = CancellationToken(cancel_event))
+
+    return result, monitor.peak_rss
+
+def default_max_jobs() -> int:
+    """
+    Number of analyses the scheduler runs at once when the settings don't say: one per
+    core, leaving a core for the application.
+    """
+    return max(1, (os.cpu_count() or 2) - 1)
+
+def pool_workers(max_workers: int | None = None) -> int:
+    """
+    Number of worker processes for the work inside one analysis (its images, the
+    points of a sweep, ...). ``max_workers`` if set, otherwise the cores of the
+    machine but one for the application, shared between the analyses running at the
+    moment. The analysis waits for its pool, so its own core is part of its share.
+    """
+    if max_workers:
+        return max_workers
+
+    running = max(1, _running_counter().value)
+
+    return max(1, default_max_jobs() // running)
+
+class WorkerPool():
+    """
+    Pool of worker processes for the work inside an analysis, kept between analyses
+    of the same process so the worker processes only pay their imports (and
+    ``initializer``) once. The pool is started again when the number of workers
+    changes, or when one of its worker processes died (e.g. out of memory) and left
+    it broken. Its worker processes keep no image cache, see ``share_dicom_cache``.
+    """
+
+    def __init__(self, initializer: Callable | None = None):
+        self._initializer = initializer
+        self._pool = None
+        self._max_workers = None
+        self._finalizer = None
+
+    def _executor(self, max_workers: int) -> ProcessPoolExecutor:
+        if self._pool is None or self._max_workers != max_workers:
+            self.reset()
+
+            # Qt does not survive a fork, always start clean interpreters instead
+            self._pool = ProcessPoolExecutor(max_workers = max_workers,
+                                             mp_context = mp.get_context("spawn"),
+                                             initializer = _init_pool_process,
+                                             initargs = (self._initializer,))
+            self._max_workers = max_workers
+
+            # A worker process of the ProcessExecutor joins its children when it exits,
+            # which would wait forever on an idle pool. Shut the pool down before that
+            # happens, and before the finalizers of its queues (priority 10) stop
+            # feeding the workers
+            self._finalizer = util.Finalize(self._pool, self._pool.shutdown,
+                                            exitpriority = 100)
+
+        return self._pool
+
+    def submit(self, max_workers: int, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Run ``fn(*args, **kwargs)`` in the pool, started with ``max_workers`` worker
+        processes if it isn't running yet.
+        """
+        try:
+            return self._executor(max_workers).submit(fn, *args, **kwargs)
+
+        except BrokenProcessPool:
+            # A worker process died since the last submit, start over with a new pool
+            self.reset()
+            return self._executor(max_workers).submit(fn, *args, **kwargs)
+
+    def run_all(self, max_workers: int, fn: Callable,
+                args: Sequence[tuple]) -> Iterator[tuple[int, Future]]:
+        """
+        Run ``fn(*args[index])`` in the pool for every index and yield the ``(index,
+        future)`` pairs as the calls complete.
+
+        A worker process that dies breaks the pool and fails all its pending calls. The
+        calls without a result run again on a new pool, and one at a time if the pool
+        breaks again. The future of a call only holds BrokenProcessPool when the call
+        killed a worker process on its own.
+        """
+        pending = list(range(len(args)))
+        breaks = 0
+
+        while pending:
+            alone = breaks > 1
+            batch = pending[:1] if alone else pending
+            futures = {self.submit(max_workers, fn, *args[index]): index for index in batch}
+            broken = []
+
+            try:
+                for future in as_completed(futures):
+                    if not alone and isinstance(future.exception(), BrokenProcessPool):
+                        broken.append(futures[future])
+                    else:
+                        yield futures[future], future
+
+            except BaseException:
+                # Includes the GeneratorExit of a caller that stops early
+                for future in futures:
+                    future.cancel()
+                raise
+
+            if alone:
+                pending = pending[1:]
+            else:
+                pending = sorted(broken)
+                breaks += bool(broken)
+
+    def reset(self):
+        """
+        Drop the pool without waiting for its work, the next submit starts a new one.
+        """
+        if self._pool is not None:
+            self._finalizer.cancel()
+            self._pool.shutdown(wait = False, cancel_futures = True)
+            self._pool = None
+            self._finalizer = None
+
+class ProcessExecutor():
+    """
+    Runs analysis runners in a pool of worker processes so that the pylinac work does
+    not hold the GIL of the calling process. Progress updates of all jobs are sent
+    back through a single queue as ``(job_id, value)`` tuples.
+
+    Each job gets an event from a multiprocessing manager, which the worker process
+    checks through a CancellationToken to stop the job between analysis stages.
+    """
+
+    def __init__(self, max_workers: int | None = None):
+        self._max_workers = max_workers
+        # Qt does not survive a fork, always start clean interpreters instead
+        self._context = mp.get_context("spawn")
+        self._progress_queue = self._context.Queue()
+        self._pool = None
+        self._manager = None
+        self._cancel_events = {}
+
+    def _create_pool(self) -> ProcessPoolExecutor:
+        max_workers = self._max_workers or os.cpu_count() or 1
+
+        return ProcessPoolExecutor(max_workers = max_workers,
+                                   mp_context = self._context,
+                                   initializer = _init_process,
+                                   initargs = (self._progress_queue, _running_counter(),
+                                               max_workers))
+
+    def submit(self, job_id: int, runner: AnalysisRunner) -> Future:
+        """
+        Run ``runner`` in a worker process. The returned future holds the analysis result
+        and the peak resident set size of the worker process during the analysis.
+        """
+        if self._pool is None:
+            self._pool = self._create_pool()
+
+        if self._manager is None:
+            self._manager = self._context.Manager()
+
+        cancel_event = self._manager.Event()
+        self._cancel_events[job_id] = cancel_event
+
+        try:
+            future = self._pool.submit(_run_analysis, job_id, runner, cancel_event)
+
+        except BrokenProcessPool:
+            # A worker process died (e.g. out of memory), start over with a new pool. The
+            # broken one still has its management thread and queues to release
+            self._pool.shutdown(wait = False, cancel_futures = True)
+            self._pool = self._create_pool()
+            future = self._pool.submit(_run_analysis, job_id, runner, cancel_event)
+
+        future.add_done_callback(lambda _: self._cancel_events.pop(job_id, None))
+
+        return future
+
+    def cancel(self, job_id: int):
+        """
+        Ask the worker process to stop the job at its next cancellation check.
+        """
+        cancel_event = self._cancel_events.get(job_id)
+
+        if cancel_event is not None:
+            cancel_event.set()
+
+    def progress_updates(self) -> list[tuple[int, Any]]:
+        """
+        Get all progress updates received since the last call, without blocking.
+        """
+        updates = []
+
+        while True:
+            try:
+                updates.append(self._progress_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return updates
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = False):
+        if self._pool is not None:
+            if cancel_futures:
+                for cancel_event in list(self._cancel_events.values()):
+                    cancel_event.set()
+
+            self._pool.shutdown(wait = wait, cancel_futures = cancel_futures)
+            self._pool = None
+
+        if self._manager is not None and wait:
+            self._manager.shutdown()
+            self._manager = None
@@ -0,0 +1,449 @@
+import io
+import math
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import closing
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import BinaryIO, Callable, Sequence
+from pydicom.misc import is_dicom
+from pylinac.core import image
+from pylinac.core.geometry import Point
+from pylinac.starshot import Starshot
+from pylinac.settings import get_dicom_cmap
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from core.analysis.compute.base import AnalysisRunner, CancellationToken, ProgressCallback
+from core.analysis.compute.process import WorkerPool, pool_workers
+from core.database.results import AnalysisRecord
+from core.image.dicom import MappedDicomImage, dicom_cache, load_image, read_dicom_image
+
+class StarshotAnalysis(Starshot):
+    """
+    Starshot analysis without any Qt dependencies.
+    """
+
+    def analyze(self, 
+                radius: float = 0.85,
+                min_peak_height: float = 0.25,
+                tolerance: float = 1,
+                start_point: Point | tuple | None = None,
+                fwhm: bool = True,
+                recursive: bool = True,
+                invert: bool = False):
+        
+        return super().analyze(radius, min_peak_height, tolerance, start_point, fwhm, recursive, invert)
+
+    def prepare(self, invert: bool = False) -> Point:
+        """
+        The steps of ``analyze()`` before the search of the spokes (inversion check and
+        start point), so several searches can share them. Returns the start point.
+        """
+        self.image.check_inversion_by_histogram(percentiles=[4, 50, 96])
+        if invert:
+            self.image.invert()
+
+        return self._get_reasonable_start_point()
+
+    def analyze_prepared(self, start_point: Point,
+                         radius: float = 0.85,
+                         min_peak_height: float = 0.25,
+                         tolerance: float = 1,
+                         fwhm: bool = True):
+        """
+        Search the spokes once with ``radius`` and ``min_peak_height`` on an image
+        already prepared by ``prepare()``, without the recursive search of pylinac.
+        """
+        self.tolerance = tolerance
+        self._get_reasonable_wobble(start_point, fwhm, min_peak_height, radius, recursive = False)
+
+    def get_publishable_plots(self) -> list[io.BytesIO()]:
+        """
+        Custom plot implementation to get smaller, high quality pdf images
+        """
+
+        full_plot_data = io.BytesIO()
+        wobble_plot_data = io.BytesIO()
+        
+        fig, ax = plt.subplots()
+        # show analyzed image
+        ax.imshow(self.image.array, cmap = get_dicom_cmap())
+        self.lines.plot(ax)
+        self.wobble.plot2axes(ax, edgecolor="green")
+        self.circle_profile.plot2axes(ax, edgecolor="green")
+
+        ax.axis('off')
+        ax.set_aspect('auto')
+
+        # Ensure that we fill the entire pdf page (pad_inches = 0.0  and box_inches = 'tight')
+        fig.savefig(full_plot_data, format = "pdf", pad_inches = 0.0, bbox_inches='tight')
+
+        xlims = [self.wobble.center.x + self.wobble.diameter,
+                 self.wobble.center.x - self.wobble.diameter]
+        
+        ylims = [self.wobble.center.y + self.wobble.diameter,
+                 self.wobble.center.y - self.wobble.diameter]
+        
+        ax.set_xlim(xlims)
+        ax.set_ylim(ylims)
+
+        fig.savefig(wobble_plot_data, format = "pdf", pad_inches = 0.0, bbox_inches='tight')
+
+        return [full_plot_data, wobble_plot_data]
+
+def merge_starshot_images(paths: Sequence[str | Path],
+                          method: str = "sum",
+                          stretch_each: bool = True,
+                          memory_map: bool = False,
+                          cancel: CancellationToken | None = None,
+                          **kwargs) -> image.ImageLike:
+    """
+    Superimpose single-spoke starshot images, like ``Starshot.from_multiple_images``.
+    The images are read one at a time, without the shared DICOM cache, and combined
+    into a single preallocated array of the dtype ``load_multiples`` would give (e.g.
+    float when the images are stretched), so only one source image is held in memory at
+    a time. With ``memory_map``, uncompressed DICOM files are mapped instead of decoded.
+    The first image provides the metadata. ``kwargs`` are the image keyword arguments.
+    """
+    if method not in ("sum", "mean", "max"):
+        raise ValueError(f"Unknown method to combine the images: {method}")
+
+    if not paths:
+        raise ValueError("No images to combine")
+
+    fill_dtype = kwargs.get("dtype")
+    combined = merged = stretched = None
+
+    for path in paths:
+        if cancel is not None:
+            cancel.check()
+
+        if isinstance(path, (str, Path)) and is_dicom(path):
+            frame = read_dicom_image(path, memory_map = memory_map, **kwargs)
+        else:
+            frame = image.load(path, **kwargs)
+
+        if merged is not None and frame.shape != merged.shape:
+            raise ValueError("Images were not the same shape")
+
+        array = frame.array
+
+        if stretch_each:
+            # Same arithmetic as the stretch of load_multiples, in a buffer reused for
+            # every image
+            if stretched is None:
+                stretched = np.empty(array.shape, dtype = float)
+
+            low, high = array.min(), array.max()
+
+            if high > low:
+                np.subtract(array, low, out = stretched)
+                stretched /= high - low
+
+                if fill_dtype is not None:
+                    stretched *= _dtype_max(fill_dtype)
+                    # Stretched values are positive, flooring them is the cast to fill_dtype
+                    np.floor(stretched, out = stretched)
+            else:
+                # A uniform image stretches to zeros (see PFMergedImage), it adds nothing
+                stretched.fill(0)
+
+            array = stretched
+
+        if merged is None:
+            dtype = np.dtype(fill_dtype) if stretch_each and fill_dtype is not None else array.dtype
+            merged = np.empty(array.shape, dtype = _merged_dtype(dtype, method))
+            merged[...] = array
+
+            # The first image carries the metadata, its own pixels are not needed anymore
+            combined = frame
+            combined.array = merged
+            if isinstance(combined, MappedDicomImage):
+                combined.raw_array = None
+        elif method == "max":
+            np.maximum(merged, array, out = merged, casting = "unsafe")
+        else:
+            np.add(merged, array, out = merged, casting = "unsafe")
+
+        del frame, array
+
+    if method == "mean":
+        merged /= len(paths)
+
+    # Like load_multiples, the values are no longer those of the file
+    combined._raw_pixels = True
+
+    return combined
+
+def _dtype_max(dtype: np.dtype):
+    dtype = np.dtype(dtype)
+    return np.iinfo(dtype).max if dtype.kind in "iu" else np.finfo(dtype).max
+
+def _merged_dtype(dtype: np.dtype, method: str) -> np.dtype:
+    # The dtype numpy reductions give over a stack of images of ``dtype``
+    if method == "max":
+        return np.dtype(dtype)
+
+    reduction = np.mean if method == "mean" else np.sum
+    return reduction(np.zeros(1, dtype = dtype)).dtype
+
+# Wobble diameter under which pylinac's recursive search accepts a result
+REASONABLE_WOBBLE_MM = 2.0
+
+# Default grid of a parameter sweep, the values pylinac's recursive search goes through
+# within the ranges of the worksheet
+SWEEP_RADII = tuple(np.round(np.linspace(0.95, 0.2, 16), 2))
+SWEEP_MIN_PEAK_HEIGHTS = tuple(np.round(np.linspace(0.05, 0.95, 10), 2))
+
+@dataclass
+class StarshotCandidate:
+    """
+    Spoke search with one (radius, min_peak_height) pair of a parameter sweep. ``error``
+    tells why the spokes were not found.
+    """
+
+    radius: float
+    min_peak_height: float
+    spokes: int = 0
+    wobble_diameter_mm: float | None = None
+    error: str | None = None
+
+    @property
+    def found(self) -> bool:
+        return self.error is None
+
+    def rank_key(self) -> tuple:
+        # Missing spokes can make the wobble smaller, so reasonable wobbles come first,
+        # then the candidates that found the most spokes and then the smallest wobble.
+        # Ties go to the search order of pylinac, the largest radius and lowest height.
+        if not self.found:
+            return (True, True, 0, math.inf, -self.radius, self.min_peak_height)
+
+        return (False, self.wobble_diameter_mm >= REASONABLE_WOBBLE_MM, -self.spokes,
+                self.wobble_diameter_mm, -self.radius, self.min_peak_height)
+
+# Pool for the candidates of parameter sweeps, kept between sweeps of the same process
+# so the worker processes only pay the pylinac import once
+_sweep_pool = WorkerPool()
+
+def _failed_candidates(candidates: list[StarshotCandidate], err: Exception) -> list[StarshotCandidate]:
+    for candidate in candidates:
+        candidate.error = str(err) or type(err).__name__
+
+    return candidates
+
+def _search_candidates(starshot: StarshotAnalysis, start_point: Point, fwhm: bool,
+                       candidates: list[StarshotCandidate]) -> list[StarshotCandidate]:
+    for candidate in candidates:
+        try:
+            starshot.analyze_prepared(start_point, candidate.radius, candidate.min_peak_height,
+                                      fwhm = fwhm)
+        except Exception as err:
+            # Any failure only rules out this pair, the sweep goes on with the others
+            _failed_candidates([candidate], err)
+            continue
+
+        candidate.spokes = len(starshot.lines)
+        candidate.wobble_diameter_mm = starshot.wobble.radius_mm * 2.0
+
+    return candidates
+
+@dataclass
+class StarshotResult:
+    summary_text: list[list[str]]
+    starshot: StarshotAnalysis
+    record: AnalysisRecord | None = None
+
+@dataclass
+class StarshotSweepResult(StarshotResult):
+    """
+    Result of the best candidate of a parameter sweep, with all the candidates from the
+    best to the worst.
+    """
+
+    candidates: list[StarshotCandidate] = field(default_factory = list)
+
+    @property
+    def best(self) -> StarshotCandidate:
+        return self.candidates[0]
+
+class StarshotRunner(AnalysisRunner):
+
+    execution_parameters = ("memory_map",)
+
+    def __init__(self, filepath: str | BinaryIO | list[str],
+                 radius: float = 0.85,
+                 min_peak_height: float = 0.25,
+                 tolerance: float = 1.0,
+                 fwhm: bool = True,
+                 recursive: bool = True,
+                 invert: bool = False,
+                 memory_map: bool | None = None,
+                 **kwargs):
+
+        self._filepath = filepath
+        self._radius = radius
+        self._min_peak_height = min_peak_height
+        self._tolerance = tolerance
+        self._fwhm = fwhm
+        self._recursive = recursive
+        self._invert = invert
+        self._memory_map = memory_map
+        self._kwargs = kwargs
+
+    def run(self, progress: ProgressCallback | None = None,
+            cancel: CancellationToken | None = None) -> StarshotResult:
+        starshot = self._load_starshot(progress, cancel)
+
+        self._check_cancelled(cancel)
+        self._report_progress(progress, "Analyzing starshot")
+        starshot.analyze(radius = self._radius,
+                         min_peak_height = self._min_peak_height,
+                         tolerance = self._tolerance,
+                         fwhm = self._fwhm,
+                         recursive = self._recursive,
+                         invert = self._invert)
+
+        return StarshotResult(summary_text = self._summary_text(starshot), starshot = starshot,
+                              record = self._record(starshot, self.parameters()))
+
+    def _load_starshot(self, progress: ProgressCallback | None,
+                       cancel: CancellationToken | None) -> StarshotAnalysis:
+        self._report_progress(progress, "Loading starshot image(s)")
+
+        if isinstance(self._filepath, list):
+            # Separate acquisitions are combined one image at a time, memory-mapped
+            # like the images of the shared cache unless set otherwise
+            memory_map = dicom_cache().memory_map if self._memory_map is None else self._memory_map
+            return StarshotAnalysis(merge_starshot_images(self._filepath, memory_map = memory_map,
+                                                          cancel = cancel, **self._kwargs))
+
+        return StarshotAnalysis(load_image(self._filepath, **self._kwargs))
+
+    def _summary_text(self, starshot: StarshotAnalysis) -> list[list[str]]:
+        return [["Minimum circle (wobble) diameter:", 
+                 f"{starshot.wobble.radius_mm * 2.0 : 2.3f} mm"],
+                ["Position of the wobble circle:",
+                 f"{starshot.wobble.center.x : 2.1f}, {starshot.wobble.center.y : 2.1f}"]]
+
+    def _record(self, starshot: StarshotAnalysis, parameters: dict) -> AnalysisRecord:
+        return AnalysisRecord.from_results("starshot", starshot.results_data(as_dict = True),
+                                           getattr(starshot.image, "metadata", None),
+                                           parameters = parameters)
+
+class StarshotSweepRunner(StarshotRunner):
+    """
+    Searches the spokes of a starshot with every pair of ``radii`` and
+    ``min_peak_heights``, in worker processes if ``max_workers`` allows it (see
+    ``pool_workers`` for the default). The image is loaded and prepared once. The
+    candidates are ranked by their wobble diameter and spoke count (see
+    ``StarshotCandidate.rank_key``) and the analysis of the best one is returned.
+    """
+
+    execution_parameters = ("memory_map", "max_workers")
+
+    def __init__(self, filepath: str | BinaryIO | list[str],
+                 radii: Sequence[float] = SWEEP_RADII,
+                 min_peak_heights: Sequence[float] = SWEEP_MIN_PEAK_HEIGHTS,
+                 tolerance: float = 1.0,
+                 fwhm: bool = True,
+                 invert: bool = False,
+                 memory_map: bool | None = None,
+                 max_workers: int | None = None,
+                 **kwargs):
+
+        super().__init__(filepath, tolerance = tolerance, fwhm = fwhm, recursive = False,
+                         invert = invert, memory_map = memory_map, **kwargs)
+        self._radii = [float(radius) for radius in radii]
+        self._min_peak_heights = [float(height) for height in min_peak_heights]
+        self._max_workers = max_workers
+
+    def run(self, progress: ProgressCallback | None = None,
+            cancel: CancellationToken | None = None) -> StarshotSweepResult:
+        starshot = self._load_starshot(progress, cancel)
+
+        self._check_cancelled(cancel)
+        self._report_progress(progress, "Preparing starshot image")
+        start_point = starshot.prepare(invert = self._invert)
+
+        candidates = [StarshotCandidate(radius, height)
+                      for radius in self._radii for height in self._min_peak_heights]
+        candidates = self._search(starshot, start_point, candidates, progress, cancel)
+        candidates.sort(key = StarshotCandidate.rank_key)
+
+        best = candidates[0]
+        if not best.found:
+            raise RuntimeError("None of the swept parameters found the spokes of the starshot. "
+                               "Check the image or extend the sweep.")
+
+        # The workers only return the candidates, the best one is searched again for
+        # the lines and profile of the analysis
+        starshot.analyze_prepared(start_point, best.radius, best.min_peak_height,
+                                  tolerance = self._tolerance, fwhm = self._fwhm)
+
+        parameters = {**self.parameters(), "radius": best.radius,
+                      "min_peak_height": best.min_peak_height}
+
+        summary_text = self._summary_text(starshot)
+        summary_text.extend([["Best swept parameters:",
+                              f"radius {best.radius:.2f}, min. peak height {best.min_peak_height:.2f}"],
+                             ["Candidates with spokes found:",
+                              f"{sum(candidate.found for candidate in candidates)} of {len(candidates)}"]])
+
+        return StarshotSweepResult(summary_text = summary_text, starshot = starshot,
+                                   record = self._record(starshot, parameters),
+                                   candidates = candidates)
+
+    def _search(self, starshot: StarshotAnalysis, start_point: Point,
+                candidates: list[StarshotCandidate],
+                progress: ProgressCallback | None,
+                cancel: CancellationToken | None) -> list[StarshotCandidate]:
+
+        max_workers = min(pool_workers(self._max_workers), len(candidates))
+        # A few chunks per worker, so the image is only sent with each chunk while the
+        # progress and the cancellation stay responsive
+        chunk_count = len(candidates) if max_workers <= 1 else min(len(candidates), 4 * max_workers)
+        chunks = [candidates[index::chunk_count] for index in range(chunk_count)]
+        searched = []
+
+        def chunk_done(chunk: list[StarshotCandidate]):
+            searched.extend(chunk)
+            self._report_progress(progress, f"Sweeping parameters ({len(searched)}/{len(candidates)})")
+            self._check_cancelled(cancel)
+
+        if max_workers <= 1:
+            for chunk in chunks:
+                chunk_done(_search_candidates(starshot, start_point, self._fwhm, chunk))
+
+            return searched
+
+        self._search_in_pool(starshot, start_point, chunks, max_workers, chunk_done)
+
+        return searched
+
+    def _search_in_pool(self, starshot: StarshotAnalysis, start_point: Point,
+                        chunks: list[list[StarshotCandidate]], max_workers: int,
+                        chunk_done: Callable[[list[StarshotCandidate]], None]):
+        results = _sweep_pool.run_all(max_workers, _search_candidates,
+                                      [(starshot, start_point, self._fwhm, chunk) for chunk in chunks])
+        killed = []
+
+        with closing(results):
+            for index, future in results:
+                try:
+                    chunk = future.result()
+                except Exception as err:
+                    # A chunk that killed its worker process on its own (e.g. out of memory)
+                    # is searched again one candidate at a time to find the culprits
+                    if isinstance(err, BrokenProcessPool) and len(chunks[index]) > 1:
+                        killed.extend(chunks[index])
+                        continue
+
+                    chunk = _failed_candidates(chunks[index], err)
+
+                chunk_done(chunk)
+
+        if killed:
+            self._search_in_pool(starshot, start_point, [[candidate] for candidate in killed],
+                                 max_workers, chunk_done)
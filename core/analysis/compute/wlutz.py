@@ -0,0 +1,449 @@
+import os
+import os.path as osp
+import copy
+import io
+from concurrent.futures import as_completed
+from dataclasses import dataclass
+
+import matplotlib.pyplot as plt
+from pylinac import WinstonLutz, WinstonLutz2D
+from pylinac.winston_lutz import (bb_projection_with_rotation, Axis, BB3D, BBArrangement,
+                                  BBFieldMatch, BB_ERROR_MESSAGE)
+from pylinac.core.geometry import cos, sin, Point, Vector
+from pylinac.core.scale import MachineScale
+from pylinac.core.image_generator.simulators import Simulator
+from pylinac.core.image_generator.layers import PerfectBBLayer, Layer
+from pathlib import Path
+import numpy as np
+from scipy import ndimage
+from typing import BinaryIO
+
+from core.analysis.compute.base import (AnalysisRunner, AnalysisCancelled,
+                                        CancellationToken, ProgressCallback)
+from core.analysis.compute.process import WorkerPool, pool_workers
+from core.database.results import AnalysisRecord
+from core.image.dicom import dicom_cache
+
+# Pool for the per-image analyses, kept between analyses of the same process so the
+# worker processes only pay the pylinac import once
+_image_pool = WorkerPool()
+
+def _analyze_image(img: WinstonLutz2D, bb_size_mm: float, low_density_bb: bool,
+                   open_field: bool) -> WinstonLutz2D:
+    img.analyze(bb_size_mm, low_density_bb, open_field)
+    return img
+
+class WLImage(WinstonLutz2D):
+    """
+    WinstonLutz2D that keeps the detected fields and BB positions of its analysis, so
+    a virtual shift can be applied without analyzing the image again.
+    """
+
+    def __init__(self, file: str | BinaryIO | Path, use_filenames: bool = False, **kwargs):
+        # Same as WinstonLutz2D.__init__, with the image decoded through the shared cache
+        if conditions := kwargs.pop("detection_conditions", False):
+            self.detection_conditions = conditions
+
+        dicom_cache().load_into(self, file, use_filenames = use_filenames, **kwargs)
+        self._is_analyzed = False
+        self._released_shape = None
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        if self.array is None:
+            return self._released_shape
+
+        return self.array.shape
+
+    def release_array(self):
+        """
+        Drop the pixel array once analyzed, the results only need its shape.
+        """
+        self._released_shape = self.array.shape
+        self.array = None
+
+    def find_field_matches(self, field_caxs: list[Point]) -> dict[str, Point]:
+        self._field_matches = super().find_field_matches(field_caxs)
+        return self._field_matches
+
+    def find_bb_centroids(self, *args, **kwargs) -> list[Point]:
+        detected_points = super().find_bb_centroids(*args, **kwargs)
+        # pylinac shifts the detected points in place, keep unshifted copies
+        self._detected_bb_points = [copy.copy(point) for point in detected_points]
+        return detected_points
+
+    def apply_shift(self, shift_vector: Vector):
+        """
+        Match the BB again after moving the detected BB positions by ``shift_vector``.
+        The field edges, EPID centre and BB search of the first analysis are reused, only
+        the BB-relative geometry is recomputed.
+        """
+        lat, sup_inf = bb_projection_with_rotation(
+            offset_left=-shift_vector.x,
+            offset_up=shift_vector.z,
+            offset_in=shift_vector.y,
+            sad=self.sad,
+            gantry=self.gantry_angle,
+            couch=self.couch_angle,
+        )
+
+        # the detected points are in image space, so the vertical shift is subtracted
+        detected_bb_points = [Point(point.x + lat * self.dpmm, point.y - sup_inf * self.dpmm)
+                              for point in self._detected_bb_points]
+
+        bb_matches = self.find_bb_matches(detected_points=detected_bb_points)
+        if len(bb_matches) != len(self._field_matches):
+            raise ValueError("The number of detected fields and BBs do not match")
+        if not bb_matches:
+            raise ValueError(BB_ERROR_MESSAGE)
+
+        self.arrangement_matches = {
+            bb_name: BBFieldMatch(
+                epid=self.center,
+                field=self._field_matches[bb_name],
+                bb=bb_match,
+                dpmm=self.dpmm,
+                gantry_angle=self.gantry_angle,
+                couch_angle=self.couch_angle,
+                sad=self.sad,
+            )
+            for bb_name, bb_match in bb_matches.items()
+        }
+        self.field_cax = self.arrangement_matches["Iso"].field
+        self.bb = self.arrangement_matches["Iso"].bb
+
+class WLAnalysis(WinstonLutz):
+    """
+    Winston-Lutz analysis without any Qt dependencies. The number of analyzed images
+    is passed to ``progress_callback`` after each image.
+
+    The images are independent of each other until the BB is reconstructed, so they
+    are analyzed in a pool of worker processes and put back in their original order.
+    """
+
+    image_type = WLImage
+
+    def __init__(self, directory: str | list[str] | Path,
+                 use_filenames: bool = False,
+                 axis_mapping: dict[str, tuple[int, int, int]] | None = None,
+                 progress_callback: ProgressCallback | None = None):
+        super().__init__(directory, use_filenames, axis_mapping)
+
+        self.progress_callback = progress_callback
+        self.image_data = []
+
+    def analyze(self,
+                bb_size_mm: float = 5,
+                machine_scale: MachineScale = MachineScale.IEC61217, 
+                low_density_bb: bool = False,
+                open_field: bool = False,
+                apply_virtual_shift: bool = False,
+                cancel: CancellationToken | None = None,
+                max_workers: int | None = None):
+        """
+        Analyze the images. If a cancellation token is given, it is checked before
+        each image is analyzed.
+
+        ``max_workers`` is the number of processes used for the per-image analysis
+        (by default this analysis' share of the idle cores, see ``pool_workers``).
+        With 1 the images are analyzed one after another in the current process.
+        """
+        # Initial counter value for the progress bar
+        self.progress_counter = 0
+        self.machine_scale = machine_scale
+
+        if self.is_from_cbct:
+            low_density_bb = True
+            open_field = True
+
+        self.analyze_images(bb_size_mm, low_density_bb, open_field,
+                            cancel = cancel, max_workers = max_workers,
+                            report_progress = True)
+
+        # in the vanilla WL case, the BB can only be represented by non-couch-kick images
+        # the ray trace cannot handle the kick currently
+        bb_config = BBArrangement.ISO[0]
+        bb_config.bb_size_mm = bb_size_mm
+        self.bb = BB3D(
+            bb_config=bb_config,
+            bb_matches=[img.arrangement_matches["Iso"] for img in self.images],
+            scale=self.machine_scale,
+        )
+        if apply_virtual_shift:
+            # The shift only moves the BB, so only the BB matching is redone for each image
+            shift = self.bb_shift_vector
+            self._virtual_shift = self.bb_shift_instructions()
+            for img in self.images:
+                if cancel is not None:
+                    cancel.check()
+
+                img.apply_shift(shift)
+
+            self.bb = BB3D(
+                bb_config=bb_config,
+                bb_matches=[img.arrangement_matches["Iso"] for img in self.images],
+                scale=self.machine_scale,
+            )
+
+        # The image details show the BB positions after the virtual shift, if any
+        for img in self.images:
+            self.image_data.append(self.image_info(img))
+
+        self._is_analyzed = True
+        self._bb_diameter = bb_size_mm
+
+    def release_images(self):
+        """
+        Drop the loaded images so their arrays are freed right away.
+        """
+        self.images = []
+        self.image_data = []
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # pylinac caches the axis minimizations on the instance, they are computed again
+        state.pop("_minimize_axis", None)
+
+        return state
+
+    def release_unplotted_arrays(self):
+        """
+        Drop the arrays of the images the summary plot doesn't show (only the first image
+        of each axis is drawn), so the analysis can be sent back from a worker process.
+        """
+        plotted = set()
+        for axis in (Axis.GANTRY, Axis.COLLIMATOR, Axis.COUCH):
+            images = [img for img in self.images if img.variable_axis in (axis, Axis.REFERENCE)]
+            if images:
+                plotted.add(id(images[0]))
+
+        for img in self.images:
+            if id(img) not in plotted:
+                img.release_array()
+
+    def get_publishable_plot(self) -> io.BytesIO:
+        """
+        Summary plot of the analysis as a PDF for the report.
+        """
+        summary_plot = io.BytesIO()
+        self.save_summary(summary_plot, format = "pdf",
+                          pad_inches = 0.0, bbox_inches='tight')
+        plt.close()
+
+        return summary_plot
+
+    def analyze_images(self, bb_size_mm: float, low_density_bb: bool, open_field: bool,
+                       cancel: CancellationToken | None = None,
+                       max_workers: int | None = None,
+                       report_progress: bool = False):
+        """
+        Run ``WinstonLutz2D.analyze`` on every image, in worker processes if
+        ``max_workers`` allows it. The images are replaced by their analyzed copies
+        in the original order.
+        """
+        max_workers = min(pool_workers(max_workers), len(self.images))
+
+        if max_workers <= 1:
+            for img in self.images:
+                if cancel is not None:
+                    cancel.check()
+
+                img.analyze(bb_size_mm, low_density_bb, open_field)
+
+                if report_progress:
+                    self.report_image_analyzed()
+
+            return
+
+        if cancel is not None:
+            cancel.check()
+
+        futures = {_image_pool.submit(max_workers, _analyze_image, img, bb_size_mm,
+                                      low_density_bb, open_field): index
+                   for index, img in enumerate(self.images)}
+
+        try:
+            for future in as_completed(futures):
+                self.images[futures[future]] = future.result()
+
+                if cancel is not None:
+                    cancel.check()
+
+                if report_progress:
+                    self.report_image_analyzed()
+
+        except BaseException:
+            for future in futures:
+                future.cancel()
+
+            raise
+
+    def image_info(self, img: WinstonLutz2D) -> dict:
+        return {
+            "file_path": str(img.path),
+            "filename": Path(str(img.path)).name,
+            "bb_location": {"x": img.bb.x, "y": img.bb.y},
+            "bb_outline_coords": img.bb,
+            "field_cax": {"x": img.field_cax.x, "y": img.field_cax.y},
+            "epid": {"x": img.epid.x, "y": img.epid.y},
+            "cax_to_bb_dist": img.cax2bb_distance,
+            "cax_to_epid_dist": img.cax2epid_distance,
+            "gantry_angle": f"{img.gantry_angle:3.2f}",
+            "collimator_angle": f"{img.collimator_angle:3.2f}",
+            "couch_angle": f"{img.couch_angle:3.2f}",
+            "delta_u": f"{(img.bb.x - img.field_cax.x) / img.dpmm:3.2f}",
+            "delta_v": f"{(img.bb.y - img.field_cax.y) / img.dpmm:3.2f}"
+        }
+
+    def update_image_info(self, img: WinstonLutz2D):
+        self.image_data.append(self.image_info(img))
+        self.report_image_analyzed()
+
+    def report_image_analyzed(self):
+        self.progress_counter += 1
+        if self.progress_callback is not None:
+            self.progress_callback(self.progress_counter)
+
+@dataclass
+class WinstonLutzResult:
+    results_data: dict
+    bb_shift_instructions: str
+    wl: WLAnalysis
+    record: AnalysisRecord | None = None
+
+class WinstonLutzRunner(AnalysisRunner):
+
+    execution_parameters = ("image_workers",)
+
+    def __init__(self, images: list[str],
+                 bb_size: float = 5.0,
+                 use_filenames: bool = False,
+                 apply_virtual_shift: bool = False,
+                 image_workers: int | None = None):
+
+        self._images = images
+        self._bb_size = bb_size
+        self._use_filenames = use_filenames
+        self._apply_virtual_shift = apply_virtual_shift
+        self._image_workers = image_workers
+
+    def run(self, progress: ProgressCallback | None = None,
+            cancel: CancellationToken | None = None) -> WinstonLutzResult:
+        """
+        Analyze the Winston-Lutz images. ``progress`` receives the number of images
+        analyzed so far. The analysis is returned for the summary plot of the report,
+        without the image arrays the plot doesn't show.
+        """
+        wl = WLAnalysis(self._images, use_filenames = self._use_filenames,
+                        progress_callback = progress)
+
+        try:
+            wl.analyze(bb_size_mm = self._bb_size,
+                       apply_virtual_shift = self._apply_virtual_shift,
+                       cancel = cancel, max_workers = self._image_workers)
+            self._check_cancelled(cancel)
+
+        except AnalysisCancelled:
+            # The traceback keeps this frame alive, free the images before leaving
+            wl.release_images()
+            raise
+
+        wl_data = wl.results_data(as_dict=True)
+
+        # Per image values are stored as arrays, in the order of the images
+        record = AnalysisRecord.from_results(
+            "winston_lutz", wl_data, wl.images[0].metadata,
+            exclude = ("keyed_image_details",),
+            parameters = self.parameters(),
+            arrays = {"gantry_angle": np.array([img.gantry_angle for img in wl.images]),
+                      "collimator_angle": np.array([img.collimator_angle for img in wl.images]),
+                      "couch_angle": np.array([img.couch_angle for img in wl.images]),
+                      "cax2bb_distance": np.array([img.cax2bb_distance for img in wl.images]),
+                      "cax2epid_distance": np.array([img.cax2epid_distance for img in wl.images])})
+
+        wl_data["image_details"] = wl.image_data
+
+        wl.release_unplotted_arrays()
+        # The progress callback may not survive the trip back from a worker process
+        wl.progress_callback = None
+
+        return WinstonLutzResult(results_data = wl_data,
+                                 bb_shift_instructions = str(wl.bb_shift_instructions()),
+                                 wl = wl,
+                                 record = record)
+
+def generate_winstonlutz(
+    simulator: Simulator,
+    field_layer: type[Layer],
+    dir_out: str,
+    field_size_mm: tuple[float, float] = (30, 30),
+    final_layers: list[Layer] | None = None,
+    bb_size_mm: float = 5,
+    offset_mm_left: float = 0,
+    offset_mm_up: float = 0,
+    offset_mm_in: float = 0,
+    image_axes: ((int, int, int), ...) = (
+        (0, 0, 0),
+        (90, 0, 0),
+        (180, 0, 0),
+        (270, 0, 0),
+    ),
+    gantry_tilt: float = 0,
+    gantry_sag: float = 0,
+    clean_dir: bool = True,
+    field_alpha: float = 1.0,
+    bb_alpha: float = -0.5,
+) -> list[str]:
+    
+    if field_alpha + bb_alpha > 1:
+        raise ValueError("field_alpha and bb_alpha must sum to <=1")
+    if field_alpha - bb_alpha < 0:
+        raise ValueError("field_alpha and bb_alpha must have a sum >=0")
+    if not osp.isdir(dir_out):
+        os.mkdir(dir_out)
+    if clean_dir:
+        for pdir, _, files in os.walk(dir_out):
+            [os.remove(osp.join(pdir, f)) for f in files]
+    file_names = []
+    for gantry, coll, couch in image_axes:
+        sim_single = copy.copy(simulator)
+        sim_single.add_layer(
+            field_layer(
+                field_size_mm=field_size_mm,
+                cax_offset_mm=(gantry_tilt * cos(gantry), gantry_sag * sin(gantry)),
+                alpha=field_alpha,
+            )
+        )
+
+        # Rotate the image now
+        sim_single.image = ndimage.rotate(sim_single.image, -coll,
+                                          reshape = False, mode = 'nearest')
+
+        gplane_offset, long_offset = bb_projection_with_rotation(
+            offset_left=offset_mm_left,
+            offset_up=offset_mm_up,
+            offset_in=offset_mm_in,
+            gantry=gantry,
+            couch=couch,
+            sad=1000,
+        )
+        sim_single.add_layer(
+            PerfectBBLayer(
+                cax_offset_mm=(long_offset, gplane_offset),
+                bb_size_mm=bb_size_mm,
+                alpha=bb_alpha,
+            )
+        )
+        if final_layers is not None:
+            for layer in final_layers:
+                sim_single.add_layer(layer)
+        file_name = f"WL G={gantry}, C={coll}, P={couch}; Field={field_size_mm}mm; BB={bb_size_mm}mm @ left={offset_mm_left}, in={offset_mm_in}, up={offset_mm_up}; Gantry tilt={gantry_tilt}, Gantry sag={gantry_sag}.dcm"
+        sim_single.generate_dicom(
+            osp.join(dir_out, file_name),
+            gantry_angle=gantry,
+            coll_angle=coll,
+            table_angle=couch,
+        )
+        file_names.append(file_name)
+    return file_names
+
@@ -1,28 +1,44 @@
 
-from PySide6.QtCore import Signal, Slot, QObject
+from PySide6.QtCore import Signal
 
-import io
 import numpy as np
 import pyqtgraph as pg
-import traceback
-from typing import BinaryIO, Tuple, Union
+from typing import Sequence, Tuple
 
 from pylinac.core.hill import Hill
-from pylinac.core.profile import Edge, Interpolation, Normalization, SingleProfile
-from pylinac.core.exceptions import NotAnalyzed
-from pylinac.field_analysis import Centering, FieldAnalysis, Protocol
+from pylinac.core.profile import Edge, Interpolation, Normalization
+from pylinac.field_analysis import Centering, Protocol
+
+from core.analysis.compute.field_analysis import (FAAnalysis, FieldAnalysisBatchRunner,
+                                                  FieldAnalysisResult, FieldAnalysisRunner,
+                                                  FieldBatchResult)
+from core.analysis.compute.plotting import PublishablePlots
+from core.analysis.worker import QAnalysisWorker
+from core.configuration.config import SettingsConfig
 
 pg.setConfigOptions(antialias = True, imageAxisOrder='row-major')
 
-class QFieldAnalysis(FieldAnalysis):
+class QFieldAnalysis():
+    """
+    Qt adapter that draws the results of a FAAnalysis with pyqtgraph. Attributes that
+    are not defined here are looked up on the wrapped analysis object.
+    """
 
-    def __init__(self, path: str | BinaryIO, 
-                 filter: int | None = None, 
-                 image_kwargs: dict | None = None):
-        
-        super().__init__(path, filter, image_kwargs)
+    def __init__(self, fa: FAAnalysis):
+        self.fa = fa
+
+        self._analyzed_image_plot_widget = None
+
+    def __getattr__(self, name: str):
+        return getattr(self.fa, name)
 
-        self.analyzed_image_plot_widget = pg.GraphicsLayoutWidget()
+    @property
+    def analyzed_image_plot_widget(self) -> pg.GraphicsLayoutWidget:
+        # The plot widget is only created once it is needed
+        if self._analyzed_image_plot_widget is None:
+            self._analyzed_image_plot_widget = pg.GraphicsLayoutWidget()
+
+        return self._analyzed_image_plot_widget
 
     def qplot_analyzed_image(self):
         self.analyzed_image_plot_widget.clear()
@@ -232,209 +248,11 @@ class QFieldAnalysis(FieldAnalysis):
                f"{text}</span></p>"
         
         return text
-    
-    def results(self, as_str=True) -> str:
-        """Get the results of the analysis.
-
-        Parameters
-        ----------
-        as_str
-            If True, return a simple string. If False, return a list of each line of text.
-        """
-        if not self._is_analyzed:
-            raise NotAnalyzed("Image is not analyzed yet. Use analyze() first.")
-
-        results = [
-            "Field Analysis Results",
-            "-----" * 10,
-            f"File: {self._path}",
-            f"Protocol: {self._protocol.name}",
-        ]
-        if not self._from_device:
-            results += [
-                f"Centering method: {self._centering.value}",
-            ]
-        results += [
-            f"Normalization method: {self.horiz_profile._norm_method.value}",
-            f"Interpolation: {self.horiz_profile._interp_method.value}",
-            f"Edge detection method: {self.horiz_profile._edge_method.value}",
-            "",
-            f"Penumbra width ({self._penumbra[0]}/{self._penumbra[1]}):",
-            "-----" * 10,
-            f"Left: {self._results['left_penumbra_mm']:3.1f} mm",
-            f"Right: {self._results['right_penumbra_mm']:3.1f} mm",
-            f"Top: {self._results['top_penumbra_mm']:3.1f} mm",
-            f"Bottom: {self._results['bottom_penumbra_mm']:3.1f} mm",
-            "",
-        ]
-        if self._edge_detection == Edge.INFLECTION_HILL:
-            results += [
-                "Penumbra gradients:",
-                "-----" * 10,
-                f"Left gradient: {self._results['left_penumbra_percent_mm']:3.2f}% /mm",
-                f"Right gradient: {self._results['right_penumbra_percent_mm']:3.2f}% /mm",
-                f"Top gradient: {self._results['top_penumbra_percent_mm']:3.2f}% /mm",
-                f"Bottom gradient: {self._results['bottom_penumbra_percent_mm']:3.2f}% /mm",
-                "",
-            ]
-        results += [
-            "Field Size:",
-            "-----" * 10,
-            f"Horizontal: {self._results['field_size_horizontal_mm']:3.1f} mm",
-            f"Vertical: {self._results['field_size_vertical_mm']:3.1f} mm",
-            "",
-            "CAX to edge distances:",
-            "-----" * 10,
-            f"CAX -> Top edge: {self._results['cax_to_top_mm']:3.1f} mm",
-            f"CAX -> Bottom edge: {self._results['cax_to_bottom_mm']:3.1f} mm",
-            f"CAX -> Left edge: {self._results['cax_to_left_mm']:3.1f} mm",
-            f"CAX -> Right edge: {self._results['cax_to_right_mm']:3.1f} mm",
-            "",
-        ]
-        if not self._from_device:
-            results += [
-                "Central ROI stats:",
-                "-----" * 10,
-                f"Mean: {self.central_roi.mean:3.3f}",
-                f"Max: {self.central_roi.max:3.3f}",
-                f"Min: {self.central_roi.min:3.3f}",
-                f"Standard deviation: {self.central_roi.std:3.3f}",
-                "",
-            ]
-        if self._is_FFF:
-            results += [
-                "'Top' vertical distance from CAX: {:3.1f} mm".format(
-                    self._results["top_vertical_distance_from_cax_mm"]
-                ),
-                "'Top' horizontal distance from CAX: {:3.1f} mm".format(
-                    self._results["top_horizontal_distance_from_cax_mm"]
-                ),
-                "'Top' vertical distance from beam center: {:3.1f} mm".format(
-                    self._results["top_vertical_distance_from_beam_center_mm"]
-                ),
-                "'Top' horizontal distance from beam center: {:3.1f} mm".format(
-                    self._results["top_horizontal_distance_from_beam_center_mm"]
-                ),
-                "",
-            ]
-        results += [
-            f"Top slope: {self._results['top_slope_percent_mm']:3.3f}% /mm",
-            f"Bottom slope: {self._results['bottom_slope_percent_mm']:3.3f}% /mm",
-            f"Left slope: {self._results['left_slope_percent_mm']:3.3f}% /mm",
-            f"Right slope: {self._results['right_slope_percent_mm']:3.3f}% /mm",
-            "",
-            "Protocol data:",
-            "-----" * 10,
-        ]
-
-        for name, item in self._protocol.value.items():
-            results.append(
-                f"Vertical {name}: {self._extra_results[name + '_vertical']:3.3f}{item['unit']}"
-            )
-            results.append(
-                f"Horizontal {name}: {self._extra_results[name + '_horizontal']:3.3f}{item['unit']}"
-            )
-            results.append("")
-
-        if as_str:
-            results = "\n".join(result for result in results)
-        return results
-
-    def get_publishable_results(self) -> dict:
-        results = {}
-
-        results[f"Penumbra widths ({self._penumbra[0]}/{self._penumbra[1]}):"] = [
-            ["Left width", f"{self._results['left_penumbra_mm']:3.1f} mm"],
-            ["Right width", f"{self._results['right_penumbra_mm']:3.1f} mm"],
-            ["Top width", f"{self._results['top_penumbra_mm']:3.1f} mm"],
-            ["Bottom width", f"{self._results['bottom_penumbra_mm']:3.1f} mm"]
-        ]
-
-        if self._edge_detection == Edge.INFLECTION_HILL:
-            
-            results["Penumbra gradients:"] = [
-                ["Left gradient",f"{self._results['left_penumbra_percent_mm']:3.2f}% /mm"],
-                ["Right gradient", f"{self._results['right_penumbra_percent_mm']:3.2f}% /mm"],
-                ["Top gradient", f"{self._results['top_penumbra_percent_mm']:3.2f}% /mm"],
-                ["Bottom gradient", f"{self._results['bottom_penumbra_percent_mm']:3.2f}% /mm"],
-            ]
-        
-        results["Field Size:"] = [
-            ["Horizontal", f"{self._results['field_size_horizontal_mm']:3.1f} mm"],
-            ["Vertical", f"{self._results['field_size_vertical_mm']:3.1f} mm"]
-        ]
-
-        results["CAX to edge distances:"] = [
-            ["CAX to top edge", f"{self._results['cax_to_top_mm']:3.1f} mm"],
-            ["CAX to bottom edge", f"{self._results['cax_to_bottom_mm']:3.1f} mm"],
-            ["CAX to left edge", f"{self._results['cax_to_left_mm']:3.1f} mm"],
-            ["CAX to right edge", f"{self._results['cax_to_right_mm']:3.1f} mm"],
-        ]
-
-        if not self._from_device:
-            results["Central ROI statistics:"] = [
-                ["Mean", f"{self.central_roi.mean:3.3f}"],
-                ["Max", f"{self.central_roi.max:3.3f}"],
-                ["Min", f"{self.central_roi.min:3.3f}"],
-                ["Standard deviation", f"{self.central_roi.std:3.3f}"],
-            ]
-
-        if self._is_FFF:
-            results["Central ROI statistics:"].extend([
-                ["", ""],
-                ["Top vertical distance from CAX", "{:3.1f} mm".format(
-                    self._results["top_vertical_distance_from_cax_mm"]
-                )],
-                ["Top horizontal distance from CAX", "{:3.1f} mm".format(
-                    self._results["top_horizontal_distance_from_cax_mm"]
-                )],
-                ["Top vertical distance from beam center", "{:3.1f} mm".format(
-                    self._results["top_vertical_distance_from_beam_center_mm"]
-                )],
-                ["Top horizontal distance from beam center", "{:3.1f} mm".format(
-                    self._results["top_horizontal_distance_from_beam_center_mm"]
-                )],
-            ])
-
-        results["Central ROI statistics:"].extend([
-            ["", ""],
-            ["Top slope", f"{self._results['top_slope_percent_mm']:3.3f}% /mm"],
-            ["Bottom slope", f"{self._results['bottom_slope_percent_mm']:3.3f}% /mm"],
-            ["Left slope", f"{self._results['left_slope_percent_mm']:3.3f}% /mm"],
-            ["Right slope", f"{self._results['right_slope_percent_mm']:3.3f}% /mm"]
-        ])
-
-        results["Protocol data:"] = []
-
-        for name, item in self._protocol.value.items():
-            results["Protocol data:"].extend([
-                [f"Vertical {name}", f"{self._extra_results[name + '_vertical']:3.3f}{item['unit']}"],
-                [f"Horizontal {name}", f"{self._extra_results[name + '_horizontal']:3.3f}{item['unit']}"]
-            ])
-
-        return results
-
-
-    def get_publishable_plots(self) -> list[io.BytesIO]:
-        # set files for the vertical and horizontal profile plots
-        # setting figsize = (4.5, 4.5) seems to do wonders on the produced pdf
-        # TODO code does not apply for device analysis
-        files = [io.BytesIO(), io.BytesIO()]
-        figs, names = self.plot_analyzed_image(
-            show = False, split_plots=True, figsize = (4.5 ,4.5)
-        )
 
-        figs[1].savefig(files[0], format = "pdf") # vertical profile
-        figs[2].savefig(files[1], format = "pdf") # horizontal profile
-
-        return files
-
-class QFieldAnalysisWorker(QObject):
+class QFieldAnalysisWorker(QAnalysisWorker):
 
     analysis_progress = Signal(str)
     analysis_results_ready =  Signal(dict)
-    thread_finished = Signal()
-    analysis_failed = Signal(str)
 
     def __init__(self,
                  path: str,
@@ -459,56 +277,63 @@ class QFieldAnalysisWorker(QObject):
         
         super().__init__()
 
-        self._protocol = protocol
-        self._centering = centering
-        self._vert_position = vert_position
-        self._horiz_position = horiz_position
-        self._vert_width = vert_width
-        self._horiz_width = horiz_width
-        self._in_field_ratio = in_field_ratio
-        self._slope_exclusion_ratio = slope_exclusion_ratio
-        self._invert = invert
-        self._is_FFF = is_FFF
-        self._penumbra = penumbra
-        self._interpolation = interpolation
-        self._interpolation_res_mm = interpolation_resolution_mm
-        self._ground = ground
-        self._normalization_method = normalization_method
-        self._edge_detection_method = edge_detection_method
-        self._edge_smoothing_ratio = edge_smoothing_ratio
-        self._hill_window_ratio = hill_window_ratio
-
-        self._fa = QFieldAnalysis(path)
-
-    def analyze(self):
-
-        try:
-            self._fa.analyze(protocol = self._protocol,
-                             centering = self._centering,
-                             vert_position = self._vert_position,
-                             horiz_position = self._horiz_position,
-                             vert_width = self._vert_width,
-                             horiz_width = self._horiz_width,
-                             in_field_ratio = self._in_field_ratio,
-                             slope_exclusion_ratio = self._slope_exclusion_ratio,
-                             invert = self._invert,
-                             is_FFF = self._is_FFF,
-                             interpolation = self._interpolation,
-                             interpolation_resolution_mm = self._interpolation_res_mm,
-                             normalization_method = self._normalization_method,
-                             ground = self._ground,
-                             edge_detection_method = self._edge_detection_method,
-                             edge_smoothing_ratio = self._edge_smoothing_ratio,
-                             hill_window_ratio = self._hill_window_ratio)
-
-            data = self._fa.results()
-            
-            results = {"summary_text": data,
-                       "field_analysis_obj": self._fa}
+        self.runner = FieldAnalysisRunner(path,
+                                          protocol,
+                                          centering,
+                                          vert_position,
+                                          horiz_position,
+                                          vert_width,
+                                          horiz_width,
+                                          in_field_ratio,
+                                          slope_exclusion_ratio,
+                                          invert,
+                                          is_FFF,
+                                          penumbra,
+                                          interpolation,
+                                          interpolation_resolution_mm,
+                                          ground,
+                                          normalization_method,
+                                          edge_detection_method,
+                                          edge_smoothing_ratio,
+                                          hill_window_ratio)
+
+    def report_progress(self, value: str):
+        self.analysis_progress.emit(value)
+
+    def handle_result(self, result: FieldAnalysisResult):
+        fa = QFieldAnalysis(result.field_analysis)
+        results = {"summary_text": result.summary_text,
+                   "field_analysis_obj": fa,
+                   "publishable_plots": PublishablePlots(fa.get_publishable_plots, "field_analysis",
+                                                         self.runner.cache_parameters())}
+
+        self.analysis_results_ready.emit(results)
+        self.thread_finished.emit()
+
+class QFieldAnalysisBatchWorker(QAnalysisWorker):
+    """
+    Field analysis of many images with the same parameters (see FieldAnalysisBatchRunner).
+    ``batch_ready`` gives the FieldBatchResult, with the images that failed among its
+    entries.
+    """
 
-            self.analysis_results_ready.emit(results)
-            self.thread_finished.emit()
-            
-        except Exception as err:
-            self.analysis_failed.emit(traceback.format_exception_only(err)[-1])
-            self.thread_finished.emit()
+    analysis_progress = Signal(str)
+    batch_ready = Signal(object)
+
+    def __init__(self, paths: str | Sequence[str], **kwargs):
+        super().__init__()
+
+        # Images are analyzed in processes like the images of a Winston-Lutz analysis
+        image_workers = SettingsConfig().getConfig().get("analysis", {}).get("image_workers")
+        self.runner = FieldAnalysisBatchRunner(paths, max_workers = image_workers, **kwargs)
+
+    def report_progress(self, value: str):
+        self.analysis_progress.emit(value)
+
+    def save_record(self, result: FieldBatchResult):
+        for entry in result.entries:
+            super().save_record(entry)
+
+    def handle_result(self, result: FieldBatchResult):
+        self.batch_ready.emit(result)
+        self.thread_finished.emit()
@@ -1,61 +1,41 @@
-import io
-from PySide6.QtCore import Signal, Slot, QObject, QCoreApplication
-from pylinac.core import image
-from pylinac.core.image_generator.simulators import Simulator
-from pylinac.core.image_generator.layers import (FilteredFieldLayer,
-                                                 FilterFreeFieldLayer,
-                                                 PerfectFieldLayer, 
-                                                 Layer)
-from pylinac.picketfence import PicketFence, MLC, MLCArrangement, Orientation
-
-import matplotlib.pyplot as plt
-import traceback
-import os.path as osp
+from PySide6.QtCore import Signal
+from pylinac.picketfence import MLC, MLCArrangement, Orientation
+
 import numpy as np
 import pyqtgraph as pg
-from scipy import ndimage
-from py_linq import Enumerable
 from pathlib import Path
-from tempfile import TemporaryDirectory
-from typing import BinaryIO, Optional, Union, Sequence
-import time
+from typing import BinaryIO, Optional, Union
 
 import gc
 
+from core.analysis.compute.picket_fence import (PFAnalysis, PicketFenceResult, PicketFenceRunner,
+                                                generate_picket_fence)
+from core.analysis.compute.plotting import PublishablePlots
+from core.analysis.worker import QAnalysisWorker
+
 pg.setConfigOptions(antialias = True, imageAxisOrder='row-major', enableExperimental=True)
 
-class QPicketFence(PicketFence):
+class QPicketFence():
+    """
+    Qt adapter that draws the results of a PFAnalysis with pyqtgraph. Attributes that
+    are not defined here are looked up on the wrapped analysis object.
+    """
 
-    def __init__(self, filename: Union[str, list[str], Path, BinaryIO],
-                 update_signal: Signal = None,
-                 filter: int | None = None,
-                 log: str | None = None,
-                 use_filename: bool = False,
-                 mlc: Union[MLC, MLCArrangement, str] = MLC.MILLENNIUM,
-                 crop_mm: int = 3,
-                 image_kwargs: Optional[dict] = None):
+    def __init__(self, pf: PFAnalysis):
+        self.pf = pf
 
-        self.mlc_type = mlc
-        
-        # Widgets for analyzed image plots
-        self.analyzed_image_plot_widget = pg.GraphicsLayoutWidget()
-        
-        if isinstance(filename, list):
-            with TemporaryDirectory() as tmp:
-                temp_file = osp.join(tmp, "temp_self.pf.dcm")
-                image.load_multiples(filename, dtype = np.uint16,
-                                     kwargs = image_kwargs).save(temp_file)
-
-                super().__init__(temp_file, filter, log,
-                                 use_filename, mlc, crop_mm, image_kwargs)
-        else:
-            super().__init__(filename, filter, log,
-                        use_filename, mlc, crop_mm, image_kwargs)
-                    
-        self.update_signal = update_signal
+        self._analyzed_image_plot_widget = None
 
-    def set_update_signal(self, update_signal: Signal):
-        self.update_signal = update_signal
+    def __getattr__(self, name: str):
+        return getattr(self.pf, name)
+
+    @property
+    def analyzed_image_plot_widget(self) -> pg.GraphicsLayoutWidget:
+        # Widgets for analyzed image plots are only created once they are needed
+        if self._analyzed_image_plot_widget is None:
+            self._analyzed_image_plot_widget = pg.GraphicsLayoutWidget()
+
+        return self._analyzed_image_plot_widget
 
     def init_profile_plot(self):
         # Widgets for leaf profile plots
@@ -151,35 +131,10 @@ class QPicketFence(PicketFence):
         #------ Add error plot data
         error_plot_item.addItem(tolerance_line)
 
-        # add errors
-        if self.orientation == Orientation.UP_DOWN:
-            pos = [
-                position.marker_lines[0].center.y
-                for position in self.pickets[0].mlc_meas
-            ]
-            
-        else:
-            pos = [
-                position.marker_lines[0].center.x
-                for position in self.pickets[0].mlc_meas
-            ]
-
-        error_stdev = []
-        error_vals = []
-        
-        for leaf_num in {m.leaf_num for m in self.mlc_meas}:
-            error_vals.append(
-                np.max(
-                    [np.abs(m.error) for m in self.mlc_meas if m.leaf_num == leaf_num]
-                )
-            )
-            error_stdev.append(
-                np.std([m.error for m in self.mlc_meas if m.leaf_num == leaf_num])
-            )
-
-        pos = np.array(pos)
-        error_stdev = np.array(error_stdev)
-        error_vals = np.array(error_vals)
+        # add errors, one bar per leaf at the leaf centre
+        pos = self.measurements.leaf_position()
+        error_vals = self.measurements.leaf_max_abs_error()
+        error_stdev = self.measurements.leaf_std_error()
 
         bar_brush = (0, 0, 255, 100)
 
@@ -252,25 +207,44 @@ class QPicketFence(PicketFence):
                                               )
 
         image_plot_item.disableAutoRange()
-        now = time.time()
-        # Add mlc peaks
-        for mlc_meas in self.mlc_meas:
-            # plot mlc peaks 
-            for idx, line in enumerate(mlc_meas.marker_lines):
-                
-                curve = pg.PlotCurveItem(x=[line.point1.x, line.point2.x], y=[line.point1.y, line.point2.y],
-                                         pen=pg.mkPen(color = mlc_meas.bg_color[idx], width = 2.0),
-                                         skipFiniteCheck=False,
-                                         )
-                pg.arrayToQPath
-                image_plot_item.addItem(curve)
-                QCoreApplication.processEvents()
+
+        # Add mlc peaks, one curve per colour with a line segment for each marker
+        for curve in self.marker_curves():
+            image_plot_item.addItem(curve)
         
         image_plot_item.enableAutoRange()
         error_plot_item.autoRange()
 
         gc.collect()
         
+    def marker_curves(self) -> list[pg.PlotCurveItem]:
+        """
+        The MLC marker lines, drawn as one disconnected curve per colour. Red markers are
+        out of tolerance, magenta markers are out of the action tolerance.
+        """
+        meas = self.measurements
+
+        half_width = meas.marker_width / 2
+        along = np.repeat(meas.position, 2)
+        across = np.column_stack((meas.leaf_center - half_width,
+                                  meas.leaf_center + half_width)).ravel()
+
+        if self.orientation == Orientation.UP_DOWN:
+            x_data, y_data = along, across
+        else:
+            x_data, y_data = across, along
+
+        colors = np.where(meas.passed, np.where(meas.passed_action, "b", "m"), "r")
+        curves = []
+
+        for color in np.unique(colors):
+            in_color = np.repeat(colors == color, 2)
+            curves.append(pg.PlotCurveItem(x = x_data[in_color], y = y_data[in_color],
+                                           connect = "pairs",
+                                           pen = pg.mkPen(color = color, width = 2.0)))
+
+        return curves
+
     def qplot_leaf_profile(self, leaf: int | str, picket: int):
         """
         Plot the profile of a leaf
@@ -279,23 +253,18 @@ class QPicketFence(PicketFence):
         self.profile_plot_widget.clear()
         #self.legend.clear()
 
-        mlc = Enumerable(self.mlc_meas).single(
-            lambda m: leaf in m.full_leaf_nums and m.picket_num == picket)
-        self.profile_plot_widget.getPlotItem().setTitle(f"Leaf error: {mlc.max_abs_error:2.3f} mm")
+        row, x_values, pix_vals = self.leaf_profiles.profile(leaf, picket)
+        mlc = self.mlc_meas[row]
 
-        #plot the pixel values 
-        if mlc._orientation == Orientation.UP_DOWN:
-            pix_vals = np.median(mlc._image_window, axis=0)
-        else:
-            pix_vals = np.median(mlc._image_window, axis=1)
-
-        offset_pixels = max(mlc._approximate_idx - mlc._spacing / 2, 0)
-        x_values = np.array(range(len(pix_vals))) + offset_pixels
+        meas = self.measurements
+        max_abs_error = np.max(np.abs(meas.error[meas.meas_index == row]))
+        self.profile_plot_widget.getPlotItem().setTitle(f"Leaf error: {max_abs_error:2.3f} mm")
 
+        #plot the pixel values 
         self.profile_plot_widget.plot(x=x_values, y=pix_vals)
 
         #plot the mlc position
-        pos = mlc.get_peak_positions()[0]
+        pos = mlc.position[0]
         mlc_pos_plot = pg.InfiniteLine(pos=pos,movable=False, angle=90, 
                        pen = mlc.bg_color[0], label=f'MLC position ({pos:2.2f})', 
                        labelOpts={'position':0.1, 'color': (135,206,235), 
@@ -346,31 +315,10 @@ class QPicketFence(PicketFence):
             #self.legend.addItem(lg_plot, "Guard rail")
             #self.legend.addItem(rg_plot, "Guard rail")
 
-    def get_publishable_plot(self) -> io.BytesIO:
-        """
-        Custom plot implementation to get smaller, high quality pdf images
-        """
-        pf_plot_data = io.BytesIO()
-
-        self.plot_analyzed_image(
-            True,
-            True,
-            False,
-            False,
-            False,
-            figure_size = (4.5 ,4.5)
-        )
-
-        plt.savefig(pf_plot_data, format = "pdf", pad_inches = 0.0, bbox_inches='tight')
-
-        return pf_plot_data
-
-class QPicketFenceWorker(QObject):
+class QPicketFenceWorker(QAnalysisWorker):
 
     analysis_progress = Signal(str)
     analysis_results_ready =  Signal(dict)
-    thread_finished = Signal()
-    analysis_failed = Signal(str)
 
     def __init__(self,filename: Union[str, list[str], Path, BinaryIO],
                  update_signal: Signal = None,
@@ -387,105 +335,28 @@ class QPicketFenceWorker(QObject):
                  image_kwargs: Optional[dict] = None,):
         super().__init__()
 
-        self._filename = filename
-        self._update_signal = update_signal
-        self._filter = filter
-        self._log = log
-        self._use_filename = use_filename
-        self._invert = invert
-        self._mlc = mlc
-        self._tolerance = tolerance
-        self._crop_mm = crop_mm
-        self._nominal_gap = nominal_gap
-        self._num_pickets = num_pickets
-        self._separate_leaves = separate_leaves
-        self._image_kwargs = image_kwargs
-
-        self._pf = QPicketFence(self._filename,
-                          self._update_signal,
-                          self._filter,
-                          self._log,
-                          self._use_filename,
-                          self._mlc,
-                          self._crop_mm,
-                          image_kwargs = self._image_kwargs)
-
-    @Slot()
-    def analyze(self):
-        """
-        Perform an analysis of a picket fence image or series of picket fence images
-        """
-        try:
-            self._pf.analyze(tolerance=self._tolerance, invert=self._invert, 
-                             separate_leaves=self._separate_leaves, num_pickets=self._num_pickets, 
-                             nominal_gap_mm=self._nominal_gap)
-
-            summary_text = [["Gantry angle:", f"{self._pf.image.gantry_angle:2.2f}°"],
-                       ["Collimator angle:", f"{self._pf.image.collimator_angle:2.2f}°"],
-                       ["Number of leaves failing:", str(len(self._pf.failed_leaves()))],
-                       ["Absolute median error:", f"{self._pf.abs_median_error:2.2f} mm"],
-                       ["Mean picket spacing:", f"{self._pf.mean_picket_spacing:2.2f} mm"]]
-            
-            if self._separate_leaves:
-                leaf_name = self._pf.max_error_leaf[0] + f"-{(int(self._pf.max_error_leaf[1:]) + 1)}"
-                summary_text.append(["Max Error:", f"{self._pf.max_error:2.3f} mm " \
-                 f"(Picket: {self._pf.max_error_picket + 1}, Leaf: {leaf_name})"])
-
-            else:
-                summary_text.append(["Max Error:", f"{self._pf.max_error:2.3f} mm " \
-                 f"(Picket: {self._pf.max_error_picket + 1}, Leaf: {self._pf.max_error_leaf + 1})"])  
-            
-            results = {"summary_text": summary_text,
-                       "picket_fence_obj": self._pf}
-            
-            self.analysis_results_ready.emit(results)
-            self.thread_finished.emit()
+        self.runner = PicketFenceRunner(filename,
+                                        filter,
+                                        log,
+                                        use_filename,
+                                        invert,
+                                        mlc,
+                                        crop_mm,
+                                        nominal_gap,
+                                        tolerance,
+                                        separate_leaves,
+                                        num_pickets,
+                                        image_kwargs)
+
+    def report_progress(self, value: str):
+        self.analysis_progress.emit(value)
+
+    def handle_result(self, result: PicketFenceResult):
+        pf = QPicketFence(result.picket_fence)
+        results = {"summary_text": result.summary_text,
+                   "picket_fence_obj": pf,
+                   "publishable_plots": PublishablePlots(pf.get_publishable_plot, "picket_fence",
+                                                         self.runner.cache_parameters())}
         
-        except Exception as err:
-            self.analysis_failed.emit(traceback.format_exception_only(err)[-1])
-            self.thread_finished.emit()
-            raise err
-
-def generate_picket_fence(
-        simulator: Simulator,
-        field_layer: type[FilterFreeFieldLayer | FilteredFieldLayer | PerfectFieldLayer],
-        file_out: str,
-        final_layers: list[Layer] = None,
-        pickets: int = 11,
-        picket_spacing_mm: int = 20,
-        picket_width_mm: int = 2,
-        picket_height_mm: int = 300,
-        gantry_angle: int = 0,
-        orientation: Orientation = Orientation.UP_DOWN,
-        picket_offset_error: Sequence | None = None,
-        image_rotation: float = 0.0
-    ):
-
-    picket_pos_mm = range(
-        -int((pickets - 1) * picket_spacing_mm / 2),
-        int((pickets - 1) * picket_spacing_mm / 2) + 1,
-        picket_spacing_mm,
-    )
-    for idx, pos in enumerate(picket_pos_mm):
-        if picket_offset_error is not None:
-            if len(picket_offset_error) != pickets:
-                raise ValueError(
-                    "The length of the error array must be the same as the number of pickets."
-                )
-            pos += picket_offset_error[idx]
-        if orientation == orientation.UP_DOWN:
-            position = (0, pos)
-            layout = (picket_height_mm, picket_width_mm)
-        else:
-            position = (pos, 0)
-            layout = (picket_width_mm, picket_height_mm)
-        simulator.add_layer(field_layer(layout, cax_offset_mm=position))
-    if final_layers is not None:
-        for layer in final_layers:
-            simulator.add_layer(layer)
-
-    # Rotate the image before DICOM generation
-    simulator.image = ndimage.rotate(simulator.image, -image_rotation,
-                                     reshape = False, mode = 'nearest')
-
-    simulator.generate_dicom(file_out, gantry_angle=gantry_angle)
+        self.analysis_results_ready.emit(results)
+        self.thread_finished.emit()
@@ -1,44 +1,42 @@
-from PySide6.QtCore import Signal, Slot, QObject
+from PySide6.QtCore import Signal
 
-from pylinac.planar_imaging import (ImagePhantomBase, LeedsTOR, LeedsTORBlue, LasVegas,
-                                    SNCkV, SNCMV, SNCMV12510, PTWEPIDQC, IBAPrimusA,
-                                    DoselabMC2kV, DoselabMC2MV, StandardImagingQC3,
-                                    StandardImagingQCkV, ElektaLasVegas)
 from pylinac.core.contrast import Contrast
 from pylinac.core.geometry import Circle, Rectangle
-from pylinac.settings import get_dicom_cmap
 
-import io
 from matplotlib.patches import Rectangle as MatplotRect
 from pathlib import Path
 from typing import BinaryIO
 
 import numpy as np
 import pyqtgraph as pg
-import enum
-import traceback
-
-class PHANTOM(enum.Enum):
-    DOSELAB_MC2_KV = "Doselab MC2 kV"
-    DOSELAB_MC2_MV = "Doselab MC2 MV"
-    IBA_PRIMUS_A = "IBA Primus A"
-    LAS_VEGAS = "Las Vegas"
-    ELEKTA_LAS_VEGAS = "Elekta Las Vegas"
-    LEEDS_TOR_RED = "Leeds TOR 18 (Red)"
-    LEEDS_TOR_BLUE = "Leeds TOR 18 (Blue)"
-    PTW_EPID_QC = "PTW EPID QC"
-    SNC_MV = "SNC MV"
-    SNC_MV_12510 = "SNC MV (12510)"
-    SNC_KV = "SNC kV"
-    STANDARD_IMAGING_QC3 = "Standard Imaging QC-3 MV"
-    STANDARD_IMAGING_QC_KV = "Standard Imaging QC kV"
+
+from core.analysis.compute.planar_imaging import (PHANTOM, PIAnalysis, PlanarImagingResult,
+                                                  PlanarImagingRunner)
+from core.analysis.compute.plotting import PublishablePlots
+from core.analysis.worker import QAnalysisWorker
 
 class QPlanarImaging():
+    """
+    Qt adapter that draws the results of a PIAnalysis with pyqtgraph. Attributes that
+    are not defined here are looked up on the wrapped analysis object.
+    """
+
+    def __init__(self, pi: PIAnalysis):
+        self.pi = pi
+        self._phantom = pi.phantom
+
+        self._analyzed_image_plot_widget = None
 
-    def __init__(self, phantom: ImagePhantomBase):
-        self._phantom = phantom
+    def __getattr__(self, name: str):
+        return getattr(self.pi, name)
 
-        self.analyzed_image_plot_widget = pg.GraphicsLayoutWidget()
+    @property
+    def analyzed_image_plot_widget(self) -> pg.GraphicsLayoutWidget:
+        # The plot widget is only created once it is needed
+        if self._analyzed_image_plot_widget is None:
+            self._analyzed_image_plot_widget = pg.GraphicsLayoutWidget()
+
+        return self._analyzed_image_plot_widget
 
     def qplot_analyzed_image(self):
         self.analyzed_image_plot_widget.clear()
@@ -177,27 +175,10 @@ class QPlanarImaging():
         else:
             self.high_freq_plot.hide()
 
-    def get_publishable_plots(self) -> list[io.BytesIO()]:
-        """
-        Custom plot implementation to get smaller, high quality pdf images
-        """
-        figs, names = self._phantom.plot_analyzed_image(
-            show=False, split_plots=True, figsize = (4.5 ,4.5)
-        )
-
-        filenames = [io.BytesIO() for _ in names]
-        for fig, name in zip(figs, filenames):
-            fig.savefig(name, format = "pdf", pad_inches = 0.0, bbox_inches='tight', dpi=200)
-        
-
-        return filenames
-
-class QPlanarImagingWorker(QObject):
+class QPlanarImagingWorker(QAnalysisWorker):
 
     analysis_progress = Signal(str)
     analysis_results_ready =  Signal(dict)
-    thread_finished = Signal()
-    analysis_failed = Signal(str)
 
     def __init__(self, phantom_name: str,
                  filepath: str | BinaryIO | Path,
@@ -214,114 +195,29 @@ class QPlanarImagingWorker(QObject):
                  image_kwargs: dict | None = None):
         super().__init__()
 
-        self._angle_override = angle_override
-        self._size_override = size_override
-        self._center_override = center_override
-        self._high_contrast_threshold = high_contrast_threshold
-        self._low_contrast_threshold = low_contrast_threshold
-        self._low_contrast_method = low_contrast_method
-        self._invert = invert
-        self._visibility_threshold = visibility_threshold
-        self._ssd = ssd
-
-        if phantom_name == PHANTOM.LEEDS_TOR_RED.value:
-            self._phantom = LeedsTOR(filepath, normalize, image_kwargs)
-            self._phantom.common_name = PHANTOM.LEEDS_TOR_RED.value
-
-        elif phantom_name == PHANTOM.LEEDS_TOR_BLUE.value:
-            self._phantom = LeedsTORBlue(filepath, normalize, image_kwargs)
-            self._phantom.common_name = PHANTOM.LEEDS_TOR_BLUE.value
-
-        elif phantom_name == PHANTOM.STANDARD_IMAGING_QC3.value:
-            self._phantom = StandardImagingQC3(filepath, normalize, image_kwargs)
-            self._phantom.common_name = PHANTOM.STANDARD_IMAGING_QC3.value
-
-        elif phantom_name == PHANTOM.STANDARD_IMAGING_QC_KV.value:
-            self._phantom = StandardImagingQCkV(filepath, normalize, image_kwargs)
-            self._phantom.common_name = PHANTOM.STANDARD_IMAGING_QC_KV.value
-
-        elif phantom_name == PHANTOM.DOSELAB_MC2_MV.value:
-            self._phantom = DoselabMC2MV(filepath, normalize, image_kwargs)
-            self._phantom.common_name = PHANTOM.DOSELAB_MC2_MV.value
-
-        elif phantom_name == PHANTOM.DOSELAB_MC2_KV.value:
-            self._phantom =  DoselabMC2kV(filepath, normalize, image_kwargs)
-            self._phantom.common_name = PHANTOM.DOSELAB_MC2_KV.value
-
-        elif phantom_name == PHANTOM.SNC_MV.value:
-            self._phantom = SNCMV(filepath, normalize, image_kwargs)
-            self._phantom.common_name = PHANTOM.SNC_MV.value
-        
-        elif phantom_name == PHANTOM.SNC_MV_12510.value:
-            self._phantom = SNCMV12510(filepath, normalize, image_kwargs)
-            self._phantom.common_name = PHANTOM.SNC_MV_12510.value
-
-        elif phantom_name == PHANTOM.SNC_KV.value:
-            self._phantom = SNCkV(filepath, normalize, image_kwargs)
-            self._phantom.common_name = PHANTOM.SNC_KV.value
-
-        elif phantom_name == PHANTOM.IBA_PRIMUS_A.value:
-            self._phantom = IBAPrimusA(filepath, normalize, image_kwargs)
-            self._phantom.common_name = PHANTOM.IBA_PRIMUS_A.value
-
-        elif phantom_name == PHANTOM.PTW_EPID_QC.value:
-            self._phantom = PTWEPIDQC(filepath, normalize, image_kwargs)
-            self._phantom.common_name = PHANTOM.PTW_EPID_QC.value
-
-        elif phantom_name == PHANTOM.LAS_VEGAS.value:
-            self._phantom = LasVegas(filepath, normalize, image_kwargs)
-            self._phantom.common_name = PHANTOM.LAS_VEGAS.value
-            self._phantom.mtf = None
-
-        elif phantom_name == PHANTOM.ELEKTA_LAS_VEGAS.value:
-            self._phantom = ElektaLasVegas(filepath, normalize, image_kwargs)
-            self._phantom.common_name = PHANTOM.ELEKTA_LAS_VEGAS.value
-            self._phantom.mtf = None
-
-        else:
-            raise ValueError("Invalid phantom name passsed. Pass one of the following: " +
-                             str.join(", ", [x for x in PHANTOM]))
-        
-        self._planar_img = QPlanarImaging(self._phantom)
-    
-    def analyze(self):
-        """
-        Perform an analysis of a phantom image from a 2D kV or MV linac imager.
-        """
-        try:
-            self._phantom.analyze(low_contrast_method=self._low_contrast_method,
-                                  low_contrast_threshold=self._low_contrast_threshold,
-                                  high_contrast_threshold=self._high_contrast_threshold,
-                                  visibility_threshold=self._visibility_threshold,
-                                  invert=self._invert,
-                                  center_override=self._center_override,
-                                  angle_override=self._angle_override,
-                                  size_override=self._size_override,
-                                  ssd=self._ssd
-                                  )
-            
-            results_data = self._phantom.results_data()
-            
-            summary_text = [["No. of low contrast ROIs visible:", str(results_data.num_contrast_rois_seen)],
-                            ["Phantom center (X):", f"{results_data.phantom_center_x_y[0]}"],
-                            ["Phantom center (Y):", f"{results_data.phantom_center_x_y[1]}"],
-                            ["Median contrast:", f"{results_data.median_contrast: 2.2f}"],
-                            ["Median CNR:", f"{results_data.median_cnr: 2.2f}"]
-            ]
-
-            if self._phantom.mtf is not None:
-                summary_text.append(["MTF 80% (lp/mm):", f"{results_data.mtf_lp_mm[0][80]: 2.2f}"])
-                summary_text.append(["MTF 50% (lp/mm):", f"{results_data.mtf_lp_mm[1][50]: 2.2f}"])
-                summary_text.append(["MTF 30% (lp/mm):", f"{results_data.mtf_lp_mm[2][30]: 2.2f}"])
-
-            results = {"summary_text": summary_text,
-                       "planar_img_obj": self._planar_img}
-
-            self.analysis_results_ready.emit(results)
-            self.thread_finished.emit()
-            
-        except Exception as err:
-            self.analysis_failed.emit(traceback.format_exception_only(err)[-1])
-            self.thread_finished.emit()
-
-            raise err
\ No newline at end of file
+        self.runner = PlanarImagingRunner(phantom_name,
+                                          filepath,
+                                          normalize,
+                                          low_contrast_threshold,
+                                          high_contrast_threshold,
+                                          invert,
+                                          angle_override,
+                                          center_override,
+                                          size_override,
+                                          ssd,
+                                          low_contrast_method,
+                                          visibility_threshold,
+                                          image_kwargs)
+
+    def report_progress(self, value: str):
+        self.analysis_progress.emit(value)
+
+    def handle_result(self, result: PlanarImagingResult):
+        pi = QPlanarImaging(result.planar_imaging)
+        results = {"summary_text": result.summary_text,
+                   "planar_img_obj": pi,
+                   "publishable_plots": PublishablePlots(pi.get_publishable_plots, "planar_imaging",
+                                                         self.runner.cache_parameters())}
+
+        self.analysis_results_ready.emit(results)
+        self.thread_finished.emit()
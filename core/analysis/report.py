@@ -0,0 +1,81 @@
+from PySide6.QtCore import Signal
+
+import matplotlib.pyplot as plt
+plt.switch_backend('agg') # plots are rendered outside of the GUI thread
+
+from core.analysis.compute.plotting import PlotResult, PlotRunner, PublishablePlots
+from core.analysis.worker import QAnalysisWorker
+from core.tools.report import (BatchReportResult, BatchReportRunner, ReportResult,
+                               ReportRunner)
+
+class QReportWorker(QAnalysisWorker):
+    """
+    Saves the report of a ReportRunner through the analysis scheduler.
+    ``report_ready`` gives the path of the saved PDF.
+    """
+
+    analysis_progress = Signal(str)
+    report_ready = Signal(str)
+
+    def __init__(self, runner: ReportRunner):
+        super().__init__()
+
+        self.filename = runner.filename
+        self.runner = runner
+
+    def report_progress(self, value: str):
+        self.analysis_progress.emit(value)
+
+    def handle_result(self, result: ReportResult):
+        self.report_ready.emit(result.filename)
+        self.thread_finished.emit()
+
+class QBatchReportWorker(QAnalysisWorker):
+    """
+    Saves a batch of reports and their index through the analysis scheduler.
+    ``report_ready`` gives the path of the index, ``result`` holds the reports that
+    failed once the batch is finished.
+    """
+
+    analysis_progress = Signal(str)
+    report_ready = Signal(str)
+
+    def __init__(self, runner: BatchReportRunner):
+        super().__init__()
+
+        self.filename = runner.filename
+        self.runner = runner
+        self.result: BatchReportResult | None = None
+
+    def report_progress(self, value: str):
+        self.analysis_progress.emit(value)
+
+    def handle_result(self, result: BatchReportResult):
+        self.result = result
+        self.report_ready.emit(result.filename)
+        self.thread_finished.emit()
+
+class QPlotWorker(QAnalysisWorker):
+    """
+    Renders the PublishablePlots of an analysis through the analysis scheduler, so
+    they are ready when a report is requested. ``plots_ready`` is emitted once the
+    plots are stored in ``plots``.
+    """
+
+    analysis_progress = Signal(str)
+    plots_ready = Signal()
+
+    def __init__(self, plots: PublishablePlots):
+        super().__init__()
+
+        self.plots = plots
+        self.runner = PlotRunner(plots)
+
+    def report_progress(self, value: str):
+        self.analysis_progress.emit(value)
+
+    def handle_result(self, result: PlotResult):
+        # The runner rendered a copy of the plots when it ran in a worker process
+        self.plots.set(result.plots)
+        self.plots_ready.emit()
+        self.thread_finished.emit()
@@ -0,0 +1,198 @@
+import heapq
+import itertools
+import time
+
+from PySide6.QtCore import Signal, Slot, QObject, QThread
+
+from core.analysis.compute.process import default_max_jobs
+from core.analysis.worker import QAnalysisWorker, ProcessBridge
+from core.configuration.config import SettingsConfig
+
+class AnalysisJob(QObject):
+    """
+    An analysis submitted to the AnalysisScheduler, together with its state.
+    """
+
+    QUEUED = 0
+    RUNNING = 1
+    COMPLETE = 2
+    FAILED = 3
+    CANCELLED = 4
+
+    state_changed = Signal(int)
+
+    def __init__(self, job_id: int, name: str, worker: QAnalysisWorker, priority: int):
+        super().__init__()
+
+        self.job_id = job_id
+        self.name = name
+        self.worker = worker
+        self.priority = priority
+        self.state = self.QUEUED
+        self.error_message = None
+        self.cancel_requested = False
+        self.qthread = None
+
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+        # Kept from the worker, which is dropped once the job has finished
+        self.peak_rss: int | None = None
+
+        # Slots of this object run in the GUI thread, whichever thread the worker is in
+        worker.analysis_failed.connect(self._on_failed)
+        worker.analysis_cancelled.connect(self._on_cancelled)
+        worker.thread_finished.connect(self._on_finished)
+
+    @property
+    def is_finished(self) -> bool:
+        return self.state in (self.COMPLETE, self.FAILED, self.CANCELLED)
+
+    def set_state(self, state: int):
+        self.state = state
+
+        if state == self.RUNNING:
+            self.started_at = time.time()
+        elif self.is_finished:
+            self.finished_at = time.time()
+
+            if self.worker is not None:
+                self.peak_rss = self.worker.peak_rss
+
+        self.state_changed.emit(state)
+
+    @Slot(str)
+    def _on_failed(self, message: str):
+        self.error_message = message
+
+    @Slot()
+    def _on_cancelled(self):
+        self.cancel_requested = True
+
+    @Slot()
+    def _on_finished(self):
+        if self.is_finished:
+            return
+
+        if self.error_message:
+            self.set_state(self.FAILED)
+        elif self.cancel_requested:
+            self.set_state(self.CANCELLED)
+        else:
+            self.set_state(self.COMPLETE)
+
+class AnalysisScheduler(QObject):
+    """
+    Central queue for all analyses of the application. At most ``max_jobs`` analyses run
+    at the same time; queued jobs start by priority (interactive before batch), then in
+    submission order.
+    """
+
+    INTERACTIVE = 0
+    BATCH = 1
+
+    job_added = Signal(object)
+    job_state_changed = Signal(object)
+
+    def __init__(self, max_jobs: int | None = None,
+                 backend: str = "process",
+                 parent: QObject | None = None):
+        super().__init__(parent)
+
+        self.max_jobs = max_jobs or default_max_jobs()
+        self.backend = backend
+        self.jobs: list[AnalysisJob] = []
+
+        self._queue = []
+        self._running: set[AnalysisJob] = set()
+        self._job_ids = itertools.count()
+        self._bridge = None
+
+    def submit(self, worker: QAnalysisWorker, name: str,
+               priority: int = INTERACTIVE) -> AnalysisJob:
+        job = AnalysisJob(next(self._job_ids), name, worker, priority)
+        job.state_changed.connect(lambda state: self._on_job_state_changed(job))
+
+        self.jobs.append(job)
+        heapq.heappush(self._queue, (priority, job.job_id, job))
+        self.job_added.emit(job)
+
+        self._dispatch()
+
+        return job
+
+    def cancel(self, job: AnalysisJob):
+        """
+        Cancel a job. A queued job is dropped right away, a running job stops at the
+        next cancellation check of its analysis.
+        """
+        if job.is_finished or job.cancel_requested:
+            return
+
+        job.cancel_requested = True
+
+        if job.state == AnalysisJob.QUEUED:
+            # The heap entry is skipped by _dispatch()
+            job.worker.handle_cancelled()
+
+        elif self._bridge is not None and job.qthread is None:
+            self._bridge.cancel(job.worker)
+
+        else:
+            job.worker.cancel_token.cancel()
+
+        self.job_state_changed.emit(job)
+
+    def clear_finished(self):
+        self.jobs = [job for job in self.jobs if not job.is_finished]
+
+    def _dispatch(self):
+        while self._queue and len(self._running) < self.max_jobs:
+            _, _, job = heapq.heappop(self._queue)
+
+            if job.state != AnalysisJob.QUEUED:
+                continue
+
+            self._running.add(job)
+            job.set_state(AnalysisJob.RUNNING)
+            self._start(job)
+
+    def _start(self, job: AnalysisJob):
+        if self.backend == "process":
+            if self._bridge is None:
+                self._bridge = ProcessBridge(self.max_jobs, self)
+
+            self._bridge.submit(job.worker)
+
+        else:
+            job.qthread = QThread()
+            job.worker.moveToThread(job.qthread)
+            job.worker.thread_finished.connect(job.qthread.quit)
+            job.qthread.started.connect(job.worker.analyze)
+            job.qthread.finished.connect(job.qthread.deleteLater)
+            job.qthread.start()
+
+    def _on_job_state_changed(self, job: AnalysisJob):
+        self.job_state_changed.emit(job)
+
+        if job.is_finished:
+            self._running.discard(job)
+            job.worker = None
+            self._dispatch()
+
+    def shutdown(self):
+        if self._bridge is not None:
+            self._bridge.shutdown()
+
+_analysis_scheduler = None
+
+def analysis_scheduler() -> AnalysisScheduler:
+    global _analysis_scheduler
+
+    if _analysis_scheduler is None:
+        settings = SettingsConfig().getConfig().get("analysis", {})
+        _analysis_scheduler = AnalysisScheduler(settings.get("max_workers"),
+                                                settings.get("execution_backend", "process"))
+
+    return _analysis_scheduler
@@ -1,41 +1,43 @@
 from PySide6.QtWidgets import QSizePolicy
-from PySide6.QtCore import Signal, Slot, QObject
+from PySide6.QtCore import Signal
 
-import io
-import traceback
 import pyqtgraph as pg
 import numpy as np
-from typing import BinaryIO
-from pylinac.core.geometry import Point
-from pylinac.starshot import Starshot
-from pylinac.settings import get_dicom_cmap
 
-import matplotlib.pyplot as plt
+from core.analysis.compute.starshot import (StarshotAnalysis, StarshotResult, StarshotRunner,
+                                           StarshotSweepResult, StarshotSweepRunner)
+from core.analysis.compute.plotting import PublishablePlots
+from core.analysis.worker import QAnalysisWorker
+from core.configuration.config import SettingsConfig
 
 pg.setConfigOptions(antialias = True, imageAxisOrder='row-major')
 
-class QStarshot(Starshot):
-
-    def __init__(self, filepath: str | BinaryIO, **kwargs):
-        super().__init__(filepath, **kwargs)
-
-        self.imagePlotWidget = pg.PlotWidget()
-        self.imagePlotWidget.setSizePolicy(QSizePolicy.Policy.Fixed, QSizePolicy.Policy.Fixed)
-        self.imagePlotWidget.setFixedSize(600, 400)
-        self.imagePlotWidget.setAspectLocked(lock=True)
-        self.imagePlotWidget.invertY(True)
-
-    def analyze(self, 
-                radius: float = 0.85,
-                min_peak_height: float = 0.25,
-                tolerance: float = 1,
-                start_point: Point | tuple | None = None,
-                fwhm: bool = True,
-                recursive: bool = True,
-                invert: bool = False):
-        
-        return super().analyze(radius, min_peak_height, tolerance, start_point, fwhm, recursive, invert)
-    
+class QStarshot():
+    """
+    Qt adapter that draws the results of a StarshotAnalysis with pyqtgraph. Attributes
+    that are not defined here are looked up on the wrapped analysis object.
+    """
+
+    def __init__(self, starshot: StarshotAnalysis):
+        self.starshot = starshot
+
+        self._image_plot_widget = None
+
+    def __getattr__(self, name: str):
+        return getattr(self.starshot, name)
+
+    @property
+    def imagePlotWidget(self) -> pg.PlotWidget:
+        # The plot widget is only created once it is needed
+        if self._image_plot_widget is None:
+            self._image_plot_widget = pg.PlotWidget()
+            self._image_plot_widget.setSizePolicy(QSizePolicy.Policy.Fixed, QSizePolicy.Policy.Fixed)
+            self._image_plot_widget.setFixedSize(600, 400)
+            self._image_plot_widget.setAspectLocked(lock=True)
+            self._image_plot_widget.invertY(True)
+
+        return self._image_plot_widget
+
     def plot_image(self):
         # plot the image
         self.imagePlotWidget.addItem(pg.ImageItem(self.image.array))
@@ -80,46 +82,10 @@ class QStarshot(Starshot):
                                                         size = 15, pxMode = False,
                                                         pen = pg.mkPen(None), brush = pg.mkBrush(255,0,255, 150)))
 
-    def get_publishable_plots(self) -> list[io.BytesIO()]:
-        """
-        Custom plot implementation to get smaller, high quality pdf images
-        """
-
-        full_plot_data = io.BytesIO()
-        wobble_plot_data = io.BytesIO()
-        
-        fig, ax = plt.subplots()
-        # show analyzed image
-        ax.imshow(self.image.array, cmap = get_dicom_cmap())
-        self.lines.plot(ax)
-        self.wobble.plot2axes(ax, edgecolor="green")
-        self.circle_profile.plot2axes(ax, edgecolor="green")
-
-        ax.axis('off')
-        ax.set_aspect('auto')
-
-        # Ensure that we fill the entire pdf page (pad_inches = 0.0  and box_inches = 'tight')
-        fig.savefig(full_plot_data, format = "pdf", pad_inches = 0.0, bbox_inches='tight')
-
-        xlims = [self.wobble.center.x + self.wobble.diameter,
-                 self.wobble.center.x - self.wobble.diameter]
-        
-        ylims = [self.wobble.center.y + self.wobble.diameter,
-                 self.wobble.center.y - self.wobble.diameter]
-        
-        ax.set_xlim(xlims)
-        ax.set_ylim(ylims)
-
-        fig.savefig(wobble_plot_data, format = "pdf", pad_inches = 0.0, bbox_inches='tight')
-
-        return [full_plot_data, wobble_plot_data]
-
-class QStarshotWorker(QObject):
+class QStarshotWorker(QAnalysisWorker):
 
     analysis_progress = Signal(str)
     analysis_results_ready =  Signal(dict)
-    analysis_failed = Signal(str)
-    thread_finished = Signal()
 
     def __init__(self, filepath: str | list[str],
                  radius: float = 0.85,
@@ -131,44 +97,57 @@ class QStarshotWorker(QObject):
                  update_signal: Signal = None,
                  **kwargs):
         super().__init__()
-        
-        self._filepath = filepath
-        self._radius = radius
-        self._min_peak_height = min_peak_height
-        self._tolerance = tolerance
-        self._fwhm = fwhm
-        self._recursive = recursive
-        self._invert = invert
-        self._update_signal = update_signal
-
-        if type(self._filepath) == str:
-            self.starshot = QStarshot(self._filepath, **kwargs)
-        else:
-            self.starshot = QStarshot.from_multiple_images(self._filepath, **kwargs)
-
-    def analyze(self):
-        try:
-            self.starshot.analyze(radius = self._radius,
-                              min_peak_height = self._min_peak_height,
-                              tolerance = self._tolerance,
-                              fwhm = self._fwhm,
-                              recursive = self._recursive,
-                              invert = self._invert)
-
-            summary_text = [["Minimum circle (wobble) diameter:", 
-                             f"{self.starshot.wobble.radius_mm * 2.0 : 2.3f} mm"],
-                             ["Position of the wobble circle:",
-                              f"{self.starshot.wobble.center.x : 2.1f}, {self.starshot.wobble.center.y : 2.1f}"]]
-        
-            results = {"summary_text": summary_text,
-                       "starshot_obj": self.starshot}
-        
-            self.analysis_results_ready.emit(results)
-            self.thread_finished.emit()
-        
-        except Exception as err:
-            self.analysis_failed.emit(traceback.format_exception_only(err)[-1])
-            self.thread_finished.emit()
-
-        
-        
\ No newline at end of file
+
+        self.runner = StarshotRunner(filepath, radius, min_peak_height, tolerance,
+                                     fwhm, recursive, invert, **kwargs)
+
+    def report_progress(self, value: str):
+        self.analysis_progress.emit(value)
+
+    def handle_result(self, result: StarshotResult):
+        starshot = QStarshot(result.starshot)
+        results = {"summary_text": result.summary_text,
+                   "starshot_obj": starshot,
+                   "publishable_plots": PublishablePlots(starshot.get_publishable_plots, "starshot",
+                                                         self.runner.cache_parameters())}
+    
+        self.analysis_results_ready.emit(results)
+        self.thread_finished.emit()
+
+class QStarshotSweepWorker(QStarshotWorker):
+    """
+    Parameter sweep of a starshot (see StarshotSweepRunner). The results are those of the
+    best candidate, with all the ranked candidates under ``sweep_candidates``.
+    """
+
+    def __init__(self, filepath: str | list[str],
+                 radii: list[float] | None = None,
+                 min_peak_heights: list[float] | None = None,
+                 tolerance: float = 1.0,
+                 fwhm: bool = True,
+                 invert: bool = False,
+                 **kwargs):
+        QAnalysisWorker.__init__(self)
+
+        sweep_kwargs = {}
+        if radii is not None:
+            sweep_kwargs["radii"] = radii
+        if min_peak_heights is not None:
+            sweep_kwargs["min_peak_heights"] = min_peak_heights
+
+        # Candidates are searched in processes like the images of a Winston-Lutz analysis
+        image_workers = SettingsConfig().getConfig().get("analysis", {}).get("image_workers")
+        self.runner = StarshotSweepRunner(filepath, tolerance = tolerance, fwhm = fwhm,
+                                          invert = invert, max_workers = image_workers,
+                                          **sweep_kwargs, **kwargs)
+
+    def handle_result(self, result: StarshotSweepResult):
+        starshot = QStarshot(result.starshot)
+        results = {"summary_text": result.summary_text,
+                   "starshot_obj": starshot,
+                   "sweep_candidates": result.candidates,
+                   "publishable_plots": PublishablePlots(starshot.get_publishable_plots, "starshot",
+                                                         self.runner.cache_parameters())}
+
+        self.analysis_results_ready.emit(results)
+        self.thread_finished.emit()
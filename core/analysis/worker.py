@@ -0,0 +1,165 @@
+import sqlite3
+import traceback
+from concurrent.futures import Future
+from typing import Any
+
+from PySide6.QtCore import Signal, Slot, QObject, QTimer
+
+from core.analysis.compute.base import AnalysisRunner, AnalysisCancelled, CancellationToken
+from core.analysis.compute.memory import PeakRSSMonitor
+from core.database.results import results_database
+from core.analysis.compute.process import ProcessExecutor, running_analysis
+
+class QAnalysisWorker(QObject):
+    """
+    Base class for the Qt workers. A worker wraps an AnalysisRunner and translates its
+    progress, result and errors into Qt signals. ``analyze()`` runs the analysis in the
+    current thread, while a ProcessBridge can hand it to a worker process instead.
+
+    ``cancel_token`` stops the analysis between two of its stages when it is cancelled,
+    the worker then emits ``analysis_cancelled`` instead of a result.
+
+    ``peak_rss`` is the peak resident set size (in bytes) of the process that ran the
+    analysis, once it has finished.
+    """
+
+    thread_finished = Signal()
+    analysis_failed = Signal(str)
+    analysis_cancelled = Signal()
+
+    runner: AnalysisRunner
+
+    def __init__(self):
+        super().__init__()
+
+        self.cancel_token = CancellationToken()
+        self.peak_rss: int | None = None
+
+    @Slot()
+    def analyze(self):
+        try:
+            self.cancel_token.check()
+
+            with PeakRSSMonitor() as monitor, running_analysis():
+                result = self.runner.run_cached(progress = self.report_progress,
+                                                cancel = self.cancel_token)
+
+            self.peak_rss = monitor.peak_rss
+            self.save_record(result)
+
+        except AnalysisCancelled:
+            # Not re-raised, the traceback would keep the analysis data alive
+            self.handle_cancelled()
+            return
+
+        except Exception as err:
+            self.handle_error(err)
+            raise err
+
+        self.handle_result(result)
+
+    def report_progress(self, value: Any):
+        pass
+
+    def save_record(self, result):
+        """
+        Queue the record of ``result`` in the results database, which writes it from its
+        own thread.
+        """
+        record = getattr(result, "record", None)
+
+        if record is None:
+            return
+
+        try:
+            database = results_database()
+        except (OSError, sqlite3.Error) as err:
+            # Losing the history must not lose the analysis
+            traceback.print_exception(err)
+            return
+
+        if database is not None:
+            database.add(record)
+
+    def handle_result(self, result):
+        raise NotImplementedError
+
+    def handle_error(self, err: BaseException):
+        self.analysis_failed.emit(traceback.format_exception_only(err)[-1])
+        self.thread_finished.emit()
+
+    def handle_cancelled(self):
+        self.analysis_cancelled.emit()
+        self.thread_finished.emit()
+
+class ProcessBridge(QObject):
+    """
+    Runs workers in a ProcessExecutor. Progress updates and finished jobs are polled
+    from the GUI thread and passed on to the worker, which emits its usual signals.
+    """
+
+    POLL_INTERVAL_MS = 50
+
+    def __init__(self, max_workers: int | None = None, parent: QObject | None = None):
+        super().__init__(parent)
+
+        self.executor = ProcessExecutor(max_workers)
+        self._jobs: dict[int, tuple[QAnalysisWorker, Future]] = {}
+        self._next_job_id = 0
+
+        self._timer = QTimer(self)
+        self._timer.setInterval(self.POLL_INTERVAL_MS)
+        self._timer.timeout.connect(self._poll)
+
+    def submit(self, worker: QAnalysisWorker):
+        job_id = self._next_job_id
+        self._next_job_id += 1
+
+        self._jobs[job_id] = (worker, self.executor.submit(job_id, worker.runner))
+
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def cancel(self, worker: QAnalysisWorker):
+        """
+        Cancel the job of ``worker``. A job that has not started yet is dropped at once,
+        a running job stops at its next cancellation check.
+        """
+        for job_id, (job_worker, future) in list(self._jobs.items()):
+            if job_worker is not worker:
+                continue
+
+            if future.cancel():
+                del self._jobs[job_id]
+                worker.handle_cancelled()
+            else:
+                self.executor.cancel(job_id)
+
+    def _poll(self):
+        for job_id, value in self.executor.progress_updates():
+            if job_id in self._jobs:
+                self._jobs[job_id][0].report_progress(value)
+
+        for job_id, (worker, future) in list(self._jobs.items()):
+            if not future.done():
+                continue
+
+            del self._jobs[job_id]
+            err = future.exception()
+
+            if isinstance(err, AnalysisCancelled):
+                worker.handle_cancelled()
+            elif err is not None:
+                traceback.print_exception(err)
+                worker.handle_error(err)
+            else:
+                result, worker.peak_rss = future.result()
+                worker.save_record(result)
+                worker.handle_result(result)
+
+        if not self._jobs:
+            self._timer.stop()
+
+    def shutdown(self):
+        self._timer.stop()
+        self.executor.shutdown(wait = False, cancel_futures = True)
@@ -0,0 +1,332 @@
+import atexit
+import json
+import queue
+import sqlite3
+import threading
+import traceback
+import zlib
+from contextlib import closing
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+from core.configuration.config import SettingsConfig
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    id INTEGER PRIMARY KEY,
+    analysis_type TEXT NOT NULL,
+    linac TEXT,
+    beam TEXT,
+    acquired_at TEXT NOT NULL,
+    analyzed_at TEXT NOT NULL,
+    passed INTEGER,
+    parameters TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS analyses_linac_type_date
+    ON analyses (linac, analysis_type, acquired_at);
+CREATE INDEX IF NOT EXISTS analyses_type_date
+    ON analyses (analysis_type, acquired_at);
+
+CREATE TABLE IF NOT EXISTS metrics (
+    analysis_id INTEGER NOT NULL REFERENCES analyses (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    value REAL,
+    PRIMARY KEY (analysis_id, name)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS arrays (
+    analysis_id INTEGER NOT NULL REFERENCES analyses (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    dtype TEXT NOT NULL,
+    shape TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (analysis_id, name)
+) WITHOUT ROWID;
+"""
+
+@dataclass
+class AnalysisRecord:
+    """
+    The stored outcome of one analysis. ``metrics`` hold its scalar results, ``arrays``
+    its per-leaf or per-image results, which are saved as compressed blobs.
+    """
+
+    analysis_type: str
+    acquired_at: datetime
+    linac: str | None = None
+    beam: str | None = None
+    passed: bool | None = None
+    parameters: dict[str, Any] = field(default_factory = dict)
+    metrics: dict[str, float] = field(default_factory = dict)
+    arrays: dict[str, np.ndarray] = field(default_factory = dict)
+    analyzed_at: datetime = field(default_factory = datetime.now)
+    id: int | None = None
+
+    @classmethod
+    def from_results(cls, analysis_type: str, results_data: dict, metadata = None,
+                     exclude: tuple[str, ...] = (), **kwargs) -> "AnalysisRecord":
+        """
+        Build a record from the ``results_data(as_dict=True)`` of a pylinac analysis.
+        Numbers become metrics and lists of numbers become arrays, nested dictionaries
+        are named with dots (e.g. "protocol_results.flatness_vertical"). The linac, beam
+        and acquisition date are read from the DICOM ``metadata`` of the analyzed image.
+        """
+        metrics, arrays = {}, {}
+
+        def add_values(data: dict, prefix: str):
+            for name, value in data.items():
+                if name in exclude:
+                    continue
+
+                if isinstance(value, dict):
+                    add_values(value, f"{prefix}{name}.")
+                elif isinstance(value, (bool, int, float, np.number, np.bool_)):
+                    metrics[prefix + name] = float(value)
+                elif isinstance(value, (list, tuple, np.ndarray)):
+                    array = np.asarray(value)
+                    if array.dtype.kind in "biuf" and array.size:
+                        arrays[prefix + name] = array
+
+        add_values(results_data, "")
+        metrics.update(kwargs.pop("metrics", {}))
+        arrays.update(kwargs.pop("arrays", {}))
+
+        linac, beam, acquired_at = image_identity(metadata)
+        kwargs.setdefault("linac", linac)
+        kwargs.setdefault("beam", beam)
+        kwargs.setdefault("acquired_at", acquired_at or datetime.now())
+
+        if isinstance(results_data.get("passed"), bool):
+            kwargs.setdefault("passed", results_data["passed"])
+
+        return cls(analysis_type, metrics = metrics, arrays = arrays, **kwargs)
+
+def image_identity(metadata) -> tuple[str | None, str | None, datetime | None]:
+    """
+    The treatment unit, beam (RT image label) and acquisition date and time found in
+    the DICOM metadata of an image, None where a value is missing.
+    """
+    if metadata is None:
+        return None, None, None
+
+    linac = (metadata.get("RadiationMachineName") or metadata.get("TreatmentMachineName")
+             or metadata.get("StationName"))
+    beam = metadata.get("RTImageLabel") or metadata.get("SeriesDescription")
+
+    acquired_at = None
+    for date_keyword, time_keyword in (("AcquisitionDate", "AcquisitionTime"),
+                                       ("ContentDate", "ContentTime"),
+                                       ("StudyDate", "StudyTime")):
+        date = str(metadata.get(date_keyword) or "")
+        time = str(metadata.get(time_keyword) or "").split(".")[0].ljust(6, "0")
+
+        try:
+            acquired_at = datetime.strptime(date + time[:6], "%Y%m%d%H%M%S")
+            break
+        except ValueError:
+            continue
+
+    return str(linac) if linac else None, str(beam) if beam else None, acquired_at
+
+class ResultsDatabase:
+    """
+    SQLite store of the analysis results. Records are queued by ``add()`` and written
+    by a background thread, several at a time in a single transaction, so the callers
+    (and the GUI thread) never wait for the disk. Each query opens its own connection
+    and can run from any thread.
+    """
+
+    BATCH_SIZE = 100
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents = True, exist_ok = True)
+
+        self._queue: queue.Queue[AnalysisRecord | None] = queue.Queue()
+        self._writer = None
+        self._lock = threading.Lock()
+
+        with closing(self._connect()) as connection:
+            # Write-ahead logging lets the history be read while records are written
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.executescript(SCHEMA)
+
+    def add(self, record: AnalysisRecord):
+        """
+        Queue ``record`` to be written. Its ``id`` is set once it has been written.
+        """
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target = self._write_records,
+                                                name = "results-database", daemon = True)
+                self._writer.start()
+                atexit.register(self.close)
+
+        self._queue.put(record)
+
+    def flush(self):
+        """
+        Wait until all the queued records are written.
+        """
+        self._queue.join()
+
+    def close(self):
+        with self._lock:
+            if self._writer is None:
+                return
+
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+
+    def analyses(self, linac: str | None = None, analysis_type: str | None = None,
+                 start: datetime | None = None, end: datetime | None = None,
+                 limit: int | None = None) -> list[AnalysisRecord]:
+        """
+        The stored analyses, latest acquisition first, with their metrics and
+        parameters. Arrays are left out, see ``arrays()``.
+        """
+        where, values = self._filters(linac, analysis_type, start, end)
+        selection = f"FROM analyses {where} ORDER BY acquired_at DESC"
+        if limit is not None:
+            selection += f" LIMIT {int(limit)}"
+        query = ("SELECT id, analysis_type, linac, beam, acquired_at, analyzed_at, passed, parameters "
+                 + selection)
+
+        with closing(self._connect()) as connection:
+            rows = connection.execute(query, values).fetchall()
+            records = {row[0]: AnalysisRecord(id = row[0], analysis_type = row[1], linac = row[2],
+                                              beam = row[3],
+                                              acquired_at = datetime.fromisoformat(row[4]),
+                                              analyzed_at = datetime.fromisoformat(row[5]),
+                                              passed = None if row[6] is None else bool(row[6]),
+                                              parameters = json.loads(row[7]))
+                       for row in rows}
+
+            metric_query = f"SELECT analysis_id, name, value FROM metrics WHERE analysis_id IN (SELECT id {selection})"
+            for analysis_id, name, value in connection.execute(metric_query, values):
+                records[analysis_id].metrics[name] = value
+
+        return list(records.values())
+
+    def metric_history(self, name: str, linac: str | None = None,
+                       analysis_type: str | None = None, start: datetime | None = None,
+                       end: datetime | None = None) -> list[tuple[datetime, float]]:
+        """
+        The values of the metric ``name`` over time, oldest first.
+        """
+        where, values = self._filters(linac, analysis_type, start, end)
+        where = f"{where} AND" if where else "WHERE"
+        query = ("SELECT analyses.acquired_at, metrics.value FROM analyses "
+                 "JOIN metrics ON metrics.analysis_id = analyses.id "
+                 f"{where} metrics.name = ? ORDER BY analyses.acquired_at")
+
+        with closing(self._connect()) as connection:
+            return [(datetime.fromisoformat(acquired_at), value)
+                    for acquired_at, value in connection.execute(query, [*values, name])]
+
+    def arrays(self, analysis_id: int) -> dict[str, np.ndarray]:
+        with closing(self._connect()) as connection:
+            rows = connection.execute("SELECT name, dtype, shape, data FROM arrays WHERE analysis_id = ?",
+                                      (analysis_id,)).fetchall()
+
+        return {name: np.frombuffer(zlib.decompress(data), dtype = dtype).reshape(json.loads(shape))
+                for name, dtype, shape, data in rows}
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout = 30)
+        connection.execute("PRAGMA foreign_keys = ON")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        return connection
+
+    @staticmethod
+    def _filters(linac: str | None, analysis_type: str | None,
+                 start: datetime | None, end: datetime | None) -> tuple[str, list]:
+        # Same column order as the (linac, analysis_type, acquired_at) index
+        conditions, values = [], []
+
+        for condition, value in (("linac = ?", linac),
+                                 ("analysis_type = ?", analysis_type),
+                                 ("acquired_at >= ?", start and start.isoformat(sep = " ")),
+                                 ("acquired_at <= ?", end and end.isoformat(sep = " "))):
+            if value is not None:
+                conditions.append(condition)
+                values.append(value)
+
+        return ("WHERE " + " AND ".join(conditions) if conditions else ""), values
+
+    def _write_records(self):
+        with closing(self._connect()) as connection:
+            while True:
+                records = [self._queue.get()]
+
+                # Whatever else is already queued goes into the same transaction
+                while len(records) < self.BATCH_SIZE:
+                    try:
+                        records.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                stop = None in records
+                records = [record for record in records if record is not None]
+
+                try:
+                    with connection:
+                        for record in records:
+                            self._insert(connection, record)
+                except sqlite3.Error as err:
+                    traceback.print_exception(err)
+
+                for _ in range(len(records) + stop):
+                    self._queue.task_done()
+
+                if stop:
+                    return
+
+    @staticmethod
+    def _insert(connection: sqlite3.Connection, record: AnalysisRecord):
+        cursor = connection.execute(
+            "INSERT INTO analyses (analysis_type, linac, beam, acquired_at, analyzed_at, passed, parameters) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (record.analysis_type, record.linac, record.beam,
+             record.acquired_at.isoformat(sep = " "), record.analyzed_at.isoformat(sep = " "),
+             None if record.passed is None else int(record.passed),
+             json.dumps(record.parameters, default = str)))
+        record.id = cursor.lastrowid
+
+        connection.executemany("INSERT INTO metrics (analysis_id, name, value) VALUES (?, ?, ?)",
+                               [(record.id, name, value) for name, value in record.metrics.items()])
+
+        arrays = []
+        for name, array in record.arrays.items():
+            array = np.ascontiguousarray(array)
+            if array.dtype.kind == "O":
+                array = array.astype(str)
+            arrays.append((record.id, name, array.dtype.str, json.dumps(array.shape),
+                           zlib.compress(array.tobytes())))
+
+        connection.executemany("INSERT INTO arrays (analysis_id, name, dtype, shape, data) VALUES (?, ?, ?, ?, ?)",
+                               arrays)
+
+_results_database = None
+
+def results_database() -> ResultsDatabase | None:
+    """
+    The shared results database, None if it is disabled in the settings.
+    """
+    global _results_database
+
+    settings = SettingsConfig().getConfig().get("results_database", {})
+
+    if not settings.get("enabled", True):
+        return None
+
+    if _results_database is None:
+        path = settings.get("path") or Path.home() / ".pybeam_qa" / "results.sqlite3"
+        _results_database = ResultsDatabase(path)
+
+    return _results_database
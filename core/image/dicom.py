@@ -0,0 +1,474 @@
+import copy
+import hashlib
+import json
+import os
+import threading
+from collections import Counter, OrderedDict
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import BinaryIO
+
+import numpy as np
+import pydicom
+from pydicom.errors import InvalidDicomError
+from pydicom.misc import is_dicom
+from pylinac.core import image
+from pylinac.core.image import LinacDicomImage, _rescale_dicom_values
+
+from core.configuration.config import SettingsConfig
+
+@dataclass
+class CacheStats:
+    hits: int
+    misses: int
+    evictions: int
+    images: int
+    size_bytes: int
+    max_bytes: int
+
+    @property
+    def hit_rate(self) -> float:
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else 0.0
+
+class MappedDicomImage(LinacDicomImage):
+    """
+    LinacDicomImage whose pixel data is memory-mapped from an uncompressed DICOM file
+    instead of being read into memory. ``raw_array`` keeps the stored integer values,
+    ``array`` is only rescaled to its usual (often float) values the first time an
+    analysis uses it. Use ``open()``, which returns None for files that can't be mapped.
+    """
+
+    def __init__(self, path: str | Path, raw_array: np.memmap, metadata: pydicom.Dataset, *,
+                 dtype: np.dtype | None = None, dpi: float | None = None, sid: float | None = None,
+                 sad: float = 1000, raw_pixels: bool = False, use_filenames: bool = False,
+                 axes_precision: int | None = None, gantry: float | None = None,
+                 coll: float | None = None, couch: float | None = None):
+        # Same attributes as LinacDicomImage.__init__, without decoding the pixel data
+        image.BaseImage.__init__(self, path)
+        self._gantry = gantry
+        self._coll = coll
+        self._couch = couch
+        self._axes_precision = axes_precision
+        self._use_filenames = use_filenames
+        self._sid = sid
+        self._dpi = dpi
+        self._sad = sad
+        self._raw_pixels = raw_pixels
+        self._original_dtype = raw_array.dtype
+        self._dtype = dtype
+        self.metadata = metadata
+        self.raw_array = raw_array
+        self._array = None
+
+    @classmethod
+    def open(cls, path: str | Path, **kwargs) -> "MappedDicomImage | None":
+        """
+        Map the pixel data of a DICOM file. ``kwargs`` are the LinacDicomImage keyword
+        arguments. Returns None if the pixel data is compressed, big endian or not a
+        single grayscale frame.
+        """
+        with open(path, "rb") as file:
+            # Stops at the pixel data tag, which is left unread
+            metadata = pydicom.dcmread(file, stop_before_pixels = True)
+            tag_offset = file.tell()
+            tag_header = file.read(12)
+
+        syntax = metadata.file_meta.get("TransferSyntaxUID")
+        if (syntax is None or syntax.is_compressed or not syntax.is_little_endian
+                or tag_header[:4] != b"\xe0\x7f\x10\x00"):
+            return None
+
+        bits = metadata.get("BitsAllocated")
+        signed = metadata.get("PixelRepresentation") == 1
+        if (bits not in (8, 16, 32) or metadata.get("SamplesPerPixel", 1) != 1
+                or int(metadata.get("NumberOfFrames") or 1) != 1
+                or (signed and metadata.get("BitsStored", bits) != bits)):
+            return None
+
+        if syntax.is_implicit_VR:
+            length, value_offset = int.from_bytes(tag_header[4:8], "little"), 8
+        elif tag_header[4:6] in (b"OB", b"OW"):
+            length, value_offset = int.from_bytes(tag_header[8:12], "little"), 12
+        else:
+            return None
+
+        shape = (int(metadata.Rows), int(metadata.Columns))
+        dtype = np.dtype(f"<{'i' if signed else 'u'}{bits // 8}")
+        if length < shape[0] * shape[1] * dtype.itemsize:
+            return None
+
+        # Copy-on-write, writes to the array never reach the file
+        raw_array = np.memmap(path, dtype = dtype, mode = "c",
+                              offset = tag_offset + value_offset, shape = shape)
+
+        return cls(path, raw_array, metadata, **kwargs)
+
+    @property
+    def array(self) -> np.ndarray:
+        if self._array is None:
+            raw_array = self.raw_array if self._dtype is None else self.raw_array.astype(self._dtype)
+            array = _rescale_dicom_values(raw_array, self.metadata, raw_pixels = self._raw_pixels)
+            # Copies of the image share the mapping, each needs its own array
+            self._array = np.array(array) if array is self.raw_array else array
+
+        return self._array
+
+    @array.setter
+    def array(self, value: np.ndarray):
+        self._array = value
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+
+        # Once rescaled, the mapping is not needed anymore (e.g. to send the image to
+        # another process), otherwise it is pickled as a regular array
+        if state["_array"] is not None:
+            state["raw_array"] = None
+
+        return state
+
+class DicomImageCache:
+    """
+    Cache of decoded DICOM images, keyed by the file path, modification time and size
+    and the image keyword arguments. Callers always get a copy they are free to modify.
+    The least recently used images are dropped once their pixel data exceeds
+    ``max_bytes``.
+
+    With ``memory_map``, uncompressed files are kept as MappedDicomImage: the cache then
+    only holds mappings of the files and each copy rescales its own array when used.
+    """
+
+    def __init__(self, max_bytes: int = 512 * 2**20, memory_map: bool = False):
+        self.max_bytes = max_bytes
+        self.memory_map = memory_map
+
+        self._images: OrderedDict[tuple, LinacDicomImage] = OrderedDict()
+        self._size_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def load(self, path: str | Path, **kwargs) -> LinacDicomImage:
+        """
+        Load a DICOM file. ``kwargs`` are passed to LinacDicomImage.
+        """
+        return self._copy(self._get(path, kwargs))
+
+    def load_into(self, dicom_image: LinacDicomImage, path: str | Path | BinaryIO, **kwargs):
+        """
+        Initialize an instance of a LinacDicomImage subclass from the cache, in place of
+        calling LinacDicomImage.__init__. Streams are read without the cache.
+        """
+        if not isinstance(path, (str, Path)):
+            LinacDicomImage.__init__(dicom_image, path, **kwargs)
+            return
+
+        loaded = self.load(path, **kwargs)
+        dicom_image.__dict__.update({name: value for name, value in loaded.__dict__.items()
+                                     if name not in ("_array", "raw_array", "_dtype")})
+        # The subclass has no lazy array, it is rescaled now
+        dicom_image.array = loaded.array
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(self._hits, self._misses, self._evictions,
+                              len(self._images), self._size_bytes, self.max_bytes)
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self._size_bytes = 0
+
+    def _get(self, path: str | Path, kwargs: dict) -> LinacDicomImage:
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size, tuple(sorted(kwargs.items())))
+
+        with self._lock:
+            cached = self._images.get(key)
+
+            if cached is not None:
+                self._images.move_to_end(key)
+                self._hits += 1
+                return cached
+
+            self._misses += 1
+
+        # Decode outside of the lock so other threads can use the cache meanwhile
+        cached = MappedDicomImage.open(path, **kwargs) if self.memory_map else None
+
+        if cached is None:
+            cached = LinacDicomImage(path, **kwargs)
+            # The decoded array is kept, the encoded pixels are not needed anymore
+            del cached.metadata.PixelData
+
+        nbytes = self._nbytes(cached)
+
+        with self._lock:
+            # Older versions of the file can't be hit again
+            for old_key in [k for k in self._images if k[0] == path and k[1:3] != key[1:3]]:
+                self._remove(old_key)
+
+            if key not in self._images and nbytes <= self.max_bytes:
+                self._images[key] = cached
+                self._size_bytes += nbytes
+
+                while self._size_bytes > self.max_bytes:
+                    self._remove(next(iter(self._images)))
+                    self._evictions += 1
+
+        return cached
+
+    def _remove(self, key: tuple):
+        self._size_bytes -= self._nbytes(self._images.pop(key))
+
+    @staticmethod
+    def _nbytes(cached: LinacDicomImage) -> int:
+        # Mapped images count with the size of their pixel data as well, which also
+        # bounds the number of open files
+        if isinstance(cached, MappedDicomImage):
+            return cached.raw_array.nbytes
+
+        return cached.array.nbytes
+
+    @staticmethod
+    def _copy(cached: LinacDicomImage) -> LinacDicomImage:
+        dicom_image = copy.copy(cached)
+        if not isinstance(cached, MappedDicomImage):
+            dicom_image.array = cached.array.copy()
+        dicom_image.metadata = copy.deepcopy(cached.metadata)
+
+        return dicom_image
+
+_dicom_cache = None
+
+# Number of processes sharing the budget of the settings, see share_dicom_cache
+_cache_processes = 1
+
+def dicom_cache() -> DicomImageCache:
+    global _dicom_cache
+
+    if _dicom_cache is None:
+        settings = SettingsConfig().getConfig().get("image_cache", {})
+        max_bytes = int(settings.get("max_megabytes", 512) * 2**20)
+        _dicom_cache = DicomImageCache(max_bytes // _cache_processes if _cache_processes else 0,
+                                       bool(settings.get("memory_map", False)) or not _cache_processes)
+
+    return _dicom_cache
+
+def share_dicom_cache(processes: int):
+    """
+    Make the cache of this process one of ``processes`` caches sharing the
+    ``max_megabytes`` of the settings, which are meant for the whole machine. With 0 the
+    process keeps no images and maps the uncompressed files instead. Called by the
+    initializers of the worker processes, before their first image is loaded.
+    """
+    global _dicom_cache, _cache_processes
+
+    _cache_processes = processes
+    _dicom_cache = None
+
+def load_dicom_image(path: str | Path, **kwargs) -> LinacDicomImage:
+    """
+    Load a DICOM file through the shared cache.
+    """
+    return dicom_cache().load(path, **kwargs)
+
+def read_dicom_image(path: str | Path, memory_map: bool = False, **kwargs) -> LinacDicomImage:
+    """
+    Load a DICOM file without the shared cache, for images that are only read once (e.g.
+    to be combined into another image). With ``memory_map``, uncompressed pixel data is
+    mapped instead of decoded. ``kwargs`` are passed to LinacDicomImage.
+    """
+    dicom_image = MappedDicomImage.open(path, **kwargs) if memory_map else None
+
+    if dicom_image is None:
+        dicom_image = LinacDicomImage(path, **kwargs)
+        # The decoded array is kept, the encoded pixels are not needed anymore
+        del dicom_image.metadata.PixelData
+
+    return dicom_image
+
+def load_image(path: str | Path | BinaryIO, **kwargs) -> image.ImageLike:
+    """
+    Same as pylinac's image.load, with DICOM files loaded through the shared cache.
+    """
+    if isinstance(path, (str, Path)) and is_dicom(path):
+        return load_dicom_image(path, **kwargs)
+
+    return image.load(path, **kwargs)
+
+@dataclass
+class DicomHeader:
+    """
+    The header values of a DICOM image that are shown before an analysis. ``valid`` is
+    False if the file could not be read as DICOM.
+    """
+
+    file_path: str
+    valid: bool = True
+    modality: str | None = None
+    acquisition_date: str | None = None
+    gantry_angle: float | None = None
+    collimator_angle: float | None = None
+    couch_angle: float | None = None
+    rows: int | None = None
+    columns: int | None = None
+
+    @property
+    def name(self) -> str:
+        return Path(self.file_path).name
+
+    def description(self) -> str:
+        if not self.valid:
+            return "Not a readable DICOM file"
+
+        def angle(value: float | None) -> str:
+            return "not in header" if value is None else f"{value:g}°"
+
+        return "\n".join([f"Modality: {self.modality or 'unknown'}",
+                          f"Acquisition date: {self.acquisition_date or 'unknown'}",
+                          f"Image size: {self.columns} x {self.rows} pixels",
+                          f"Gantry angle: {angle(self.gantry_angle)}",
+                          f"Collimator angle: {angle(self.collimator_angle)}",
+                          f"Couch angle: {angle(self.couch_angle)}"])
+
+def read_dicom_header(path: str | Path) -> DicomHeader:
+    """
+    Read the header of a DICOM file, without the pixel data.
+    """
+    try:
+        ds = pydicom.dcmread(path, stop_before_pixels = True)
+    except (InvalidDicomError, OSError):
+        return DicomHeader(str(path), valid = False)
+
+    def number(keyword: str) -> float | None:
+        value = ds.get(keyword)
+        return None if value in (None, "") else float(value)
+
+    date = ds.get("AcquisitionDate") or ds.get("ContentDate") or ds.get("StudyDate")
+    if date and len(date) == 8:
+        date = f"{date[:4]}-{date[4:6]}-{date[6:]}"
+
+    return DicomHeader(str(path),
+                       modality = ds.get("Modality"),
+                       acquisition_date = date or None,
+                       gantry_angle = number("GantryAngle"),
+                       collimator_angle = number("BeamLimitingDeviceAngle"),
+                       couch_angle = number("PatientSupportAngle"),
+                       rows = ds.get("Rows"),
+                       columns = ds.get("Columns"))
+
+class DicomHeaderIndex:
+    """
+    Reads DICOM headers and keeps them on disk as JSON files. They are keyed by a hash
+    of the file size and of its first bytes, which hold the header, so a file is only
+    read again once its header changes and copies of a file share their entry.
+    """
+
+    KEY_BYTES = 64 * 1024
+
+    def __init__(self, directory: str | Path):
+        self.directory = Path(directory)
+
+    def header(self, path: str | Path) -> DicomHeader:
+        try:
+            key = self.file_key(path)
+        except OSError:
+            return DicomHeader(str(path), valid = False)
+
+        entry = self.directory / f"{key}.json"
+
+        try:
+            with entry.open(encoding="utf-8") as file:
+                return DicomHeader(**{**json.load(file), "file_path": str(path)})
+        except (OSError, ValueError, TypeError):
+            pass
+
+        header = read_dicom_header(path)
+
+        try:
+            self.directory.mkdir(parents = True, exist_ok = True)
+            temp_entry = entry.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+
+            with temp_entry.open("w", encoding="utf-8") as file:
+                json.dump(asdict(header), file)
+            os.replace(temp_entry, entry)
+        except OSError:
+            # The index only saves time, the header is still returned
+            pass
+
+        return header
+
+    @classmethod
+    def file_key(cls, path: str | Path) -> str:
+        file_hash = hashlib.sha1(str(os.path.getsize(path)).encode())
+
+        with open(path, "rb") as file:
+            file_hash.update(file.read(cls.KEY_BYTES))
+
+        return file_hash.hexdigest()
+
+_dicom_header_index = None
+
+def dicom_header_index() -> DicomHeaderIndex:
+    global _dicom_header_index
+
+    if _dicom_header_index is None:
+        settings = SettingsConfig().getConfig().get("image_cache", {})
+        directory = settings.get("header_directory") or Path.home() / ".pybeam_qa" / "dicom_headers"
+        _dicom_header_index = DicomHeaderIndex(directory)
+
+    return _dicom_header_index
+
+def check_headers(headers: list[DicomHeader],
+                  require_dicom: bool = True,
+                  require_axes: bool = False,
+                  same_size: bool = False) -> list[str]:
+    """
+    Look for problems in a set of images that would make its analysis fail or give
+    misleading results, before any pixel data is loaded.
+
+    Parameters
+    ----------
+    require_dicom
+        Report the files that are not readable DICOM files.
+    require_axes
+        Report missing gantry, collimator or couch angles, and images that share the
+        same angles.
+    same_size
+        Report images whose size differs from the others.
+    """
+    warnings = []
+    valid_headers = [header for header in headers if header.valid]
+
+    if require_dicom:
+        warnings.extend(f"{header.name} is not a readable DICOM file"
+                        for header in headers if not header.valid)
+
+    if require_axes:
+        for header in valid_headers:
+            missing = [axis for axis, value in (("gantry", header.gantry_angle),
+                                                ("collimator", header.collimator_angle),
+                                                ("couch", header.couch_angle))
+                       if value is None]
+            if missing:
+                warnings.append(f"{header.name} has no {', '.join(missing)} angle in its header")
+
+        axes = Counter((header.gantry_angle, header.collimator_angle, header.couch_angle)
+                       for header in valid_headers)
+        warnings.extend(f"{count} images have gantry {gantry:g}°, collimator {coll:g}°, couch {couch:g}°"
+                        for (gantry, coll, couch), count in axes.items()
+                        if count > 1 and None not in (gantry, coll, couch))
+
+    if same_size:
+        sizes = Counter((header.columns, header.rows) for header in valid_headers)
+
+        if len(sizes) > 1:
+            size_text = ", ".join(f"{columns} x {rows} ({count})"
+                                  for (columns, rows), count in sizes.most_common())
+            warnings.append(f"The images have different sizes: {size_text}")
+
+    return warnings
@@ -0,0 +1,99 @@
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict
+from pathlib import Path
+
+from PySide6.QtCore import Qt, Signal, QObject, QTimer
+from PySide6.QtWidgets import QListWidget
+
+from core.image.dicom import DicomHeader, check_headers, dicom_header_index
+
+class ImageHeaderIndexer(QObject):
+    """
+    Reads the DICOM headers of the images of a list widget on a thread pool, as they
+    are added. Each list item gets the header values in its data under "header" and a
+    tooltip that describes them. Finished headers are polled from the GUI thread.
+    """
+
+    headers_updated = Signal()
+
+    POLL_INTERVAL_MS = 50
+    MAX_THREADS = 4
+
+    _executor = None
+
+    def __init__(self, list_widget: QListWidget, parent: QObject | None = None):
+        super().__init__(parent)
+
+        self.list_widget = list_widget
+        self.headers: dict[str, DicomHeader] = {}
+        self._pending: dict[str, Future] = {}
+
+        self._timer = QTimer(self)
+        self._timer.setInterval(self.POLL_INTERVAL_MS)
+        self._timer.timeout.connect(self._poll)
+
+    @classmethod
+    def executor(cls) -> ThreadPoolExecutor:
+        # Reading headers is I/O bound, all the worksheets share a few threads
+        if cls._executor is None:
+            cls._executor = ThreadPoolExecutor(cls.MAX_THREADS, thread_name_prefix = "dicom-header")
+
+        return cls._executor
+
+    def index(self, files: list[str]):
+        for file in files:
+            path = str(Path(file))
+
+            if path in self.headers:
+                self._update_items(path, self.headers[path])
+
+            elif path not in self._pending:
+                self._pending[path] = self.executor().submit(dicom_header_index().header, path)
+
+        if self._pending and not self._timer.isActive():
+            self._timer.start()
+
+    def warnings(self, files: list[str], **checks) -> list[str]:
+        """
+        Problems found in the headers of ``files`` by check_headers(), which ``checks``
+        are passed to. Files whose header has not been read yet are left out.
+        """
+        headers = [self.headers[str(Path(file))] for file in files
+                   if str(Path(file)) in self.headers]
+
+        return check_headers(headers, **checks)
+
+    def _poll(self):
+        updated = False
+
+        for path, future in list(self._pending.items()):
+            if not future.done():
+                continue
+
+            del self._pending[path]
+            err = future.exception()
+
+            if err is not None:
+                traceback.print_exception(err)
+                continue
+
+            self.headers[path] = future.result()
+            self._update_items(path, self.headers[path])
+            updated = True
+
+        if not self._pending:
+            self._timer.stop()
+
+        if updated:
+            self.headers_updated.emit()
+
+    def _update_items(self, path: str, header: DicomHeader):
+        for index in range(self.list_widget.count()):
+            item = self.list_widget.item(index)
+            item_data = item.data(Qt.UserRole)
+
+            if item_data["file_path"] == path:
+                item_data["header"] = asdict(header)
+                item.setData(Qt.UserRole, item_data)
+                item.setToolTip(header.description())
@@ -6,15 +6,27 @@ from reportlab.lib.units import cm
 from reportlab.lib import colors
 from reportlab.pdfgen.canvas import Canvas
 from reportlab.lib.enums import TA_LEFT, TA_CENTER, TA_RIGHT
+from xml.sax.saxutils import escape
 
 from datetime import datetime
+from dataclasses import dataclass, field
+import threading
+from typing import Any, Callable
 
 import io
+import os
+import traceback
+from contextlib import closing
 from pathlib import Path
 from pdfrw import PdfReader, PdfDict
 from pdfrw.buildxobj import pagexobj
 
 from core.tools.toreportlab import makerl
+from core.analysis.compute.base import (AnalysisRunner, AnalysisCancelled,
+                                        CancellationToken, ProgressCallback)
+from core.analysis.compute.plotting import plot_lock
+from core.analysis.compute.process import WorkerPool, pool_workers
+from core.database.results import AnalysisRecord
 
 assets_dir = Path(str(Path(__file__).parent) + "/report_assets").resolve()
 assets_dir = str(assets_dir)
@@ -46,6 +58,18 @@ class BaseReport:
         canvas.drawCentredString(A4[0]/2.0, 26.0 * cm , self.report_name)
         canvas.restoreState()
 
+    def build_document(self, document: SimpleDocTemplate, doc_contents: list,
+                       cancel: CancellationToken | None = None, **kwargs):
+        """
+        Build the PDF. If a cancellation token is given, it is checked after every
+        flowable is drawn; nothing is written to disk when the build is cancelled.
+        """
+        if cancel is not None:
+            cancel.check()
+            document.afterFlowable = lambda flowable: cancel.check()
+
+        document.build(doc_contents, **kwargs)
+
     def add_page_number(self, canvas: Canvas, document):
         page_num = canvas.getPageNumber()
         text = f"Page {page_num}"
@@ -141,7 +165,7 @@ class WinstonLutzReport(BaseReport):
         doc_contents.append(Spacer(1, 16)) # add spacing of 8 pts
         doc_contents.append(PdfImage(self._summary_plot, width=16*cm, height=16*cm))
 
-    def save_report(self):
+    def save_report(self, cancel: CancellationToken | None = None):
         document =  SimpleDocTemplate(self._filename)
         doc_contents = [Spacer(1, 2.0*cm)]
 
@@ -155,7 +179,7 @@ class WinstonLutzReport(BaseReport):
         self.add_comments(doc_contents)
         self.add_signature(doc_contents)
 
-        document.build(doc_contents, onFirstPage=self.add_metadata)
+        self.build_document(document, doc_contents, cancel, onFirstPage=self.add_metadata)
 
 class PicketFenceReport(BaseReport):
     """
@@ -234,7 +258,7 @@ class PicketFenceReport(BaseReport):
         image.hAlign = "CENTRE"
         doc_contents.append(image)
 
-    def save_report(self):
+    def save_report(self, cancel: CancellationToken | None = None):
         document =  SimpleDocTemplate(self._filename)
         doc_contents = [Spacer(1, 2.0*cm)]
 
@@ -248,7 +272,7 @@ class PicketFenceReport(BaseReport):
         self.add_comments(doc_contents)
         self.add_signature(doc_contents)
 
-        document.build(doc_contents, onFirstPage=self.add_metadata)
+        self.build_document(document, doc_contents, cancel, onFirstPage=self.add_metadata)
 
 class FieldAnalysisReport(BaseReport):
     """
@@ -326,7 +350,7 @@ class FieldAnalysisReport(BaseReport):
 
         doc_contents.append(Table(data, colWidths=[9.0*cm, 9.0*cm], hAlign="CENTER"))
 
-    def save_report(self):
+    def save_report(self, cancel: CancellationToken | None = None):
         document =  SimpleDocTemplate(self._filename)
         doc_contents = [Spacer(1, 2.0*cm)]
 
@@ -340,7 +364,7 @@ class FieldAnalysisReport(BaseReport):
         self.add_comments(doc_contents)
         self.add_signature(doc_contents)
 
-        document.build(doc_contents, onFirstPage=self.add_metadata)
+        self.build_document(document, doc_contents, cancel, onFirstPage=self.add_metadata)
        
 class StarshotReport(BaseReport):
     """
@@ -414,7 +438,7 @@ class StarshotReport(BaseReport):
 
         doc_contents.append(Table(data, colWidths=[8.0*cm, 8.0*cm], hAlign="CENTER"))
 
-    def save_report(self):
+    def save_report(self, cancel: CancellationToken | None = None):
         document =  SimpleDocTemplate(self._filename)
         doc_contents = [Spacer(1, 2.0*cm)]
 
@@ -428,7 +452,7 @@ class StarshotReport(BaseReport):
         self.add_comments(doc_contents)
         self.add_signature(doc_contents)
 
-        document.build(doc_contents, onFirstPage=self.add_metadata)
+        self.build_document(document, doc_contents, cancel, onFirstPage=self.add_metadata)
 
 class PlanarImagingReport(BaseReport):
     """
@@ -509,7 +533,7 @@ class PlanarImagingReport(BaseReport):
 
         doc_contents.append(Table(data, colWidths=[8.0*cm, 8.0*cm], hAlign="CENTER"))
 
-    def save_report(self):
+    def save_report(self, cancel: CancellationToken | None = None):
         document =  SimpleDocTemplate(self._filename)
         doc_contents = [Spacer(1, 2.0*cm)]
 
@@ -523,7 +547,7 @@ class PlanarImagingReport(BaseReport):
         self.add_comments(doc_contents)
         self.add_signature(doc_contents)
 
-        document.build(doc_contents, onFirstPage=self.add_metadata)
+        self.build_document(document, doc_contents, cancel, onFirstPage=self.add_metadata)
 
 class BaseCalibrationReport(BaseReport):
     """
@@ -739,7 +763,7 @@ class PhotonCalibrationReport(BaseCalibrationReport):
         
         doc_contents.append(table)
 
-    def save_report(self):
+    def save_report(self, cancel: CancellationToken | None = None):
         document =  SimpleDocTemplate(self._filename, pagesize=A4, pageCompression=1)
         doc_contents = [Spacer(1, 2.0*cm)]
 
@@ -753,7 +777,7 @@ class PhotonCalibrationReport(BaseCalibrationReport):
         self.add_comments(doc_contents)
         self.add_signature(doc_contents)
 
-        document.build(doc_contents, onFirstPage=self.add_metadata)
+        self.build_document(document, doc_contents, cancel, onFirstPage=self.add_metadata)
 
 class ElectronCalibrationReport(BaseCalibrationReport):
     """
@@ -912,7 +936,7 @@ class ElectronCalibrationReport(BaseCalibrationReport):
         
         doc_contents.append(table)
 
-    def save_report(self):
+    def save_report(self, cancel: CancellationToken | None = None):
         document =  SimpleDocTemplate(self._filename, pagesize=A4, pageCompression=1)
         doc_contents = [Spacer(1, 2.0*cm)]
 
@@ -925,7 +949,333 @@ class ElectronCalibrationReport(BaseCalibrationReport):
         
         self.add_signature(doc_contents)
 
-        document.build(doc_contents, onFirstPage=self.add_metadata)
+        self.build_document(document, doc_contents, cancel, onFirstPage=self.add_metadata)
+
+class AnalysisRecordReport(BaseReport):
+    """
+    Class for generating reports of analyses stored in the results database
+    """
+    def __init__(
+        self, filename: str,
+        record: AnalysisRecord,
+        report_name: str | None = None,
+        author: str = "N/A",
+        institution: str = "N/A",
+        treatment_unit_name: str | None = None,
+        analysis_date: str | None = None,
+        comments: str | None = None
+        ):
+        analysis_name = record.analysis_type.replace("_", " ").title()
+        super().__init__(filename, report_name or f"{analysis_name} Analysis Report")
+
+        self._record = record
+        self._author = author
+        self._institution = institution
+        self._treatment_unit_name = treatment_unit_name or record.linac or "N/A"
+        self._analysis_date = analysis_date or record.analyzed_at.strftime("%d %B %Y")
+        self._comments = comments
+
+    def set_user_details(self, doc_contents: list):
+        if self._record.passed is None:
+            outcome = "N/A"
+        else:
+            outcome = "Pass" if self._record.passed else "Fail"
+
+        data = [[Paragraph("<b>Physicist</b>"), f": {self._author}"],
+                [Paragraph("<b>Institution</b>"), f": {self._institution}"],
+                [Paragraph("<b>Treatment unit</b>"), f": {self._treatment_unit_name}"],
+                [Paragraph("<b>Beam</b>"), f": {self._record.beam or 'N/A'}"],
+                [Paragraph("<b>Acquisition date</b>"), f": {self._record.acquired_at:%d %B %Y %H:%M}"],
+                [Paragraph("<b>Analysis date</b>"), f": {self._analysis_date}"],
+                [Paragraph("<b>Test outcome</b>"), f": {outcome}"]]
+
+        doc_contents.append(Table(data, colWidths=[3.5*cm, 8.0*cm], hAlign="LEFT",
+                                  style=[('LEFTPADDING', (0,0), (0,-1), 0)]))
+
+    def set_analysis_details(self, doc_contents: list):
+        doc_contents.append(Spacer(1, 16)) # add spacing of 16 pts
+        doc_contents.append(Paragraph("<b><u><font size=11 color=\"darkblue\">Analysis Details:</font></u></b>"))
+        doc_contents.append(Spacer(1, 16)) # add spacing of 16 pts
+
+        data = [[Paragraph(name), f"{value:.4g}"] for name, value in sorted(self._record.metrics.items())]
+        data.insert(0, [Paragraph("<b>Parameter</b>"), Paragraph("<b>Value</b>")])
+
+        table = Table(data, colWidths=[11.0*cm, 4.0*cm], hAlign="LEFT", repeatRows=1,
+                      style=[('GRID', (0,0), (-1,-1), 0.5, colors.grey),
+                             ('BACKGROUND', (0,0), (-1,0), colors.lightgrey),
+                             ('LINEABOVE', (0,0), (-1,0), 1, colors.black),
+                             ('LINEABOVE', (0,1), (-1,1), 1, colors.black)])
+
+        doc_contents.append(table)
+
+    def save_report(self, cancel: CancellationToken | None = None):
+        document =  SimpleDocTemplate(self._filename)
+        doc_contents = [Spacer(1, 2.0*cm)]
+
+        # add document body and then build the PDF
+        self.set_user_details(doc_contents)
+        self.set_analysis_details(doc_contents)
+
+        self.add_comments(doc_contents)
+        self.add_signature(doc_contents)
+
+        self.build_document(document, doc_contents, cancel, onFirstPage=self.add_metadata)
+
+@dataclass
+class ReportResult:
+    filename: str
+
+class ReportRunner(AnalysisRunner):
+    """
+    Builds and saves a report, so that it can run away from the GUI thread like an
+    analysis. ``plots`` returns the plots of the report (e.g. the PublishablePlots of
+    an analysis, which may already be rendered) when the job runs; they are passed to
+    the report as its ``plots_argument``. The other keyword arguments go to the report.
+    """
+
+    cacheable = False
+
+    def __init__(self, report_type: type[BaseReport], filename: str,
+                 plots: Callable[[], Any] | None = None,
+                 plots_argument: str = "summary_plot",
+                 **report_kwargs):
+
+        self._report_type = report_type
+        self._filename = filename
+        self._plots = plots
+        self._plots_argument = plots_argument
+        self._report_kwargs = report_kwargs
+
+    @property
+    def filename(self) -> str:
+        return self._filename
+
+    def run(self, progress: ProgressCallback | None = None,
+            cancel: CancellationToken | None = None) -> ReportResult:
+        report_kwargs = dict(self._report_kwargs)
+
+        if self._plots is not None:
+            self._report_progress(progress, "Rendering plots")
+
+            with plot_lock:
+                report_kwargs[self._plots_argument] = self._plots()
+
+            self._check_cancelled(cancel)
+
+        self._report_progress(progress, "Building report")
+        report = self._report_type(filename = self._filename, **report_kwargs)
+        report.save_report(cancel = cancel)
+
+        return ReportResult(self._filename)
+
+def _init_report_process():
+    # Plots are only rendered to files, never shown
+    import matplotlib
+    matplotlib.use("agg")
+
+    # Load the standard fonts and their metrics before the first report needs them
+    Canvas(io.BytesIO()).setFont("Times-Bold", 22)
+
+    for asset in Path(assets_dir).glob("*.pdf"):
+        load_pdf_asset(asset)
+
+# Pool building the reports of a batch, kept between batches so the worker processes
+# only load reportlab, the fonts, the styles and the report assets once
+_report_pool = WorkerPool(initializer = _init_report_process)
+
+def _build_report(runner: ReportRunner) -> ReportResult:
+    return runner.run()
+
+@dataclass
+class BatchReportEntry:
+    """
+    One report of a batch. ``error`` is set when the report could not be built.
+    """
+    title: str
+    runner: ReportRunner
+    treatment_unit: str = "N/A"
+    error: str | None = None
+
+    @property
+    def filename(self) -> str:
+        return self.runner.filename
+
+@dataclass
+class BatchReportResult:
+    output_dir: str
+    filename: str
+    entries: list[BatchReportEntry] = field(default_factory = list)
+
+    @property
+    def failed(self) -> list[BatchReportEntry]:
+        return [entry for entry in self.entries if entry.error is not None]
+
+class BatchReportRunner(AnalysisRunner):
+    """
+    Builds the reports of ``entries`` concurrently in a pool of worker processes, then
+    saves an index of the reports in ``output_dir``. The reports are saved where their
+    runners say, which should be in ``output_dir`` for the links of the index to work.
+    A report that fails is listed as such in the index and does not stop the others.
+    """
+
+    cacheable = False
+
+    def __init__(self, entries: list[BatchReportEntry], output_dir: str,
+                 index_name: str = "index.pdf", author: str = "N/A",
+                 institution: str = "N/A", max_workers: int | None = None):
+        self._entries = entries
+        self._output_dir = output_dir
+        self._index_name = index_name
+        self._author = author
+        self._institution = institution
+        self._max_workers = max_workers
+
+    @property
+    def filename(self) -> str:
+        return os.path.join(self._output_dir, self._index_name)
+
+    def run(self, progress: ProgressCallback | None = None,
+            cancel: CancellationToken | None = None) -> BatchReportResult:
+        os.makedirs(self._output_dir, exist_ok = True)
+
+        max_workers = min(pool_workers(self._max_workers), len(self._entries))
+
+        if max_workers <= 1:
+            for count, entry in enumerate(self._entries, start = 1):
+                self._check_cancelled(cancel)
+
+                try:
+                    entry.runner.run(cancel = cancel)
+                except AnalysisCancelled:
+                    raise
+                except Exception as err:
+                    traceback.print_exception(err)
+                    entry.error = str(err) or type(err).__name__
+
+                self._report_progress(progress, f"{count}/{len(self._entries)} reports")
+
+        else:
+            self._check_cancelled(cancel)
+            self._build_in_pool(max_workers, progress, cancel)
+
+        self._report_progress(progress, "Building index")
+        BatchIndexReport(self.filename, self._entries, self._author, self._institution).save_report(cancel)
+
+        return BatchReportResult(self._output_dir, self.filename, self._entries)
+
+    def _build_in_pool(self, max_workers: int, progress: ProgressCallback | None,
+                       cancel: CancellationToken | None):
+        results = _report_pool.run_all(max_workers, _build_report,
+                                       [(entry.runner,) for entry in self._entries])
+
+        with closing(results):
+            for count, (index, future) in enumerate(results, start = 1):
+                try:
+                    future.result()
+                except Exception as err:
+                    traceback.print_exception(err)
+                    self._entries[index].error = str(err) or type(err).__name__
+
+                self._check_cancelled(cancel)
+                self._report_progress(progress, f"{count}/{len(self._entries)} reports")
+
+class BatchIndexReport(BaseReport):
+    """
+    Class for generating the index of a batch of reports, with a link to each report
+    """
+    def __init__(
+        self, filename: str,
+        entries: list[BatchReportEntry],
+        author: str = "N/A",
+        institution: str = "N/A",
+        report_name: str = "QA Reports"
+        ):
+        super().__init__(filename, report_name)
+
+        self._entries = entries
+        self._author = author
+        self._institution = institution
+
+    def set_user_details(self, doc_contents: list):
+        saved = len([entry for entry in self._entries if entry.error is None])
+
+        data = [[Paragraph("<b>Physicist</b>"), f": {self._author}"],
+                [Paragraph("<b>Institution</b>"), f": {self._institution}"],
+                [Paragraph("<b>Created</b>"), f": {datetime.now():%d %B %Y %H:%M}"],
+                [Paragraph("<b>Reports</b>"), f": {saved} of {len(self._entries)} saved"]]
+
+        doc_contents.append(Table(data, colWidths=[3.5*cm, 8.0*cm], hAlign="LEFT",
+                                  style=[('LEFTPADDING', (0,0), (0,-1), 0)]))
+
+    def set_report_list(self, doc_contents: list):
+        doc_contents.append(Spacer(1, 16)) # add spacing of 16 pts
+        doc_contents.append(Paragraph("<b><u><font size=11 color=\"darkblue\">Reports:</font></u></b>"))
+        doc_contents.append(Spacer(1, 16)) # add spacing of 16 pts
+
+        index_dir = os.path.dirname(os.path.abspath(self._filename))
+        data = [[Paragraph("<b>No.</b>"), Paragraph("<b>Report</b>"),
+                 Paragraph("<b>Treatment unit</b>"), Paragraph("<b>Status</b>")]]
+
+        for number, entry in enumerate(self._entries, start = 1):
+            title = escape(entry.title)
+
+            if entry.error is None:
+                # Relative links keep working when the folder is moved
+                link = escape(os.path.relpath(os.path.abspath(entry.filename), index_dir).replace(os.sep, "/"))
+                title = f'<a href="{link}" color="blue">{title}</a>'
+                status = "Saved"
+            else:
+                status = Paragraph(f"Failed: {escape(entry.error)}")
+
+            data.append([str(number), Paragraph(title), Paragraph(escape(entry.treatment_unit)), status])
+
+        table = Table(data, colWidths=[1.2*cm, 7.5*cm, 3.5*cm, 4.0*cm], hAlign="LEFT", repeatRows=1,
+                      style=[('GRID', (0,0), (-1,-1), 0.5, colors.grey),
+                             ('BACKGROUND', (0,0), (-1,0), colors.lightgrey),
+                             ('VALIGN', (0,0), (-1,-1), 'TOP'),
+                             ('LINEABOVE', (0,0), (-1,0), 1, colors.black),
+                             ('LINEABOVE', (0,1), (-1,1), 1, colors.black)])
+
+        doc_contents.append(table)
+
+    def save_report(self, cancel: CancellationToken | None = None):
+        document =  SimpleDocTemplate(self._filename)
+        doc_contents = [Spacer(1, 2.0*cm)]
+
+        self.set_user_details(doc_contents)
+        self.set_report_list(doc_contents)
+
+        self.build_document(document, doc_contents, cancel, onFirstPage=self.add_metadata,
+                            onLaterPages=self.add_page_number)
+
+def parse_pdf_image(imgdata) -> tuple[PdfDict, float, float]:
+    """
+    The single page of a PDF as a form XObject, with its width and height.
+    """
+    page, = PdfReader(imgdata).pages
+    return pagexobj(page), float(page['/MediaBox'][2]), float(page['/MediaBox'][3])
+
+# Parsed PDF files (e.g. the formulas of report_assets) by path, modification time and
+# size, shared by the reports built in this process
+_pdf_assets: dict[str, tuple[tuple[int, int], tuple[PdfDict, float, float]]] = {}
+_pdf_assets_lock = threading.Lock()
+
+def load_pdf_asset(path: str | Path) -> tuple[PdfDict, float, float]:
+    """
+    Same as ``parse_pdf_image`` for a file, which is only parsed again once it changes.
+    The form XObject is shared, toreportlab converts it once per report.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+
+    with _pdf_assets_lock:
+        cached = _pdf_assets.get(path)
+
+        if cached is None or cached[0] != version:
+            cached = _pdf_assets[path] = (version, parse_pdf_image(path))
+
+    return cached[1]
 
 class PdfImage(Flowable):
     def __init__(self, image: str | io.BytesIO, width=None, height=None):
@@ -938,13 +1288,16 @@ class PdfImage(Flowable):
         self.img_data = self.form_xo_reader(image)
 
     def form_xo_reader(self, imgdata):
-        page, = PdfReader(imgdata).pages
+        if isinstance(imgdata, (str, Path)):
+            xobj, width, height = load_pdf_asset(imgdata)
+        else:
+            xobj, width, height = parse_pdf_image(imgdata)
 
         if self.img_width is None or self.img_height is None:
-            self.img_width = float(page['/MediaBox'][2])
-            self.img_height = float(page['/MediaBox'][3])
+            self.img_width = width
+            self.img_height = height
 
-        return pagexobj(page)
+        return xobj
 
     def wrap(self, width, height):
         return self.img_width, self.img_height
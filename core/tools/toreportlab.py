@@ -49,8 +49,17 @@ Notes:
        (e.g. with a table of contents).  These have
        a different doc object on every pass.
 
+    4) PyBeam QA keeps parsed objects (e.g. the report assets)
+       alive between documents.  The derived objects are
+       held weakly so finished documents can be freed,
+       and streams with the same content and a plain
+       dictionary (e.g. the same font embedded by several
+       assets) are only written once per document.
+
 '''
 
+import weakref
+
 from reportlab.pdfbase import pdfdoc as rldocmodule
 from pdfrw.objects import PdfDict, PdfArray, PdfName
 from pdfrw.py23_diffs import convert_store
@@ -59,6 +68,9 @@ RLStream = rldocmodule.PDFStream
 RLDict = rldocmodule.PDFDictionary
 RLArray = rldocmodule.PDFArray
 
+# Streams already written to each document, by content
+_doc_streams = weakref.WeakKeyDictionary()
+
 
 def _makedict(rldoc, pdfobj):
     rlobj = rldict = RLDict()
@@ -73,9 +85,32 @@ def _makedict(rldoc, pdfobj):
     return rlobj
 
 
+def _stream_key(pdfobj):
+    # Only streams whose dictionary holds no other objects can be shared
+    items = []
+    for key, value in pdfobj.iteritems():
+        if isinstance(value, (PdfDict, PdfArray)):
+            return None
+        items.append((key, str(value)))
+    return pdfobj.stream, tuple(sorted(items))
+
+
 def _makestream(rldoc, pdfobj, xobjtype=PdfName.XObject):
+    key = _stream_key(pdfobj)
+    if key is not None:
+        streams = _doc_streams.setdefault(rldoc, {})
+        derived = streams.get(key)
+        if derived is not None:
+            pdfobj.derived_rl_obj[rldoc] = derived
+            return derived[0]
+
+    # The converted data is kept with the object, for the next document
+    data = getattr(pdfobj.private, 'rl_stream_data', None)
+    if data is None:
+        data = pdfobj.private.rl_stream_data = convert_store(pdfobj.stream)
+
     rldict = RLDict()
-    rlobj = RLStream(rldict, convert_store(pdfobj.stream))
+    rlobj = RLStream(rldict, data)
 
     if pdfobj.Type == xobjtype:
         shortname = 'pdfrw_%s' % (rldoc.objectcounter + 1)
@@ -84,6 +119,8 @@ def _makestream(rldoc, pdfobj, xobjtype=PdfName.XObject):
         shortname = fullname = None
     result = rldoc.Reference(rlobj, fullname)
     pdfobj.derived_rl_obj[rldoc] = result, shortname
+    if key is not None:
+        streams[key] = result, shortname
 
     for key, value in pdfobj.iteritems():
         rldict[key[1:]] = makerl_recurse(rldoc, value)
@@ -129,11 +166,11 @@ def makerl_recurse(rldoc, pdfobj):
         else:
             func = _makedict
         if docdict is None:
-            pdfobj.private.derived_rl_obj = {}
+            pdfobj.private.derived_rl_obj = weakref.WeakKeyDictionary()
     elif isinstance(pdfobj, PdfArray):
         func = _makearray
         if docdict is None:
-            pdfobj.derived_rl_obj = {}
+            pdfobj.derived_rl_obj = weakref.WeakKeyDictionary()
     else:
         func = _makestr
     return func(rldoc, pdfobj)
@@ -2,16 +2,21 @@ from PySide6 import QtWidgets
 from PySide6.QtGui import QIcon
 
 from ui.app_main_win import AppMainWin
+from core.analysis.scheduler import analysis_scheduler
 from core.tools.devices import DeviceManager
 
 import sys
-
-app = QtWidgets.QApplication(sys.argv)
+import multiprocessing
 
 def initFiles():
     DeviceManager.loadDevices("core/tools/list.json")
 
 if __name__ == "__main__":
+    # Needed for the analysis worker processes when running as a frozen executable
+    multiprocessing.freeze_support()
+
+    # Worker processes re-import this module, so only create the application here
+    app = QtWidgets.QApplication(sys.argv)
 
     initFiles()
     
@@ -23,4 +28,5 @@ if __name__ == "__main__":
 
     app.setWindowIcon(QIcon(u":/misc_icons/icons/ic_app_alt.svg").pixmap(48))
     app.exec()
-    
+
+    analysis_scheduler().shutdown()
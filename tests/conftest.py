@@ -0,0 +1,11 @@
+import os
+import os.path as osp
+import sys
+import tempfile
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+# The result cache and the results database live in the home directory, keep the
+# user's out of the tests (worker processes inherit the variable)
+os.environ["HOME"] = tempfile.mkdtemp(prefix = "pybeam_qa_tests_")
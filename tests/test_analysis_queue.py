@@ -0,0 +1,45 @@
+import time
+
+from PySide6.QtWidgets import QApplication
+
+from core.analysis.compute.base import AnalysisRunner
+from core.analysis.scheduler import AnalysisJob, AnalysisScheduler
+from core.analysis.worker import QAnalysisWorker
+from ui.util_widgets.analysis_queue import AnalysisQueueWidget
+
+class EmptyRunner(AnalysisRunner):
+
+    cacheable = False
+
+    def run(self, progress = None, cancel = None):
+        return None
+
+class EmptyWorker(QAnalysisWorker):
+
+    def __init__(self):
+        super().__init__()
+        self.runner = EmptyRunner()
+
+    def handle_result(self, result):
+        self.thread_finished.emit()
+
+def test_queue_widget_after_finished_job():
+    app = QApplication.instance() or QApplication([])
+    scheduler = AnalysisScheduler(1, "thread")
+    job = scheduler.submit(EmptyWorker(), "Empty analysis")
+
+    deadline = time.monotonic() + 30
+    while not job.is_finished and time.monotonic() < deadline:
+        app.processEvents()
+        time.sleep(0.01)
+
+    assert job.state == AnalysisJob.COMPLETE
+    assert job.worker is None
+
+    # The widget of a window opened after the job has finished
+    widget = AnalysisQueueWidget(scheduler)
+    item = widget.job_items[job.job_id]
+
+    assert item.text(2) == "Complete"
+    assert job.peak_rss is not None
+    assert item.text(4) == f"{job.peak_rss / 2**20:.0f} MB"
@@ -0,0 +1,50 @@
+import shutil
+
+from core.analysis.compute import base
+from core.analysis.compute.base import AnalysisRunner
+from core.analysis.compute.cache import ResultCache
+
+class CountingRunner(AnalysisRunner):
+
+    execution_parameters = ("max_workers",)
+    runs = 0
+
+    def __init__(self, directory: str, max_workers: int | None = None):
+        self._directory = directory
+        self._max_workers = max_workers
+
+    def run(self, progress = None, cancel = None) -> int:
+        CountingRunner.runs += 1
+        return CountingRunner.runs
+
+def _make_directory(path, images: dict[str, bytes]):
+    for name, content in images.items():
+        (path / name).parent.mkdir(parents = True, exist_ok = True)
+        (path / name).write_bytes(content)
+
+    return str(path)
+
+def test_directory_key_follows_its_files(tmp_path):
+    cache = ResultCache(tmp_path / "cache")
+    directory = _make_directory(tmp_path / "images", {"a.dcm": b"a", "sub/b.dcm": b"b"})
+    key = cache.key("analysis", {"directory": directory})
+
+    # Same files elsewhere
+    moved = shutil.copytree(directory, tmp_path / "moved")
+    assert cache.key("analysis", {"directory": str(moved)}) == key
+
+    (tmp_path / "images" / "sub" / "b.dcm").write_bytes(b"changed")
+    assert cache.key("analysis", {"directory": directory}) != key
+
+    (tmp_path / "moved" / "c.dcm").write_bytes(b"c")
+    assert cache.key("analysis", {"directory": str(moved)}) != key
+
+def test_run_cached_ignores_execution_parameters(tmp_path, monkeypatch):
+    cache = ResultCache(tmp_path / "cache")
+    monkeypatch.setattr(base, "result_cache", lambda: cache)
+    directory = _make_directory(tmp_path / "images", {"a.dcm": b"a"})
+
+    first = CountingRunner(directory, max_workers = 1).run_cached()
+
+    assert CountingRunner(directory, max_workers = 4).run_cached() == first
+    assert CountingRunner(directory, max_workers = 4).parameters()["max_workers"] == 4
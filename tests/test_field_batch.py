@@ -0,0 +1,80 @@
+import os
+import signal
+import time
+
+import pytest
+from pylinac.core.image_generator import AS500Image, FilteredFieldLayer, GaussianFilterLayer
+
+from core.analysis.compute import field_analysis
+from core.analysis.compute.field_analysis import FieldAnalysisBatchRunner, FieldAnalysisRunner
+
+class KillingRunner(FieldAnalysisRunner):
+    """
+    Kills its worker process, like an image that runs it out of memory.
+    """
+
+    cacheable = False
+
+    def run(self, progress = None, cancel = None):
+        os._exit(1)
+
+@pytest.fixture(scope = "module")
+def field_images(tmp_path_factory) -> list[str]:
+    folder = tmp_path_factory.mktemp("fields")
+    paths = []
+
+    for index, size in enumerate((80, 100, 120)):
+        path = str(folder / f"field_{index}.dcm")
+        simulator = AS500Image(1000)
+        simulator.add_layer(FilteredFieldLayer(field_size_mm = (size, size)))
+        simulator.add_layer(GaussianFilterLayer(sigma_mm = 2))
+        simulator.generate_dicom(path)
+        paths.append(path)
+
+    return paths
+
+def _kill_worker(max_workers: int):
+    pool = field_analysis._batch_pool._executor(max_workers)
+    os.kill(next(iter(pool._processes)), signal.SIGKILL)
+
+    # Wait for the pool to notice, so the next batch finds it broken
+    deadline = time.monotonic() + 30
+    while not pool._broken and time.monotonic() < deadline:
+        time.sleep(0.1)
+
+    assert pool._broken
+
+def test_batch_after_worker_died(field_images):
+    first = FieldAnalysisBatchRunner(field_images, max_workers = 2).run()
+    assert not first.failed
+
+    _kill_worker(2)
+
+    second = FieldAnalysisBatchRunner(field_images, max_workers = 2).run()
+    assert not second.failed
+    assert second.table() == first.table()
+
+def test_batch_isolates_failed_image(field_images, tmp_path):
+    broken = tmp_path / "broken.dcm"
+    broken.write_bytes(b"not a DICOM file")
+
+    result = FieldAnalysisBatchRunner([*field_images, str(broken)], max_workers = 2).run()
+
+    assert [entry.error is None for entry in result.entries] == [True, True, True, False]
+
+def test_batch_default_workers(field_images, monkeypatch):
+    monkeypatch.setattr(os, "cpu_count", lambda: 4)
+
+    result = FieldAnalysisBatchRunner(field_images).run()
+
+    assert not result.failed
+    assert field_analysis._batch_pool._max_workers == 3
+
+def test_batch_isolates_killed_worker(field_images):
+    runners = [FieldAnalysisRunner(path) for path in field_images]
+    runners.insert(1, KillingRunner(field_images[0]))
+
+    entries = FieldAnalysisBatchRunner(field_images)._analyze_in_pool(runners, 2, None, None)
+
+    # Only the image that kills its worker fails, not the images pending with it
+    assert [entry.error is None for entry in entries] == [True, False, True, True]
@@ -0,0 +1,27 @@
+import warnings
+
+import numpy as np
+from pylinac.core.image_generator import AS500Image, FilteredFieldLayer
+
+from core.analysis.compute.picket_fence import PFMergedImage
+
+def _generate(path: str, field: bool) -> str:
+    simulator = AS500Image(1000)
+    if field:
+        simulator.add_layer(FilteredFieldLayer(field_size_mm = (100, 100)))
+    simulator.generate_dicom(path)
+
+    return path
+
+def test_merge_with_blank_image(tmp_path):
+    field = _generate(str(tmp_path / "field.dcm"), field = True)
+    blank = _generate(str(tmp_path / "blank.dcm"), field = False)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", RuntimeWarning)
+        merged = PFMergedImage([field, blank])
+        alone = PFMergedImage([field])
+
+    # The blank image adds nothing to the mean of the two images
+    assert np.all(np.isfinite(merged.array))
+    np.testing.assert_allclose(merged.array, alone.array / 2)
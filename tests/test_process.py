@@ -0,0 +1,62 @@
+import os
+
+from core.analysis.compute import process
+from core.analysis.compute.base import AnalysisRunner
+from core.analysis.compute.process import (ProcessExecutor, WorkerPool, pool_workers,
+                                           running_analysis)
+from core.image.dicom import dicom_cache
+
+class RunningAnalysesRunner(AnalysisRunner):
+
+    cacheable = False
+
+    def run(self, progress = None, cancel = None) -> int:
+        return process._running_counter().value
+
+class CacheBudgetRunner(AnalysisRunner):
+
+    cacheable = False
+
+    def run(self, progress = None, cancel = None) -> tuple[int, int]:
+        # The budget of a sub-pool worker, next to the one of this worker process
+        future = WorkerPool().submit(1, _cache_budget)
+
+        return _cache_budget(), future.result()
+
+def _cache_budget() -> int:
+    return dicom_cache().max_bytes
+
+def test_default_pool_workers(monkeypatch):
+    monkeypatch.setattr(os, "cpu_count", lambda: 8)
+
+    # A single analysis gets every core but the one of the application
+    assert pool_workers() == 7
+    with running_analysis():
+        assert pool_workers() == 7
+
+        with running_analysis(), running_analysis():
+            assert pool_workers() == 2
+
+    assert pool_workers(3) == 3
+
+def test_worker_process_counts_running_analyses():
+    executor = ProcessExecutor(1)
+
+    try:
+        result, _ = executor.submit(0, RunningAnalysesRunner()).result()
+    finally:
+        executor.shutdown()
+
+    assert result == 1
+    assert process._running_counter().value == 0
+
+def test_worker_processes_share_image_cache():
+    executor = ProcessExecutor(2)
+
+    try:
+        (worker_budget, pool_budget), _ = executor.submit(0, CacheBudgetRunner()).result()
+    finally:
+        executor.shutdown()
+
+    assert worker_budget == dicom_cache().max_bytes // 2
+    assert pool_budget == 0
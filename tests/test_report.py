@@ -0,0 +1,21 @@
+import os
+
+from core.database.results import AnalysisRecord
+from core.tools import report
+from core.tools.report import (AnalysisRecordReport, BatchReportEntry, BatchReportRunner,
+                               ReportRunner)
+
+def test_batch_report_default_workers(tmp_path, monkeypatch):
+    monkeypatch.setattr(os, "cpu_count", lambda: 4)
+
+    record = AnalysisRecord.from_results("starshot", {"wobble_diameter_mm": 0.5, "passed": True})
+    entries = [BatchReportEntry(f"Starshot {index}",
+                                ReportRunner(AnalysisRecordReport, str(tmp_path / f"starshot_{index}.pdf"),
+                                             record = record))
+               for index in range(3)]
+
+    result = BatchReportRunner(entries, str(tmp_path)).run()
+
+    assert not result.failed
+    assert report._report_pool._max_workers == 3
+    assert all(os.path.exists(entry.filename) for entry in entries)
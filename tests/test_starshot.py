@@ -0,0 +1,85 @@
+import os
+import warnings
+
+import numpy as np
+import pytest
+from pylinac.core.image_generator import AS1200Image, FilteredFieldLayer, GaussianFilterLayer
+from scipy import ndimage
+
+from core.analysis.compute import starshot as starshot_module
+from core.analysis.compute.starshot import (StarshotAnalysis, StarshotCandidate,
+                                            StarshotSweepRunner, merge_starshot_images)
+from core.image.dicom import load_image
+
+RADII = (0.95, 0.85, 0.75, 0.65, 0.55, 0.45)
+MIN_PEAK_HEIGHTS = (0.25, 0.5)
+
+class KillingStarshot(StarshotAnalysis):
+    """
+    Kills its worker process when searched with a radius of 0.75, like a search that
+    runs it out of memory.
+    """
+
+    def analyze_prepared(self, start_point, radius = 0.85, *args, **kwargs):
+        if radius == 0.75:
+            os._exit(1)
+
+        return super().analyze_prepared(start_point, radius, *args, **kwargs)
+
+@pytest.fixture(scope = "module")
+def starshot_image(tmp_path_factory) -> str:
+    path = str(tmp_path_factory.mktemp("starshot") / "star.dcm")
+    simulator = AS1200Image(1000)
+
+    for angle in (0, 30, 60, 90, 120, 150):
+        spoke = AS1200Image(1000)
+        spoke.add_layer(FilteredFieldLayer((300, 4)))
+        simulator.image = simulator.image + ndimage.rotate(spoke.image, angle, reshape = False)
+
+    simulator.add_layer(GaussianFilterLayer(sigma_mm = 1))
+    simulator.generate_dicom(path)
+
+    return path
+
+def _search(path: str, analysis_type: type, max_workers: int) -> list[StarshotCandidate]:
+    starshot = analysis_type(load_image(path))
+    start_point = starshot.prepare()
+    candidates = [StarshotCandidate(radius, height) for radius in RADII for height in MIN_PEAK_HEIGHTS]
+
+    runner = StarshotSweepRunner(path, max_workers = max_workers)
+    searched = runner._search(starshot, start_point, candidates, None, None)
+
+    return sorted(searched, key = lambda candidate: (candidate.radius, candidate.min_peak_height))
+
+def test_sweep_default_workers(starshot_image, monkeypatch):
+    monkeypatch.setattr(os, "cpu_count", lambda: 4)
+
+    result = StarshotSweepRunner(starshot_image, radii = RADII,
+                                 min_peak_heights = MIN_PEAK_HEIGHTS).run()
+
+    assert result.best.found
+    assert starshot_module._sweep_pool._max_workers == 3
+
+def test_sweep_isolates_killed_worker(starshot_image):
+    expected = _search(starshot_image, StarshotAnalysis, 1)
+    searched = _search(starshot_image, KillingStarshot, 2)
+
+    # Only the candidates that kill their worker fail, not the candidates pending with them
+    for candidate, reference in zip(searched, expected):
+        if candidate.radius == 0.75:
+            assert not candidate.found
+        else:
+            assert candidate == reference
+
+def test_merge_with_blank_image(starshot_image, tmp_path):
+    blank = str(tmp_path / "blank.dcm")
+    AS1200Image(1000).generate_dicom(blank)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", RuntimeWarning)
+        merged = merge_starshot_images([starshot_image, blank])
+        alone = merge_starshot_images([starshot_image])
+
+    # The blank image adds nothing to the sum of the two images
+    assert np.all(np.isfinite(merged.array))
+    np.testing.assert_allclose(merged.array, alone.array)
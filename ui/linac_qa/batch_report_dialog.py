@@ -0,0 +1,235 @@
+from PySide6.QtWidgets import (QApplication, QDialog, QDialogButtonBox, QFormLayout, QHBoxLayout,
+                               QLineEdit, QPushButton, QDateEdit, QPlainTextEdit, QCheckBox,
+                               QComboBox, QLabel, QRadioButton, QButtonGroup, QFileDialog,
+                               QVBoxLayout, QSizePolicy, QSpacerItem, QWidget)
+from PySide6.QtCore import QDate, QTime, QDateTime
+
+import os.path as osp
+import re
+import sqlite3
+import traceback
+
+from core.analysis.report import QBatchReportWorker
+from core.database.results import results_database
+from core.tools.devices import DeviceManager
+from core.tools.report import (AnalysisRecordReport, BatchReportEntry, BatchReportRunner,
+                               ReportRunner)
+from ui.linac_qa.qa_tools_win import QAToolsWindow
+from ui.util_widgets import submit_report
+from ui.util_widgets.dialogs import MessageDialog
+
+def report_file_name(number: int, title: str) -> str:
+    # Characters that are not allowed in file names on Windows
+    title = re.sub(r'[<>:"/\\|?*\x00-\x1f]', "_", title).strip(" .")
+    return f"{number:02d} {title}.pdf"
+
+def analyzed_worksheets() -> list[tuple[str, QWidget]]:
+    """
+    The worksheets of all the open QA windows that have an analysis ready for a report,
+    with their tab titles.
+    """
+    worksheets = []
+
+    for window in QApplication.topLevelWidgets():
+        if not isinstance(window, QAToolsWindow):
+            continue
+
+        for index in range(window.ui.tabWidget.count()):
+            worksheet = window.ui.tabWidget.widget(index)
+
+            # Same condition as the "Generate Report" button of the worksheet
+            if hasattr(worksheet, "report_runner") and worksheet.ui.genReportBtn.isEnabled():
+                worksheets.append((window.ui.tabWidget.tabText(index), worksheet))
+
+    return worksheets
+
+def open_results_database():
+    try:
+        return results_database()
+    except (OSError, sqlite3.Error) as err:
+        traceback.print_exception(err)
+        return None
+
+class BatchReportDialog(QDialog):
+    """
+    Saves the reports of many analyses in one folder, with an index of the reports. The
+    analyses are either those of the open worksheets or those in the results database.
+    """
+
+    def __init__(self, parent: QWidget | None = None):
+        super().__init__(parent)
+
+        self.setWindowTitle("Batch Reports ‒ PyBeam QA")
+
+        self.worksheets = analyzed_worksheets()
+
+        self.physicist_name_le = QLineEdit()
+        self.institution_name_le = QLineEdit()
+        self.comments_te = QPlainTextEdit()
+        self.analysis_date = QDateEdit()
+        self.physicist_name_le.setMinimumWidth(250)
+        self.institution_name_le.setMinimumWidth(350)
+        self.analysis_date.setMaximumWidth(120)
+        self.analysis_date.setCalendarPopup(True)
+        self.analysis_date.setDisplayFormat("dd MMMM yyyy")
+        self.analysis_date.setMaximumDate(QDate.currentDate())
+        self.analysis_date.setDate(QDate.currentDate())
+
+        self.worksheets_rb = QRadioButton(f"Open worksheets ({len(self.worksheets)} analyzed)")
+        self.database_rb = QRadioButton("Results database")
+        self.source_group = QButtonGroup(self)
+        self.source_group.addButton(self.worksheets_rb)
+        self.source_group.addButton(self.database_rb)
+        source_layout = QVBoxLayout()
+        source_layout.addWidget(self.worksheets_rb)
+        source_layout.addWidget(self.database_rb)
+
+        self.start_date = QDateEdit()
+        self.end_date = QDateEdit()
+        for date_edit in (self.start_date, self.end_date):
+            date_edit.setCalendarPopup(True)
+            date_edit.setDisplayFormat("dd MMMM yyyy")
+            date_edit.setMaximumWidth(120)
+        self.start_date.setDate(QDate.currentDate().addMonths(-1))
+        self.end_date.setDate(QDate.currentDate())
+        date_range_layout = QHBoxLayout()
+        date_range_layout.addWidget(self.start_date)
+        date_range_layout.addWidget(QLabel("to"))
+        date_range_layout.addWidget(self.end_date)
+
+        self.treatment_unit_cb = QComboBox()
+        self.treatment_unit_cb.setEditable(True)
+        self.treatment_unit_cb.setMinimumWidth(250)
+        self.treatment_unit_cb.addItem("")
+        self.treatment_unit_cb.addItems([linac.name for linac in DeviceManager.device_list["linacs"]])
+        self.treatment_unit_cb.setToolTip("Leave empty for all the treatment units")
+
+        self.output_dir_le = QLineEdit()
+        self.output_dir_le.setReadOnly(True)
+        output_dir_btn = QPushButton("Save to...")
+        output_dir_layout = QHBoxLayout()
+        output_dir_layout.addWidget(self.output_dir_le)
+        output_dir_layout.addWidget(output_dir_btn)
+
+        self.open_index_checkbox = QCheckBox()
+        open_index_label = QLabel("Open index:")
+        self.open_index_checkbox.setSizePolicy(QSizePolicy.Policy.Fixed, QSizePolicy.Policy.Fixed)
+        open_index_label.setSizePolicy(QSizePolicy.Policy.Fixed, QSizePolicy.Policy.Fixed)
+        open_index_layout = QHBoxLayout()
+        open_index_layout.addWidget(open_index_label)
+        open_index_layout.addWidget(self.open_index_checkbox)
+
+        details_layout = QFormLayout()
+        details_layout.addRow("Physicist:", self.physicist_name_le)
+        details_layout.addRow("Institution:", self.institution_name_le)
+        details_layout.addRow("Analysis date:", self.analysis_date)
+        details_layout.addRow("Analyses:", source_layout)
+        details_layout.addRow("Acquired:", date_range_layout)
+        details_layout.addRow("Treatment unit:", self.treatment_unit_cb)
+        details_layout.addRow("Save location:", output_dir_layout)
+        details_layout.addRow("Comments:", self.comments_te)
+        details_layout.addRow("", open_index_layout)
+        details_layout.addItem(QSpacerItem(1, 10, QSizePolicy.Policy.Minimum,
+                                           QSizePolicy.Policy.Minimum))
+
+        dialog_buttons = QDialogButtonBox()
+        self.save_button = dialog_buttons.addButton(QDialogButtonBox.StandardButton.Save)
+        cancel_button = dialog_buttons.addButton(QDialogButtonBox.StandardButton.Cancel)
+
+        layout = QVBoxLayout()
+        layout.addLayout(details_layout)
+        layout.addWidget(dialog_buttons)
+        self.setLayout(layout)
+
+        self.source_group.buttonToggled.connect(self.update_state)
+        self.output_dir_le.textChanged.connect(self.update_state)
+        output_dir_btn.clicked.connect(self.select_output_dir)
+        cancel_button.clicked.connect(self.reject)
+        self.save_button.clicked.connect(self.accept)
+
+        self.database = open_results_database()
+        self.database_rb.setEnabled(self.database is not None)
+
+        if self.worksheets:
+            self.worksheets_rb.setChecked(True)
+        else:
+            self.worksheets_rb.setEnabled(False)
+            self.database_rb.setChecked(True)
+        self.update_state()
+        self.setFixedSize(self.sizeHint())
+
+    def update_state(self):
+        from_database = self.database_rb.isChecked() and self.database is not None
+        self.start_date.setEnabled(from_database)
+        self.end_date.setEnabled(from_database)
+        self.treatment_unit_cb.setEnabled(from_database)
+
+        has_source = self.worksheets_rb.isChecked() or from_database
+        self.save_button.setEnabled(has_source and self.output_dir_le.text() != "")
+
+    def select_output_dir(self):
+        output_dir = QFileDialog.getExistingDirectory(self, "Save Reports To...")
+
+        if output_dir != "":
+            self.output_dir_le.setText(output_dir)
+
+    def report_entries(self) -> list[BatchReportEntry]:
+        output_dir = self.output_dir_le.text()
+        author = self.physicist_name_le.text() or "N/A"
+        institution = self.institution_name_le.text() or "N/A"
+        analysis_date = self.analysis_date.date().toString("dd MMMM yyyy")
+        comments = self.comments_te.toPlainText()
+        entries = []
+
+        if self.worksheets_rb.isChecked():
+            for number, (title, worksheet) in enumerate(self.worksheets, start = 1):
+                treatment_unit = worksheet.report_treatment_unit or "N/A"
+                filename = osp.join(output_dir, report_file_name(number, title))
+                runner = worksheet.report_runner(filename, author, institution, treatment_unit,
+                                                 analysis_date, comments)
+                entries.append(BatchReportEntry(title, runner, treatment_unit))
+
+            return entries
+
+        start = QDateTime(self.start_date.date(), QTime(0, 0)).toPython()
+        end = QDateTime(self.end_date.date(), QTime(23, 59, 59)).toPython()
+        records = self.database.analyses(linac = self.treatment_unit_cb.currentText() or None,
+                                         start = start, end = end)
+
+        # Oldest first, like the pages of a logbook
+        for number, record in enumerate(reversed(records), start = 1):
+            title = f"{record.analysis_type.replace('_', ' ').title()} {record.acquired_at:%Y-%m-%d %H%M}"
+            if record.beam:
+                title += f" {record.beam}"
+
+            filename = osp.join(output_dir, report_file_name(number, title))
+            runner = ReportRunner(AnalysisRecordReport, filename,
+                                  record = record,
+                                  author = author,
+                                  institution = institution,
+                                  analysis_date = analysis_date,
+                                  comments = comments)
+            entries.append(BatchReportEntry(title, runner, record.linac or "N/A"))
+
+        return entries
+
+    def accept(self):
+        entries = self.report_entries()
+
+        if not entries:
+            info_dialog = MessageDialog(self)
+            info_dialog.set_title("Batch Reports")
+            info_dialog.set_header_text("There are no analyses to report")
+            info_dialog.set_info_text("No stored analysis was acquired in the selected dates.")
+            info_dialog.set_standard_buttons(QDialogButtonBox.StandardButton.Ok)
+            info_dialog.set_icon(MessageDialog.INFO_ICON)
+            info_dialog.exec()
+            return
+
+        runner = BatchReportRunner(entries, self.output_dir_le.text(),
+                                   author = self.physicist_name_le.text() or "N/A",
+                                   institution = self.institution_name_le.text() or "N/A")
+        submit_report(QBatchReportWorker(runner), f"Batch of {len(entries)} reports",
+                      self.open_index_checkbox.isChecked(), self.parent())
+
+        super().accept()
@@ -3,25 +3,29 @@ from PySide6.QtWidgets import (QWidget, QLabel, QProgressBar, QVBoxLayout, QFile
                                QMainWindow, QFormLayout, QGridLayout,
                                QSplitter, QComboBox, QDialog, QDialogButtonBox, QLineEdit,
                                QSpacerItem,QPushButton, QCheckBox, QHBoxLayout, QPlainTextEdit,
-                               QDateEdit)
-from PySide6.QtGui import QIcon, QPixmap
-from PySide6.QtCore import Qt, QSize, QEvent, QThread, Signal, QDate
+                               QDateEdit, QTableWidget, QTableWidgetItem, QHeaderView)
+from PySide6.QtGui import QIcon, QPixmap, QColor
+from PySide6.QtCore import Qt, QSize, QEvent, Signal, QDate
 
 from ui.linac_qa.qa_tools_win import QAToolsWindow
 from ui.py_ui import icons_rc
-from ui.util_widgets import worksheet_save_report
+from ui.util_widgets import worksheet_save_report, submit_report, prepare_plots
 from ui.util_widgets.statusbar import AnalysisInfoLabel
 from ui.py_ui.field_analysis_worksheet_ui import Ui_QFieldAnalysisWorksheet
-from core.analysis.field_analysis import QFieldAnalysis, QFieldAnalysisWorker
-from core.tools.report import FieldAnalysisReport
+from core.analysis.compute.field_analysis import FieldBatchResult
+from core.analysis.field_analysis import QFieldAnalysis, QFieldAnalysisBatchWorker, QFieldAnalysisWorker
+from core.analysis.scheduler import analysis_scheduler
+from core.analysis.report import QReportWorker
+from core.tools.report import FieldAnalysisReport, ReportRunner
 from core.tools.devices import DeviceManager
 
 import platform
-import webbrowser
 import subprocess
+import traceback
 import pyqtgraph as pg
 from pathlib import Path
-from pylinac.core.image import LinacDicomImage
+from core.image.dicom import load_dicom_image
+from core.image.indexer import ImageHeaderIndexer
 from pylinac.field_analysis import Protocol, Centering, Interpolation, Normalization, Edge
 
 class FieldAnalysisMainWindow(QAToolsWindow):
@@ -35,6 +39,8 @@ class FieldAnalysisMainWindow(QAToolsWindow):
         self.add_new_worksheet()
 
         self.ui.menuFile.addAction("Add Image(s)", self.ui.tabWidget.currentWidget().add_files)
+        self.ui.menuFile.addAction("Batch Analyze Folder...",
+                                   lambda: self.ui.tabWidget.currentWidget().batch_analyze_folder())
         self.ui.menuFile.addSeparator()
         self.ui.menuFile.addAction("Add New Worksheet", self.add_new_worksheet)
 
@@ -82,6 +88,14 @@ class QFieldAnalysisWorksheet(QWidget):
         self.ui.genReportBtn.setEnabled(False)
         self.ui.summaryTE.setReadOnly(True)
 
+        self.batchBtn = QPushButton("Batch analysis")
+        self.batchBtn.setToolTip("Analyze every selected image with the same parameters, "
+                                 "in one table of results")
+        self.batchBtn.setSizePolicy(self.ui.analyzeBtn.sizePolicy())
+        self.batchBtn.setStyleSheet(self.ui.analyzeBtn.styleSheet())
+        self.batchBtn.setEnabled(False)
+        self.ui.mainActionsHL.insertWidget(1, self.batchBtn, 0, Qt.AlignLeft)
+
         # Add widgets
         self.progress_vl = QVBoxLayout()
         self.progress_vl.setSpacing(10)
@@ -121,9 +135,26 @@ class QFieldAnalysisWorksheet(QWidget):
         self.progress_vl.addWidget(self.analysis_progress_bar, 0, Qt.AlignHCenter)
         self.progress_vl.addWidget(self.analysis_message_label, 0, Qt.AlignHCenter)
 
+        self.cancel_analysis_btn = QPushButton("Cancel")
+        self.cancel_analysis_btn.setToolTip("Cancel the running analysis")
+        self.cancel_analysis_btn.clicked.connect(self.cancel_analysis)
+        self.cancel_analysis_btn.hide()
+        self.progress_vl.addWidget(self.cancel_analysis_btn, 0, Qt.AlignHCenter)
+
+        # Problems found in the image headers before the analysis
+        self.header_warning_label = QLabel()
+        self.header_warning_label.setWordWrap(True)
+        self.header_warning_label.setStyleSheet("color: rgb(255, 170, 0);")
+        self.header_warning_label.hide()
+        self.progress_vl.addWidget(self.header_warning_label)
+
+        self.header_indexer = ImageHeaderIndexer(self.ui.imageListWidget, self)
+        self.header_indexer.headers_updated.connect(self.update_header_warnings)
+
         # Connect slots
         self.ui.addImgBtn.clicked.connect(self.add_files)
         self.ui.analyzeBtn.clicked.connect(self.start_analysis)
+        self.batchBtn.clicked.connect(lambda: self.start_batch_analysis(list(self.marked_images)))
         self.ui.advancedViewBtn.clicked.connect(self.show_advanced_results_view)
         self.ui.genReportBtn.clicked.connect(self.generate_report)
         self.ui.imageListWidget.itemChanged.connect(self.update_marked_images)
@@ -133,7 +164,9 @@ class QFieldAnalysisWorksheet(QWidget):
         self.current_results = None
         self.imageView_windows = []
         self.advanced_results_view = None
+        self.batch_results_dialog = None
         self.analysis_in_progress = False
+        self.job = None
         self.has_analysis = False
 
         self.setup_config()
@@ -149,6 +182,7 @@ class QFieldAnalysisWorksheet(QWidget):
         self.report_date = QDate.currentDate()
         self.save_path = ""
         self.save_comment = ""
+        self.report_treatment_unit = ""
 
     def setup_config(self):
         """
@@ -258,6 +292,8 @@ class QFieldAnalysisWorksheet(QWidget):
                 listItemWidget.setCheckState(Qt.Unchecked)
                 listItemWidget.setData(Qt.UserRole, itemData)
 
+            self.header_indexer.index(files)
+
     def remove_selected_files(self):
         index = 0
         while index < self.ui.imageListWidget.count():
@@ -322,15 +358,24 @@ class QFieldAnalysisWorksheet(QWidget):
         
         if len(self.marked_images) > 0:
             self.ui.analyzeBtn.setEnabled(True)
+            self.batchBtn.setEnabled(True)
 
         else:
             self.ui.analyzeBtn.setEnabled(False)
+            self.batchBtn.setEnabled(False)
             self.analysis_message_label.hide()
 
+        self.update_header_warnings()
+
+    def update_header_warnings(self):
+        warnings = self.header_indexer.warnings(self.marked_images)
+        self.header_warning_label.setText("\n".join(warnings))
+        self.header_warning_label.setVisible(len(warnings) > 0)
+
     def view_dicom_image(self):
         image_short_name = self.ui.imageListWidget.currentItem().text()
         image_path = self.ui.imageListWidget.selectedItems()[0].data(Qt.UserRole)["file_path"]
-        image = LinacDicomImage(image_path)
+        image = load_dicom_image(image_path)
 
         imgView = pg.ImageView()
         imgView.setImage(image.array)
@@ -425,6 +470,7 @@ class QFieldAnalysisWorksheet(QWidget):
         self.ui.addImgBtn.setEnabled(True)
     
         self.analysis_progress_bar.hide()
+        self.cancel_analysis_btn.hide()
         self.analysis_message_label.hide()
 
         self.warning_dialog = QMessageBox()
@@ -441,62 +487,152 @@ class QFieldAnalysisWorksheet(QWidget):
 
         self.warning_dialog.exec()
 
-    def start_analysis(self):
+    def cancel_analysis(self):
+        if self.analysis_in_progress and self.job is not None:
+            self.cancel_analysis_btn.setEnabled(False)
+            self.analysis_message_label.setText("Cancelling analysis...")
+            analysis_scheduler().cancel(self.job)
+
+    def on_analysis_cancelled(self):
+        self.analysis_info_signal.emit({"state": AnalysisInfoLabel.CANCELLED,
+                                        "message": None})
+        self.analysis_state =  AnalysisInfoLabel.CANCELLED
+        self.analysis_message = None
+
+        self.analysis_in_progress = False
+        self.restore_list_checkmarks()
+
+        self.ui.analyzeBtn.setText(f"Analyze images")
+        self.ui.addImgBtn.setEnabled(True)
+
+        self.analysis_progress_bar.hide()
+        self.analysis_message_label.hide()
+        self.cancel_analysis_btn.hide()
+
+    def analysis_parameters(self) -> dict:
+        """
+        The parameters of the analysis, as set in the configuration fields.
+        """
+        return {"protocol": self.DEFAULT_PROTOCOLS[self.ui.protocolCB.currentText()],
+                "centering": self.ui.centeringCB.currentText(),
+                "vert_position": self.ui.vertPosDSB.value(),
+                "horiz_position": self.ui.horPosDSB.value(),
+                "normalization_method": self.ui.normalizationCB.currentText(),
+                "edge_detection_method": self.ui.edgeDetCB.currentText(),
+                "edge_smoothing_ratio": self.ui.edgeSmoothDSB.value(),
+                "hill_window_ratio": self.ui.hillWinRatioDSB.value(),
+                "interpolation": self.ui.interpolationCB.currentText(),
+                "in_field_ratio": self.ui.inFieldRatioDSB.value(),
+                "slope_exclusion_ratio": self.ui.slopeExclRatioDSB.value(),
+                "is_FFF": self.ui.fffBeamCheckB.isChecked(),
+                "invert": self.ui.invertImageCheckB.isChecked(),
+                "ground": self.ui.groundCheckB.isChecked()}
+
+    def set_busy(self):
+        """
+        Show an analysis in progress and lock the image list until it is done.
+        """
         self.analysis_info_signal.emit({"state": AnalysisInfoLabel.IN_PROGRESS,
                                         "message": None})
         self.analysis_state =  AnalysisInfoLabel.IN_PROGRESS
         self.analysis_message = None
 
         self.analysis_in_progress = True
-        self.ui.advancedViewBtn.setEnabled(False)
-        self.ui.genReportBtn.setEnabled(False)
         self.remove_list_checkmarks()
 
-        self.ui.summaryTE.hide()
-        self.ui.summaryTE.clear()
-
         self.ui.addImgBtn.setEnabled(False)
-        self.ui.genReportBtn.setEnabled(False)
         self.ui.analyzeBtn.setEnabled(False)
+        self.batchBtn.setEnabled(False)
         self.ui.analyzeBtn.setText("Analysis in progress...")
         self.analysis_message_label.setText("Analysis in progress")
         self.analysis_progress_bar.show()
         self.analysis_message_label.show()
 
+    def start_analysis(self):
+        self.set_busy()
+        self.ui.advancedViewBtn.setEnabled(False)
+        self.ui.genReportBtn.setEnabled(False)
+
+        self.ui.summaryTE.hide()
+        self.ui.summaryTE.clear()
+
         self.set_protocol = self.ui.protocolCB.currentText()
             
-        self.worker = QFieldAnalysisWorker(path = self.marked_images[0],
-                                           protocol = self.DEFAULT_PROTOCOLS[self.set_protocol],
-                                           centering = self.ui.centeringCB.currentText(),
-                                           vert_position = self.ui.vertPosDSB.value(),
-                                           horiz_position = self.ui.horPosDSB.value(),
-                                           normalization_method = self.ui.normalizationCB.currentText(),
-                                           edge_detection_method = self.ui.edgeDetCB.currentText(),
-                                           edge_smoothing_ratio = self.ui.edgeSmoothDSB.value(),
-                                           hill_window_ratio = self.ui.hillWinRatioDSB.value(),
-                                           interpolation = self.ui.interpolationCB.currentText(),
-                                           in_field_ratio = self.ui.inFieldRatioDSB.value(),
-                                           slope_exclusion_ratio = self.ui.slopeExclRatioDSB.value(),
-                                           is_FFF = self.ui.fffBeamCheckB.isChecked(),
-                                           invert = self.ui.invertImageCheckB.isChecked(),
-                                           ground = self.ui.groundCheckB.isChecked()
-                                           )
+        self.worker = QFieldAnalysisWorker(path = self.marked_images[0], **self.analysis_parameters())
         
-        self.qthread = QThread()
-        self.worker.moveToThread(self.qthread)
-        self.worker.analysis_failed.connect(self.qthread.quit)
         self.worker.analysis_failed.connect(self.on_analysis_failed)
-        self.worker.thread_finished.connect(self.qthread.quit)
         self.worker.analysis_results_ready.connect(lambda results: self.show_analysis_results(results))
-        self.qthread.started.connect(self.worker.analyze)
-        self.qthread.finished.connect(self.qthread.deleteLater)
 
-        self.qthread.start()
+        self.worker.analysis_cancelled.connect(self.on_analysis_cancelled)
+
+        self.cancel_analysis_btn.setEnabled(True)
+        self.cancel_analysis_btn.show()
+
+        self.job = analysis_scheduler().submit(self.worker, f"Field analysis ({Path(self.marked_images[0]).name})")
+
+    def batch_analyze_folder(self):
+        if self.analysis_in_progress:
+            return
+
+        folder = QFileDialog.getExistingDirectory(self, "Select Folder of Field Analysis Images")
+
+        if folder != "":
+            self.start_batch_analysis(folder)
+
+    def start_batch_analysis(self, paths: str | list[str]):
+        """
+        Analyze the images ``paths`` (or the DICOM images of the folder ``paths``) with the
+        current parameters, and show their results in one table. The last single analysis
+        stays the one shown and reported.
+        """
+        self.set_busy()
+
+        try:
+            self.worker = QFieldAnalysisBatchWorker(paths, **self.analysis_parameters())
+            self.worker.analysis_progress.connect(self.analysis_message_label.setText)
+            self.worker.analysis_failed.connect(self.on_analysis_failed)
+            self.worker.thread_finished.connect(self.worker.deleteLater)
+            self.worker.batch_ready.connect(self.show_batch_results)
+            self.worker.analysis_cancelled.connect(self.on_analysis_cancelled)
+
+            self.cancel_analysis_btn.setEnabled(True)
+            self.cancel_analysis_btn.show()
+
+            name = Path(paths).name if isinstance(paths, str) else f"{len(paths)} image(s)"
+            self.job = analysis_scheduler().submit(self.worker, f"Batch field analysis ({name})")
+
+        except Exception as err:
+            self.on_analysis_failed(traceback.format_exception_only(err)[-1])
+
+    def show_batch_results(self, result: FieldBatchResult):
+        self.analysis_in_progress = False
+        self.restore_list_checkmarks()
+
+        # Analyze buttons are auto-enabled by update_marked_images() on item data change
+        self.ui.analyzeBtn.setText(f"Analyze images")
+        self.ui.addImgBtn.setEnabled(True)
+
+        self.analysis_progress_bar.hide()
+        self.cancel_analysis_btn.hide()
+        self.analysis_message_label.hide()
+
+        message = f"{len(result.entries)} images analyzed"
+        if result.failed:
+            message += f", {len(result.failed)} failed"
+
+        self.analysis_info_signal.emit({"state": AnalysisInfoLabel.COMPLETE,
+                                        "message": message})
+        self.analysis_state =  AnalysisInfoLabel.COMPLETE
+        self.analysis_message = message
+
+        self.batch_results_dialog = FieldBatchResultsDialog(result, self)
+        self.batch_results_dialog.show()
 
     def show_analysis_results(self, results: dict):
         self.has_analysis = True
         self.current_results = results
         self.analysis_in_progress = False
+        prepare_plots(results["publishable_plots"], "Field analysis plots")
         self.ui.advancedViewBtn.setEnabled(True)
         self.ui.genReportBtn.setEnabled(True)
         self.restore_list_checkmarks()
@@ -513,6 +649,7 @@ class QFieldAnalysisWorksheet(QWidget):
         self.analysis_message = None
 
         self.analysis_progress_bar.hide()
+        self.cancel_analysis_btn.hide()
         self.analysis_message_label.hide()
 
         # Update the report summary
@@ -591,6 +728,7 @@ class QFieldAnalysisWorksheet(QWidget):
         # get linac devices
         linac_devices = DeviceManager.device_list["linacs"]
         treatment_unit_le.addItems([linac.name for linac in linac_devices])
+        treatment_unit_le.setCurrentText(self.report_treatment_unit)
 
         user_details_layout = QFormLayout()
         user_details_layout.addRow("Physicist:", physicist_name_le)
@@ -637,27 +775,102 @@ class QFieldAnalysisWorksheet(QWidget):
             self.report_institution = institution_name_le.text()
             self.save_comment = comments_te.toPlainText()
             self.report_date = analysis_date.date()
+            self.report_treatment_unit = treatment_unit_le.currentText()
 
             physicist_name = "N/A" if physicist_name_le.text() == "" else physicist_name_le.text()
             institution_name = "N/A" if institution_name_le.text() == "" else institution_name_le.text()
             treatment_unit = "N/A" if treatment_unit_le.currentText() == "" else treatment_unit_le.currentText()
 
-            fa = self.current_results["field_analysis_obj"]
-
-            report = FieldAnalysisReport(save_path_le.text(),
-                                   author = physicist_name,
-                                   institution = institution_name,
-                                   treatment_unit_name = treatment_unit,
-                                   protocol = self.set_protocol,
-                                   analysis_date = self.report_date.toString("dd MMMM yyyy"),
-                                   analysis_summary = fa.get_publishable_results(),
-                                   summary_plots = fa.get_publishable_plots(),
-                                   comments = comments_te.toPlainText())
-        
-            report.save_report()
+            runner = self.report_runner(save_path_le.text(), physicist_name, institution_name,
+                                        treatment_unit, self.report_date.toString("dd MMMM yyyy"),
+                                        comments_te.toPlainText())
+            submit_report(QReportWorker(runner), "Field analysis report", show_report_checkbox.isChecked(), self)
+
+    def report_runner(self, filename: str, author: str, institution: str, treatment_unit: str,
+                      analysis_date: str, comments: str) -> ReportRunner:
+        """
+        Report of the current analysis, built by a QReportWorker or with a batch of reports.
+        """
+        fa = self.current_results["field_analysis_obj"]
+
+        return ReportRunner(FieldAnalysisReport, filename,
+                            author = author,
+                            institution = institution,
+                            treatment_unit_name = treatment_unit,
+                            protocol = self.set_protocol,
+                            analysis_date = analysis_date,
+                            analysis_summary = fa.get_publishable_results(),
+                            plots = self.current_results["publishable_plots"],
+                            plots_argument = "summary_plots",
+                            comments = comments)
+
+class FieldBatchResultsDialog(QDialog):
+    """
+    The combined results table of a batch field analysis, one row per image, which can
+    be saved as a CSV file.
+    """
+
+    def __init__(self, result: FieldBatchResult, parent: QWidget | None = None):
+        super().__init__(parent)
+
+        self.result = result
+
+        self.setWindowTitle("Batch Field Analysis ‒ PyBeam QA")
+
+        headers, rows = result.table()
+
+        self.table_widget = QTableWidget(len(rows), len(headers))
+        self.table_widget.setHorizontalHeaderLabels(headers)
+        self.table_widget.horizontalHeader().setStretchLastSection(True)
+        self.table_widget.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.ResizeToContents)
+        self.table_widget.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+
+        for row, (entry, values) in enumerate(zip(result.entries, rows)):
+            for column, value in enumerate(values):
+                item = QTableWidgetItem(value)
+                item.setFlags(item.flags() ^ Qt.ItemFlag.ItemIsEditable)
+
+                if 0 < column < len(values) - 1:
+                    item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
+
+                if entry.error is not None:
+                    item.setBackground(QColor(231, 29, 14))
+
+                self.table_widget.setItem(row, column, item)
+
+        # Sortable once populated, e.g. by beam to group the field sizes of each energy
+        self.table_widget.horizontalHeader().setSortIndicator(0, Qt.SortOrder.AscendingOrder)
+        self.table_widget.setSortingEnabled(True)
+
+        summary = f"{len(result.entries)} images analyzed"
+        if result.failed:
+            summary += f", {len(result.failed)} failed"
+
+        dialog_buttons = QDialogButtonBox()
+        save_button = dialog_buttons.addButton("Save CSV...", QDialogButtonBox.ButtonRole.ActionRole)
+        close_button = dialog_buttons.addButton(QDialogButtonBox.StandardButton.Close)
+
+        layout = QVBoxLayout()
+        layout.addWidget(QLabel(summary))
+        layout.addWidget(self.table_widget)
+        layout.addWidget(dialog_buttons)
+        self.setLayout(layout)
+        self.resize(1100, 500)
+
+        save_button.clicked.connect(self.save_csv)
+        close_button.clicked.connect(self.close)
+
+    def save_csv(self):
+        filename, _ = QFileDialog.getSaveFileName(self, "Save Batch Results", "",
+                                                  "CSV Files (*.csv)")
+
+        if filename == "":
+            return
 
-            if show_report_checkbox.isChecked():
-                webbrowser.open(save_path_le.text())
+        try:
+            self.result.save_csv(filename)
+        except OSError as err:
+            QMessageBox.warning(self, "Batch Field Analysis", f"The results could not be saved: {err}")
             
 class AdvancedFAView(QMainWindow):
 
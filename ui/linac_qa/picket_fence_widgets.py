@@ -6,9 +6,9 @@ from PySide6.QtWidgets import (QWidget, QLabel, QProgressBar, QVBoxLayout, QFile
                                QPushButton, QCheckBox, QHBoxLayout, QPlainTextEdit,
                                QDateEdit)
 from PySide6.QtGui import QIcon, QPixmap
-from PySide6.QtCore import Qt, QSize, QEvent, QThread, Signal, QDate
+from PySide6.QtCore import Qt, QSize, QEvent, Signal, QDate
 
-from ui.util_widgets import worksheet_save_report
+from ui.util_widgets import worksheet_save_report, submit_report, prepare_plots
 from ui.util_widgets.statusbar import AnalysisInfoLabel
 from ui.linac_qa.picket_fence_test_dialog import PFTestDialog
 from ui.linac_qa.qa_tools_win import QAToolsWindow
@@ -17,12 +17,15 @@ from ui.py_ui.picket_fence_worksheet_ui import Ui_QPicketFenceWorksheet
 from core.analysis.picket_fence import (QPicketFence,
                                         QPicketFenceWorker,
                                         generate_picket_fence)
-from core.tools.report import PicketFenceReport
+from core.analysis.scheduler import analysis_scheduler
+from core.analysis.report import QReportWorker
+from core.tools.report import PicketFenceReport, ReportRunner
 from core.tools.devices import DeviceManager
+from core.image.dicom import load_dicom_image
+from core.image.indexer import ImageHeaderIndexer
 
 import traceback
 import platform
-import webbrowser
 import subprocess
 import pyqtgraph as pg
 from pathlib import Path
@@ -32,7 +35,6 @@ from pylinac.core.image_generator import (GaussianFilterLayer,
                                           AS500Image,
                                           AS1000Image,
                                           AS1200Image)
-from pylinac.core.image import LinacDicomImage
 from pylinac.picketfence import MLC, Orientation
 
 class PicketFenceMainWindow(QAToolsWindow):
@@ -204,6 +206,22 @@ class QPicketFenceWorksheet(QWidget):
         self.progress_vl.addWidget(self.analysis_progress_bar, 0, Qt.AlignHCenter)
         self.progress_vl.addWidget(self.analysis_message_label, 0, Qt.AlignHCenter)
 
+        self.cancel_analysis_btn = QPushButton("Cancel")
+        self.cancel_analysis_btn.setToolTip("Cancel the running analysis")
+        self.cancel_analysis_btn.clicked.connect(self.cancel_analysis)
+        self.cancel_analysis_btn.hide()
+        self.progress_vl.addWidget(self.cancel_analysis_btn, 0, Qt.AlignHCenter)
+
+        # Problems found in the image headers before the analysis
+        self.header_warning_label = QLabel()
+        self.header_warning_label.setWordWrap(True)
+        self.header_warning_label.setStyleSheet("color: rgb(255, 170, 0);")
+        self.header_warning_label.hide()
+        self.progress_vl.addWidget(self.header_warning_label)
+
+        self.header_indexer = ImageHeaderIndexer(self.ui.imageListWidget, self)
+        self.header_indexer.headers_updated.connect(self.update_header_warnings)
+
         #--------  connect slots -------- 
         self.ui.addImgBtn.clicked.connect(self.add_files)
         self.ui.analyzeBtn.clicked.connect(self.start_analysis)
@@ -218,6 +236,7 @@ class QPicketFenceWorksheet(QWidget):
         self.imageView_windows = []
         self.advanced_results_view = None
         self.analysis_in_progress = False
+        self.job = None
         self.has_analysis = False
 
         self.setup_config()
@@ -234,6 +253,7 @@ class QPicketFenceWorksheet(QWidget):
         self.report_date = QDate.currentDate()
         self.save_path = ""
         self.save_comment = ""
+        self.report_treatment_unit = ""
 
     def setup_config(self):
         self.ui.mlcTypeCB.addItems([mlc.value["name"] for mlc in MLC])
@@ -282,6 +302,8 @@ class QPicketFenceWorksheet(QWidget):
                 listItemWidget.setCheckState(Qt.Unchecked)
                 listItemWidget.setData(Qt.UserRole, itemData)
 
+            self.header_indexer.index(files)
+
     def remove_selected_files(self):
         index = 0
         while index < self.ui.imageListWidget.count():
@@ -358,10 +380,17 @@ class QPicketFenceWorksheet(QWidget):
             self.ui.analyzeBtn.setEnabled(False)
             self.analysis_message_label.hide()
 
+        self.update_header_warnings()
+
+    def update_header_warnings(self):
+        warnings = self.header_indexer.warnings(self.marked_images, same_size = True)
+        self.header_warning_label.setText("\n".join(warnings))
+        self.header_warning_label.setVisible(len(warnings) > 0)
+
     def view_dicom_image(self):
         image_short_name = self.ui.imageListWidget.currentItem().text()
         image_path = self.ui.imageListWidget.selectedItems()[0].data(Qt.UserRole)["file_path"]
-        image = LinacDicomImage(image_path)
+        image = load_dicom_image(image_path)
 
         imgView = pg.ImageView()
         imgView.setImage(image.array)
@@ -453,6 +482,7 @@ class QPicketFenceWorksheet(QWidget):
         self.ui.addImgBtn.setEnabled(True)
     
         self.analysis_progress_bar.hide()
+        self.cancel_analysis_btn.hide()
         self.analysis_message_label.hide()
 
         self.error_dialog = QMessageBox()
@@ -469,6 +499,28 @@ class QPicketFenceWorksheet(QWidget):
 
         self.error_dialog.exec()
 
+    def cancel_analysis(self):
+        if self.analysis_in_progress and self.job is not None:
+            self.cancel_analysis_btn.setEnabled(False)
+            self.analysis_message_label.setText("Cancelling analysis...")
+            analysis_scheduler().cancel(self.job)
+
+    def on_analysis_cancelled(self):
+        self.analysis_info_signal.emit({"state": AnalysisInfoLabel.CANCELLED,
+                                        "message": None})
+        self.analysis_state =  AnalysisInfoLabel.CANCELLED
+        self.analysis_message = None
+
+        self.analysis_in_progress = False
+        self.restore_list_checkmarks()
+
+        self.ui.analyzeBtn.setText(f"Analyze images")
+        self.ui.addImgBtn.setEnabled(True)
+
+        self.analysis_progress_bar.hide()
+        self.analysis_message_label.hide()
+        self.cancel_analysis_btn.hide()
+
     def start_analysis(self):
         self.analysis_info_signal.emit({"state": AnalysisInfoLabel.IN_PROGRESS,
                                         "message": None})
@@ -514,17 +566,16 @@ class QPicketFenceWorksheet(QWidget):
                                 nominal_gap = self.ui.nominalGapDSB.value(),
                                 separate_leaves = not self.ui.combLeafAnalysisCheckB.isChecked())
         
-                self.qthread = QThread()
-                self.worker.moveToThread(self.qthread)
-                self.worker.analysis_failed.connect(self.qthread.quit)
                 self.worker.analysis_failed.connect(lambda x: self.on_analysis_failed(error_message = x))
-                self.worker.thread_finished.connect(self.qthread.quit)
                 self.worker.thread_finished.connect(self.worker.deleteLater)
                 self.worker.analysis_results_ready.connect(lambda results: self.show_analysis_results(results))
-                self.qthread.started.connect(self.worker.analyze)
-                self.qthread.finished.connect(self.qthread.deleteLater)
 
-                self.qthread.start()
+                self.worker.analysis_cancelled.connect(self.on_analysis_cancelled)
+
+                self.cancel_analysis_btn.setEnabled(True)
+                self.cancel_analysis_btn.show()
+
+                self.job = analysis_scheduler().submit(self.worker, f"Picket fence ({Path(images).name})")
 
             except Exception as err:
                 self.on_analysis_failed(error_message = traceback.format_exception_only(err)[-1])
@@ -533,6 +584,7 @@ class QPicketFenceWorksheet(QWidget):
         self.has_analysis = True
         self.current_results = results
         self.analysis_in_progress = False
+        prepare_plots(results["publishable_plots"], "Picket fence plots")
         self.ui.advancedViewBtn.setEnabled(True)
         self.ui.genReportBtn.setEnabled(True)
         self.restore_list_checkmarks()
@@ -549,6 +601,7 @@ class QPicketFenceWorksheet(QWidget):
         self.analysis_message = None
 
         self.analysis_progress_bar.hide()
+        self.cancel_analysis_btn.hide()
         self.analysis_message_label.hide()
 
         for summary_item in results["summary_text"]:
@@ -661,6 +714,7 @@ class QPicketFenceWorksheet(QWidget):
         # get linac devices
         linac_devices = DeviceManager.device_list["linacs"]
         treatment_unit_le.addItems([linac.name for linac in linac_devices])
+        treatment_unit_le.setCurrentText(self.report_treatment_unit)
 
         user_details_layout = QFormLayout()
         user_details_layout.addRow("Physicist:", physicist_name_le)
@@ -708,46 +762,52 @@ class QPicketFenceWorksheet(QWidget):
             self.report_institution = institution_name_le.text()
             self.save_comment = comments_te.toPlainText()
             self.report_date = analysis_date.date()
+            self.report_treatment_unit = treatment_unit_le.currentText()
 
             physicist_name = "N/A" if physicist_name_le.text() == "" else physicist_name_le.text()
             institution_name = "N/A" if institution_name_le.text() == "" else institution_name_le.text()
             treatment_unit = "N/A" if treatment_unit_le.currentText() == "" else treatment_unit_le.currentText()
 
-            pf = self.current_results["picket_fence_obj"]
+            runner = self.report_runner(save_path_le.text(), physicist_name, institution_name,
+                                        treatment_unit, self.report_date.toString("dd MMMM yyyy"),
+                                        comments_te.toPlainText())
+            submit_report(QReportWorker(runner), "Picket fence report", show_report_checkbox.isChecked(), self)
+
+    def report_runner(self, filename: str, author: str, institution: str, treatment_unit: str,
+                      analysis_date: str, comments: str) -> ReportRunner:
+        """
+        Report of the current analysis, built by a QReportWorker or with a batch of reports.
+        """
+        pf = self.current_results["picket_fence_obj"]
+
+        summary_text = {"Gantry angle": f"{pf.image.gantry_angle:2.2f}°",
+                        "Collimator angle": f"{pf.image.collimator_angle:2.2f}°",
+                        "Number of leaves failing": str(len(pf.failed_leaves())),
+                        "Absolute median error": f"{pf.abs_median_error:2.2f} mm",
+                        "Mean picket spacing": f"{pf.mean_picket_spacing:2.2f} mm"}
+
+        if pf.separate_leaves:
+            leaf_name = pf.max_error_leaf[0] + f"-{(int(pf.max_error_leaf[1:]) + 1)}"
+            summary_text["Max Error"] = [f"{pf.max_error:2.3f} mm",
+                                         f"At picket: {pf.max_error_picket + 1}, leaf: {leaf_name}"]
 
-            summary_text = {"Gantry angle": f"{pf.image.gantry_angle:2.2f}°",
-                            "Collimator angle": f"{pf.image.collimator_angle:2.2f}°",
-                            "Number of leaves failing": str(len(pf.failed_leaves())),
-                            "Absolute median error": f"{pf.abs_median_error:2.2f} mm",
-                            "Mean picket spacing": f"{pf.mean_picket_spacing:2.2f} mm"}
-            
-            if pf.separate_leaves:
-                leaf_name = pf.max_error_leaf[0] + f"-{(int(pf.max_error_leaf[1:]) + 1)}"
-                summary_text["Max Error"] = [f"{pf.max_error:2.3f} mm",
-                                             f"At picket: {pf.max_error_picket + 1}, leaf: {leaf_name}"]
-
-            else:
-                summary_text["Max Error"] = [f"{pf.max_error:2.3f} mm",
-                                             f"At picket: {pf.max_error_picket + 1}, leaf: {pf.max_error_leaf + 1}"] 
-
-            report = PicketFenceReport(save_path_le.text(),
-                                   author = physicist_name,
-                                   institution = institution_name,
-                                   treatment_unit_name = treatment_unit,
-                                   mlc_type = pf.mlc_type,
-                                   analysis_date = self.report_date.toString("dd MMMM yyyy"),
-                                   analysis_summary = summary_text,
-                                   report_status = self.ui.outcomeLE.text(),
-                                   max_error = pf.max_error,
-                                   tolerance = self.ui.toleranceDSB.value(),
-                                   summary_plot = pf.get_publishable_plot(),
-                                   comments = comments_te.toPlainText()
-                                   )
-        
-            report.save_report()
-
-            if show_report_checkbox.isChecked():
-                webbrowser.open(save_path_le.text())
+        else:
+            summary_text["Max Error"] = [f"{pf.max_error:2.3f} mm",
+                                         f"At picket: {pf.max_error_picket + 1}, leaf: {pf.max_error_leaf + 1}"] 
+
+        return ReportRunner(PicketFenceReport, filename,
+                            author = author,
+                            institution = institution,
+                            treatment_unit_name = treatment_unit,
+                            mlc_type = pf.mlc_type,
+                            analysis_date = analysis_date,
+                            analysis_summary = summary_text,
+                            report_status = self.ui.outcomeLE.text(),
+                            max_error = pf.max_error,
+                            tolerance = self.ui.toleranceDSB.value(),
+                            plots = self.current_results["publishable_plots"],
+                            comments = comments
+                            )
 
     def clear_analysis_data(self):
         del self.current_results
@@ -850,7 +910,7 @@ class AdvancedPFView(QMainWindow):
         details = [["Gantry angle", f"{self.pf.image.gantry_angle:2.2f}°", ""],
                       ["Collimator angle", f"{self.pf.image.collimator_angle:2.2f}°", ""],
                       ["Number of pickets found", f"{len(self.pf.pickets)}", ""],
-                      ["Number of leaf pairs found", f"{int(len(self.pf.mlc_meas) / len(self.pf.pickets))}"]]
+                      ["Number of leaf pairs found", f"{len(self.pf.measurements.leaf_numbers())}"]]
         
         if self.pf.separate_leaves:
             leaf_name = self.pf.max_error_leaf[0] + f"-{(int(self.pf.max_error_leaf[1:]) + 1)}"
@@ -896,11 +956,11 @@ class AdvancedPFView(QMainWindow):
         self.pickets_cb.addItems([str(x) for x in range(1,self.pf.num_pickets+1)])
 
         if not self.pf.separate_leaves:
-            self.leafs_cb.addItems([str(x) for x in sorted({mlc.leaf_num + 1 for mlc in self.pf.mlc_meas})])
+            self.leafs_cb.addItems([str(x) for x in self.pf.measurements.leaf_numbers() + 1])
         
         else:
             leaf_items = []
-            [leaf_items.extend([f"A{x}", f"B{x}"]) for x in sorted({mlc.leaf_num for mlc in self.pf.mlc_meas})]
+            [leaf_items.extend([f"A{x}", f"B{x}"]) for x in self.pf.measurements.leaf_numbers()]
             self.leafs_cb.addItems(leaf_items)
 
         self.plot_leaf_profile(True)
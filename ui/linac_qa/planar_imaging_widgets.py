@@ -5,25 +5,27 @@ from PySide6.QtWidgets import (QWidget, QLabel, QProgressBar, QVBoxLayout, QFile
                                QSpacerItem, QPushButton, QCheckBox, QHBoxLayout, QPlainTextEdit,
                                QDateEdit)
 from PySide6.QtGui import QIcon, QPixmap
-from PySide6.QtCore import Qt, QSize, QEvent, QThread, Signal, QDate
+from PySide6.QtCore import Qt, QSize, QEvent, Signal, QDate
 
 from ui.py_ui.planar_imaging_worksheet_ui import Ui_QPlanarImagingWorksheet
 from ui.py_ui import icons_rc
-from ui.util_widgets import worksheet_save_report
+from ui.util_widgets import worksheet_save_report, submit_report, prepare_plots
 from ui.util_widgets.dialogs import MessageDialog
 from ui.util_widgets.statusbar import AnalysisInfoLabel
 from ui.linac_qa.qa_tools_win import QAToolsWindow
 from core.analysis.planar_imaging import QPlanarImaging, QPlanarImagingWorker
-from core.tools.report import PlanarImagingReport
+from core.analysis.scheduler import analysis_scheduler
+from core.analysis.report import QReportWorker
+from core.tools.report import PlanarImagingReport, ReportRunner
 from core.tools.devices import DeviceManager
+from core.image.dicom import load_dicom_image
+from core.image.indexer import ImageHeaderIndexer
 
 import platform
-import webbrowser
 import subprocess
 import pyqtgraph as pg
 from pathlib import Path
 
-from pylinac.core.image import LinacDicomImage
 from pylinac.planar_imaging import ImagePhantomBase
 from pylinac.core.contrast import Contrast
 
@@ -121,6 +123,22 @@ class QPlanarImagingWorksheet(QWidget):
         self.progress_vl.addWidget(self.analysis_progress_bar, 0, Qt.AlignHCenter)
         self.progress_vl.addWidget(self.analysis_message_label, 0, Qt.AlignHCenter)
 
+        self.cancel_analysis_btn = QPushButton("Cancel")
+        self.cancel_analysis_btn.setToolTip("Cancel the running analysis")
+        self.cancel_analysis_btn.clicked.connect(self.cancel_analysis)
+        self.cancel_analysis_btn.hide()
+        self.progress_vl.addWidget(self.cancel_analysis_btn, 0, Qt.AlignHCenter)
+
+        # Problems found in the image headers before the analysis
+        self.header_warning_label = QLabel()
+        self.header_warning_label.setWordWrap(True)
+        self.header_warning_label.setStyleSheet("color: rgb(255, 170, 0);")
+        self.header_warning_label.hide()
+        self.progress_vl.addWidget(self.header_warning_label)
+
+        self.header_indexer = ImageHeaderIndexer(self.ui.imageListWidget, self)
+        self.header_indexer.headers_updated.connect(self.update_header_warnings)
+
         #--------  connect slots -------- 
         self.ui.addImgBtn.clicked.connect(self.add_files)
         self.ui.analyzeBtn.clicked.connect(self.start_analysis)
@@ -134,6 +152,7 @@ class QPlanarImagingWorksheet(QWidget):
         self.imageView_windows = []
         self.advanced_results_view = None
         self.analysis_in_progress = False
+        self.job = None
         self.has_analysis = False
 
         self.setup_config()
@@ -149,6 +168,7 @@ class QPlanarImagingWorksheet(QWidget):
         self.report_date = QDate.currentDate()
         self.save_path = ""
         self.save_comment = ""
+        self.report_treatment_unit = ""
 
     def setup_config(self):
         """
@@ -241,6 +261,8 @@ class QPlanarImagingWorksheet(QWidget):
                 listItemWidget.setCheckState(Qt.Unchecked)
                 listItemWidget.setData(Qt.UserRole, itemData)
 
+            self.header_indexer.index(files)
+
     def remove_selected_files(self):
         index = 0
         while index < self.ui.imageListWidget.count():
@@ -310,10 +332,17 @@ class QPlanarImagingWorksheet(QWidget):
             self.ui.analyzeBtn.setEnabled(False)
             self.analysis_message_label.hide()
 
+        self.update_header_warnings()
+
+    def update_header_warnings(self):
+        warnings = self.header_indexer.warnings(self.marked_images)
+        self.header_warning_label.setText("\n".join(warnings))
+        self.header_warning_label.setVisible(len(warnings) > 0)
+
     def view_dicom_image(self):
         image_short_name = self.ui.imageListWidget.currentItem().text()
         image_path = self.ui.imageListWidget.selectedItems()[0].data(Qt.UserRole)["file_path"]
-        image = LinacDicomImage(image_path)
+        image = load_dicom_image(image_path)
 
         imgView = pg.ImageView()
         imgView.setImage(image.array)
@@ -402,6 +431,7 @@ class QPlanarImagingWorksheet(QWidget):
         self.ui.addImgBtn.setEnabled(True)
     
         self.analysis_progress_bar.hide()
+        self.cancel_analysis_btn.hide()
         self.analysis_message_label.hide()
 
         self.warning_dialog = MessageDialog()
@@ -413,6 +443,28 @@ class QPlanarImagingWorksheet(QWidget):
 
         self.warning_dialog.exec()
 
+    def cancel_analysis(self):
+        if self.analysis_in_progress and self.job is not None:
+            self.cancel_analysis_btn.setEnabled(False)
+            self.analysis_message_label.setText("Cancelling analysis...")
+            analysis_scheduler().cancel(self.job)
+
+    def on_analysis_cancelled(self):
+        self.analysis_info_signal.emit({"state": AnalysisInfoLabel.CANCELLED,
+                                        "message": None})
+        self.analysis_state =  AnalysisInfoLabel.CANCELLED
+        self.analysis_message = None
+
+        self.analysis_in_progress = False
+        self.restore_list_checkmarks()
+
+        self.ui.analyzeBtn.setText(f"Analyze images")
+        self.ui.addImgBtn.setEnabled(True)
+
+        self.analysis_progress_bar.hide()
+        self.analysis_message_label.hide()
+        self.cancel_analysis_btn.hide()
+
     def start_analysis(self):
         self.analysis_info_signal.emit({"state": AnalysisInfoLabel.IN_PROGRESS,
                                         "message": None})
@@ -469,21 +521,21 @@ class QPlanarImagingWorksheet(QWidget):
                                            size_override = size_override
                                            )
         
-        self.qthread = QThread()
-        self.worker.moveToThread(self.qthread)
-        self.worker.analysis_failed.connect(self.qthread.quit)
         self.worker.analysis_failed.connect(self.on_analysis_failed)
-        self.worker.thread_finished.connect(self.qthread.quit)
         self.worker.analysis_results_ready.connect(lambda results: self.show_analysis_results(results))
-        self.qthread.started.connect(self.worker.analyze)
-        self.qthread.finished.connect(self.qthread.deleteLater)
 
-        self.qthread.start()
+        self.worker.analysis_cancelled.connect(self.on_analysis_cancelled)
+
+        self.cancel_analysis_btn.setEnabled(True)
+        self.cancel_analysis_btn.show()
+
+        self.job = analysis_scheduler().submit(self.worker, f"Planar imaging ({Path(self.marked_images[0]).name})")
 
     def show_analysis_results(self, results: dict):
         self.has_analysis = True
         self.current_results = results
         self.analysis_in_progress = False
+        prepare_plots(results["publishable_plots"], "Planar imaging plots")
         self.ui.advancedViewBtn.setEnabled(True)
         self.ui.genReportBtn.setEnabled(True)
         self.restore_list_checkmarks()
@@ -500,6 +552,7 @@ class QPlanarImagingWorksheet(QWidget):
         self.analysis_message = None
     
         self.analysis_progress_bar.hide()
+        self.cancel_analysis_btn.hide()
         self.analysis_message_label.hide()
 
         for summary_item in results["summary_text"]:
@@ -594,6 +647,7 @@ class QPlanarImagingWorksheet(QWidget):
         # get linac devices
         linac_devices = DeviceManager.device_list["linacs"]
         treatment_unit_le.addItems([linac.name for linac in linac_devices])
+        treatment_unit_le.setCurrentText(self.report_treatment_unit)
 
         user_details_layout = QFormLayout()
         user_details_layout.addRow("Physicist:", physicist_name_le)
@@ -642,29 +696,38 @@ class QPlanarImagingWorksheet(QWidget):
             self.report_institution = institution_name_le.text()
             self.save_comment = comments_te.toPlainText()
             self.report_date = analysis_date.date()
+            self.report_treatment_unit = treatment_unit_le.currentText()
 
             physicist_name = "N/A" if physicist_name_le.text() == "" else physicist_name_le.text()
             institution_name = "N/A" if institution_name_le.text() == "" else institution_name_le.text()
             treatment_unit = "N/A" if treatment_unit_le.currentText() == "" else treatment_unit_le.currentText()
 
-            pi = self.current_results["planar_img_obj"]
-
-            report = PlanarImagingReport(save_path_le.text(),
-                                   author = physicist_name,
-                                   institution = institution_name,
-                                   treatment_unit_name = treatment_unit,
-                                   analysis_date = self.report_date.toString("dd MMMM yyyy"),
-                                   imaging_system_type = imaging_sys_cb.currentText(),
-                                   imaging_system_name = imaging_sys_name.currentText(),
-                                   phantom_name = pi._phantom.common_name,
-                                   summary_plots = pi.get_publishable_plots(),
-                                   analysis_summary = self.analysis_summary,
-                                   comments = comments_te.toPlainText())
-        
-            report.save_report()
+            runner = self.report_runner(save_path_le.text(), physicist_name, institution_name,
+                                        treatment_unit, self.report_date.toString("dd MMMM yyyy"),
+                                        comments_te.toPlainText(),
+                                        imaging_sys_cb.currentText(), imaging_sys_name.currentText())
+            submit_report(QReportWorker(runner), "Planar imaging report", show_report_checkbox.isChecked(), self)
 
-            if show_report_checkbox.isChecked():
-                webbrowser.open(save_path_le.text())
+    def report_runner(self, filename: str, author: str, institution: str, treatment_unit: str,
+                      analysis_date: str, comments: str,
+                      imaging_system_type: str = "N/A", imaging_system_name: str = "N/A") -> ReportRunner:
+        """
+        Report of the current analysis, built by a QReportWorker or with a batch of reports.
+        """
+        pi = self.current_results["planar_img_obj"]
+
+        return ReportRunner(PlanarImagingReport, filename,
+                            author = author,
+                            institution = institution,
+                            treatment_unit_name = treatment_unit,
+                            analysis_date = analysis_date,
+                            imaging_system_type = imaging_system_type,
+                            imaging_system_name = imaging_system_name,
+                            phantom_name = pi._phantom.common_name,
+                            plots = self.current_results["publishable_plots"],
+                            plots_argument = "summary_plots",
+                            analysis_summary = self.analysis_summary,
+                            comments = comments)
             
 class AdvancedPIView(QMainWindow):
 
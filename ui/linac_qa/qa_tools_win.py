@@ -7,6 +7,8 @@ from ui.py_ui.qa_main_win_ui import Ui_MainWindow
 from ui.util_widgets.statusbar import AnalysisInfoLabel
 from ui.util_widgets.dialogs import MessageDialog
 from ui.util_widgets.dialogs import AboutDialog
+from ui.util_widgets.analysis_queue import AnalysisQueueWidget
+from core.analysis.scheduler import analysis_scheduler
 
 class QAToolsWindow(QMainWindow):
 
@@ -42,9 +44,18 @@ class QAToolsWindow(QMainWindow):
         full_screen_action.setCheckable(True)
         #full_screen_action.toggled.connect(self.set_window_state)
 
-        # setup basic dock functionality
+        # setup basic dock functionality, the dock shows the shared analysis queue
+        self.ui.dockWidget.setWindowTitle("Analysis Queue")
+        self.ui.dockWidget.setWidget(AnalysisQueueWidget(analysis_scheduler()))
         self.ui.dockWidget.close()
 
+        self.ui.menuTools.addAction("Batch Reports...", self.batch_reports, "Ctrl+Shift+R")
+        self.ui.menuTools.addSeparator()
+
+        queue_action = self.ui.dockWidget.toggleViewAction()
+        queue_action.setText("Analysis Queue")
+        self.ui.menuView.addAction(queue_action)
+
         #copyright_text = QLabel("PyBeam QA - v0.1.0 (Copyright © 2023 Kagiso Lebang)")
         #copyright_text.setAlignment(Qt.AlignmentFlag.AlignCenter)
 
@@ -105,8 +116,21 @@ class QAToolsWindow(QMainWindow):
         response = warning_dialog.exec_()
 
         if response == QDialog.DialogCode.Accepted:
+            worksheet = self.ui.tabWidget.widget(tab_index)
+
+            # Stop the analysis of the worksheet so it does not hold up queued work
+            if getattr(worksheet, "analysis_in_progress", False) and hasattr(worksheet, "cancel_analysis"):
+                worksheet.cancel_analysis()
+
             self.ui.tabWidget.removeTab(tab_index)
         
+    def batch_reports(self):
+        # The dialog looks for the worksheets of every QAToolsWindow
+        from ui.linac_qa.batch_report_dialog import BatchReportDialog
+
+        dialog = BatchReportDialog(self)
+        dialog.exec()
+
     def about_app(self):
         about = AboutDialog()
         about.exec()
@@ -5,17 +5,20 @@ from PySide6.QtWidgets import (QWidget, QLabel, QProgressBar, QVBoxLayout, QFile
                                QPushButton, QCheckBox, QHBoxLayout, QPlainTextEdit,
                                QDateEdit)
 from PySide6.QtGui import QIcon, QPixmap
-from PySide6.QtCore import Qt, QSize, QEvent, QThread, Signal, QDate
+from PySide6.QtCore import Qt, QSize, QEvent, Signal, QDate
 
 from ui.py_ui import icons_rc
 from ui.py_ui.starshot_worksheet_ui import Ui_QStarshotWorksheet
-from ui.util_widgets import worksheet_save_report
+from ui.util_widgets import worksheet_save_report, submit_report, prepare_plots
 from ui.util_widgets.statusbar import AnalysisInfoLabel
 from ui.linac_qa.starshot_test_dialog import StarshotTestDialog
 from ui.linac_qa.qa_tools_win import QAToolsWindow
-from core.tools.report import StarshotReport
+from core.analysis.report import QReportWorker
+from core.tools.report import StarshotReport, ReportRunner
 from core.tools.devices import DeviceManager
-from core.analysis.starshot import QStarshotWorker
+from core.image.indexer import ImageHeaderIndexer
+from core.analysis.starshot import QStarshotWorker, QStarshotSweepWorker
+from core.analysis.scheduler import analysis_scheduler
 
 from pylinac.core.image import load
 from pylinac.core.image_generator import (GaussianFilterLayer,
@@ -28,7 +31,6 @@ from scipy import ndimage
 
 import traceback
 import platform
-import webbrowser
 import subprocess
 import pyqtgraph as pg
 from pathlib import Path
@@ -112,6 +114,14 @@ class QStarshotWorksheet(QWidget):
         self.ui.analyzeBtn.setText("Analyze image(s)")
         self.ui.genReportBtn.setEnabled(False)
 
+        # Searches a grid of radii and minimum peak heights when the spokes are hard to find
+        self.sweepBtn = QPushButton("Sweep parameters")
+        self.sweepBtn.setToolTip("Analyze with every radius and minimum peak height, and keep the best result")
+        self.sweepBtn.setSizePolicy(self.ui.analyzeBtn.sizePolicy())
+        self.sweepBtn.setStyleSheet(self.ui.analyzeBtn.styleSheet())
+        self.sweepBtn.setEnabled(False)
+        self.ui.mainActionsHL.insertWidget(1, self.sweepBtn, 0, Qt.AlignLeft)
+
         #--------  add widgets --------
         self.progress_vl = QVBoxLayout()
         self.progress_vl.setSpacing(10)
@@ -152,9 +162,26 @@ class QStarshotWorksheet(QWidget):
         self.progress_vl.addWidget(self.analysis_progress_bar, 0, Qt.AlignHCenter)
         self.progress_vl.addWidget(self.analysis_message_label, 0, Qt.AlignHCenter)
 
+        self.cancel_analysis_btn = QPushButton("Cancel")
+        self.cancel_analysis_btn.setToolTip("Cancel the running analysis")
+        self.cancel_analysis_btn.clicked.connect(self.cancel_analysis)
+        self.cancel_analysis_btn.hide()
+        self.progress_vl.addWidget(self.cancel_analysis_btn, 0, Qt.AlignHCenter)
+
+        # Problems found in the image headers before the analysis
+        self.header_warning_label = QLabel()
+        self.header_warning_label.setWordWrap(True)
+        self.header_warning_label.setStyleSheet("color: rgb(255, 170, 0);")
+        self.header_warning_label.hide()
+        self.progress_vl.addWidget(self.header_warning_label)
+
+        self.header_indexer = ImageHeaderIndexer(self.ui.imageListWidget, self)
+        self.header_indexer.headers_updated.connect(self.update_header_warnings)
+
         #--------  connect slots -------- 
         self.ui.addImgBtn.clicked.connect(self.add_files)
         self.ui.analyzeBtn.clicked.connect(self.start_analysis)
+        self.sweepBtn.clicked.connect(lambda: self.start_analysis(sweep = True))
         self.ui.genReportBtn.clicked.connect(self.generate_report)
         self.ui.imageListWidget.itemChanged.connect(self.update_marked_images)
         self.ui.toleranceDSB.valueChanged.connect(self.set_analysis_outcome)
@@ -166,6 +193,7 @@ class QStarshotWorksheet(QWidget):
         self.imageView_windows = []
         self.advanced_results_view = None
         self.analysis_in_progress = False
+        self.job = None
         self.has_analysis = False
 
         self.setup_config()
@@ -182,6 +210,7 @@ class QStarshotWorksheet(QWidget):
         self.report_date = QDate.currentDate()
         self.save_path = ""
         self.save_comment = ""
+        self.report_treatment_unit = ""
 
     def setup_config(self):
         self.ui.SIDInputCB.addItems(["Auto", "Manual"])
@@ -226,6 +255,8 @@ class QStarshotWorksheet(QWidget):
                 listItemWidget.setCheckState(Qt.Unchecked)
                 listItemWidget.setData(Qt.UserRole, itemData)
 
+            self.header_indexer.index(files)
+
     def remove_selected_files(self):
         index = 0
         while index < self.ui.imageListWidget.count():
@@ -290,6 +321,7 @@ class QStarshotWorksheet(QWidget):
         
         if len(self.marked_images) > 0:
             self.ui.analyzeBtn.setEnabled(True)
+            self.sweepBtn.setEnabled(True)
 
             if len(self.marked_images) > 1:
                 self.analysis_message_label.setText(f"{len(self.marked_images)} images will be merged and analyzed")
@@ -300,8 +332,16 @@ class QStarshotWorksheet(QWidget):
 
         else:
             self.ui.analyzeBtn.setEnabled(False)
+            self.sweepBtn.setEnabled(False)
             self.analysis_message_label.hide()
 
+        self.update_header_warnings()
+
+    def update_header_warnings(self):
+        warnings = self.header_indexer.warnings(self.marked_images, require_dicom = False, same_size = True)
+        self.header_warning_label.setText("\n".join(warnings))
+        self.header_warning_label.setVisible(len(warnings) > 0)
+
     def view_dicom_image(self):
         image_short_name = self.ui.imageListWidget.currentItem().text()
         image_path = self.ui.imageListWidget.selectedItems()[0].data(Qt.UserRole)["file_path"]
@@ -395,6 +435,7 @@ class QStarshotWorksheet(QWidget):
         self.ui.addImgBtn.setEnabled(True)
     
         self.analysis_progress_bar.hide()
+        self.cancel_analysis_btn.hide()
         self.analysis_message_label.hide()
 
         self.error_dialog = QMessageBox()
@@ -411,7 +452,29 @@ class QStarshotWorksheet(QWidget):
 
         self.error_dialog.exec()
 
-    def start_analysis(self):
+    def cancel_analysis(self):
+        if self.analysis_in_progress and self.job is not None:
+            self.cancel_analysis_btn.setEnabled(False)
+            self.analysis_message_label.setText("Cancelling analysis...")
+            analysis_scheduler().cancel(self.job)
+
+    def on_analysis_cancelled(self):
+        self.analysis_info_signal.emit({"state": AnalysisInfoLabel.CANCELLED,
+                                        "message": None})
+        self.analysis_state =  AnalysisInfoLabel.CANCELLED
+        self.analysis_message = None
+
+        self.analysis_in_progress = False
+        self.restore_list_checkmarks()
+
+        self.ui.analyzeBtn.setText(f"Analyze images")
+        self.ui.addImgBtn.setEnabled(True)
+
+        self.analysis_progress_bar.hide()
+        self.analysis_message_label.hide()
+        self.cancel_analysis_btn.hide()
+
+    def start_analysis(self, sweep: bool = False):
         self.analysis_info_signal.emit({"state": AnalysisInfoLabel.IN_PROGRESS,
                                         "message": None})
         self.analysis_state =  AnalysisInfoLabel.IN_PROGRESS
@@ -433,6 +496,7 @@ class QStarshotWorksheet(QWidget):
         self.ui.addImgBtn.setEnabled(False)
         self.ui.genReportBtn.setEnabled(False)
         self.ui.analyzeBtn.setEnabled(False)
+        self.sweepBtn.setEnabled(False)
         self.ui.analyzeBtn.setText("Analysis in progress...")
         self.analysis_message_label.setText("Analysis in progress")
         self.analysis_progress_bar.show()
@@ -454,26 +518,35 @@ class QStarshotWorksheet(QWidget):
 
         # Top level try clause catches file IO errors
         try:
-            self.worker = QStarshotWorker(filepath = images,
-                                          radius = self.ui.radiusSB.value(),
-                                          min_peak_height = self.ui.miniPeakHeightDSB.value(),
-                                          tolerance = self.ui.toleranceDSB.value(),
-                                          fwhm = self.ui.useFWHMCB.isChecked(),
-                                          recursive = self.ui.recursiveSearchCB.isChecked(),
-                                          invert = self.ui.forceInvertCB.isChecked(),
-                                          **params
-                                          )
-            self.qthread = QThread()
-            self.worker.moveToThread(self.qthread)
-            self.worker.analysis_failed.connect(self.qthread.quit)
+            if sweep:
+                self.worker = QStarshotSweepWorker(filepath = images,
+                                                   tolerance = self.ui.toleranceDSB.value(),
+                                                   fwhm = self.ui.useFWHMCB.isChecked(),
+                                                   invert = self.ui.forceInvertCB.isChecked(),
+                                                   **params
+                                                   )
+                self.worker.analysis_progress.connect(self.analysis_message_label.setText)
+            else:
+                self.worker = QStarshotWorker(filepath = images,
+                                              radius = self.ui.radiusSB.value(),
+                                              min_peak_height = self.ui.miniPeakHeightDSB.value(),
+                                              tolerance = self.ui.toleranceDSB.value(),
+                                              fwhm = self.ui.useFWHMCB.isChecked(),
+                                              recursive = self.ui.recursiveSearchCB.isChecked(),
+                                              invert = self.ui.forceInvertCB.isChecked(),
+                                              **params
+                                              )
             self.worker.analysis_failed.connect(self.on_analysis_failed)
-            self.worker.thread_finished.connect(self.qthread.quit)
             self.worker.thread_finished.connect(self.worker.deleteLater)
             self.worker.analysis_results_ready.connect(lambda results: self.show_analysis_results(results))
-            self.qthread.started.connect(self.worker.analyze)
-            self.qthread.finished.connect(self.qthread.deleteLater)
 
-            self.qthread.start()
+            self.worker.analysis_cancelled.connect(self.on_analysis_cancelled)
+
+            self.cancel_analysis_btn.setEnabled(True)
+            self.cancel_analysis_btn.show()
+
+            job_name = "Starshot sweep" if sweep else "Starshot"
+            self.job = analysis_scheduler().submit(self.worker, f"{job_name} ({len(self.marked_images)} image(s))")
 
         except Exception as err:
             self.on_analysis_failed(traceback.format_exception_only(err)[-1])
@@ -482,6 +555,7 @@ class QStarshotWorksheet(QWidget):
         self.has_analysis = True
         self.current_results = results
         self.analysis_in_progress = False
+        prepare_plots(results["publishable_plots"], "Starshot plots")
         self.ui.genReportBtn.setEnabled(True)
         self.restore_list_checkmarks()
 
@@ -497,6 +571,7 @@ class QStarshotWorksheet(QWidget):
         self.analysis_message = None
 
         self.analysis_progress_bar.hide()
+        self.cancel_analysis_btn.hide()
         self.analysis_message_label.hide()
 
         for summary_item in results["summary_text"]:
@@ -515,6 +590,14 @@ class QStarshotWorksheet(QWidget):
         self.analysis_summary= {"Wobble (circle) diameter": f"{starshot.wobble.radius_mm*2.0:2.3f} mm",
                                 "Number of spokes detected": f"{len(starshot.lines)}"}
 
+        # Offer the best parameters of a sweep for the next analyses
+        if results.get("sweep_candidates"):
+            best = results["sweep_candidates"][0]
+            self.ui.radiusSB.setValue(best.radius)
+            self.ui.miniPeakHeightDSB.setValue(best.min_peak_height)
+            self.analysis_summary["Swept parameters"] = (f"radius {best.radius:.2f}, "
+                                                         f"min. peak height {best.min_peak_height:.2f}")
+
     def remove_list_checkmarks(self):
         for index in range(self.ui.imageListWidget.count()):
             listItemWidget = self.ui.imageListWidget.item(index)
@@ -607,6 +690,7 @@ class QStarshotWorksheet(QWidget):
         # get linac devices
         linac_devices = DeviceManager.device_list["linacs"]
         treatment_unit_le.addItems([linac.name for linac in linac_devices])
+        treatment_unit_le.setCurrentText(self.report_treatment_unit)
 
         user_details_layout = QFormLayout()
         user_details_layout.addRow("Physicist:", physicist_name_le)
@@ -653,27 +737,34 @@ class QStarshotWorksheet(QWidget):
             self.report_institution = institution_name_le.text()
             self.save_comment = comments_te.toPlainText()
             self.report_date = analysis_date.date()
+            self.report_treatment_unit = treatment_unit_le.currentText()
 
             physicist_name = "N/A" if physicist_name_le.text() == "" else physicist_name_le.text()
             institution_name = "N/A" if institution_name_le.text() == "" else institution_name_le.text()
             treatment_unit = "N/A" if treatment_unit_le.currentText() == "" else treatment_unit_le.currentText()
         
-            starshot = self.current_results["starshot_obj"]
-
-            report = StarshotReport(filename = save_path_le.text(),
-                                    author = physicist_name,
-                                    institution = institution_name,
-                                    treatment_unit_name = treatment_unit,
-                                    analysis_date = self.report_date.toString("dd MMMM yyyy"),
-                                    analysis_summary = self.analysis_summary.copy(),
-                                    summary_plots = starshot.get_publishable_plots(),
-                                    wobble_diameter = starshot.wobble.radius_mm * 2.0,
-                                    tolerance = self.ui.toleranceDSB.value(),
-                                    report_status = self.ui.outcomeLE.text(),
-                                    comments = comments_te.toPlainText()
-                                    )
-            report.save_report()
-
-            if show_report_checkbox.isChecked():
-                webbrowser.open(save_path_le.text())
-            
\ No newline at end of file
+            runner = self.report_runner(save_path_le.text(), physicist_name, institution_name,
+                                        treatment_unit, self.report_date.toString("dd MMMM yyyy"),
+                                        comments_te.toPlainText())
+            submit_report(QReportWorker(runner), "Starshot report", show_report_checkbox.isChecked(), self)
+
+    def report_runner(self, filename: str, author: str, institution: str, treatment_unit: str,
+                      analysis_date: str, comments: str) -> ReportRunner:
+        """
+        Report of the current analysis, built by a QReportWorker or with a batch of reports.
+        """
+        starshot = self.current_results["starshot_obj"]
+
+        return ReportRunner(StarshotReport, filename,
+                            author = author,
+                            institution = institution,
+                            treatment_unit_name = treatment_unit,
+                            analysis_date = analysis_date,
+                            analysis_summary = self.analysis_summary.copy(),
+                            plots = self.current_results["publishable_plots"],
+                            plots_argument = "summary_plots",
+                            wobble_diameter = starshot.wobble.radius_mm * 2.0,
+                            tolerance = self.ui.toleranceDSB.value(),
+                            report_status = self.ui.outcomeLE.text(),
+                            comments = comments
+                            )
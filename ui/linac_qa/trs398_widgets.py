@@ -9,10 +9,11 @@ from core.tools.devices import Linac
 
 from ui.py_ui.photons_worksheet_ui import Ui_QPhotonsWorksheet
 from ui.py_ui.electrons_worksheet_ui import Ui_QElectronsWorksheet
-from ui.util_widgets import worksheet_save_report
+from ui.util_widgets import worksheet_save_report, submit_report
 from ui.util_widgets.validators import DoubleValidator
 from ui.util_widgets.dialogs import MessageDialog
-from core.tools.report import PhotonCalibrationReport, ElectronCalibrationReport
+from core.analysis.report import QReportWorker
+from core.tools.report import PhotonCalibrationReport, ElectronCalibrationReport, ReportRunner
 from core.calibration.trs398 import TRS398Photons, TRS398Electrons
 from core.configuration.config import ChambersConfig, SettingsConfig
 from ui.linac_qa.qa_tools_win import QAToolsWindow
@@ -22,7 +23,6 @@ from pathlib import Path
 
 from copy import copy
 import json
-import webbrowser
 
 #TODO Move TRS398 Electrons here!
 
@@ -213,17 +213,14 @@ class BaseTRS398Window(QAToolsWindow):
             calibration_info["comments"] = comments_te.toPlainText()
 
             if isinstance(worksheet, QPhotonsWorksheet):
-                report = PhotonCalibrationReport(filename=save_path_le.text(),
-                                                 calibration_info=calibration_info)
-                report.save_report()
+                runner = ReportRunner(PhotonCalibrationReport, save_path_le.text(),
+                                      calibration_info=calibration_info)
             
             else:
-                report = ElectronCalibrationReport(filename=save_path_le.text(),
-                                                 calibration_info=calibration_info)
-                report.save_report()
+                runner = ReportRunner(ElectronCalibrationReport, save_path_le.text(),
+                                      calibration_info=calibration_info)
 
-            if show_report_checkbox.isChecked():
-                webbrowser.open(save_path_le.text())
+            submit_report(QReportWorker(runner), "Beam calibration report", show_report_checkbox.isChecked(), self)
 
     def save_pybq_to(self) -> str | None:
         file_path = QFileDialog.getSaveFileName(caption="Save As...", 
@@ -5,19 +5,23 @@ from PySide6.QtWidgets import (QWidget, QListWidgetItem, QMenu, QFileDialog, QDi
                                QCheckBox, QGridLayout, QTabWidget, QSplitter, QTableWidget,
                                QHeaderView, QTableWidgetItem, QPlainTextEdit, QDateEdit)
 from PySide6.QtGui import QIcon, QPixmap, QColor, QAction, QTransform
-from PySide6.QtCore import Qt, QSize, QEvent, QThread, Signal, QDate
+from PySide6.QtCore import Qt, QSize, QEvent, Signal, QDate
 
 from ui.py_ui import icons_rc
 from ui.linac_qa.qa_tools_win import QAToolsWindow
 from ui.py_ui.winston_lutz_worksheet_ui import Ui_QWLutzWorksheet
 from ui.util_widgets.statusbar import AnalysisInfoLabel
-from ui.util_widgets import worksheet_save_report
+from ui.util_widgets import worksheet_save_report, submit_report
 from ui.util_widgets.dialogs import MessageDialog
 from ui.linac_qa.winston_lutz_test_dialog import WLTestDialog
 
 from core.analysis.wlutz import QWinstonLutzWorker, generate_winstonlutz
-from core.tools.report import WinstonLutzReport
+from core.analysis.scheduler import analysis_scheduler
+from core.analysis.report import QReportWorker
+from core.tools.report import WinstonLutzReport, ReportRunner
 from core.tools.devices import DeviceManager
+from core.image.dicom import load_dicom_image
+from core.image.indexer import ImageHeaderIndexer
 
 from pylinac.core.image_generator import (FilteredFieldLayer,
                                           FilterFreeConeLayer,
@@ -29,7 +33,6 @@ from pylinac.core.image_generator import (FilteredFieldLayer,
                                           AS1000Image,
                                           AS1200Image,
                                           generate_winstonlutz_cone)
-from pylinac.core.image import LinacDicomImage
 from pylinac.metrics.image import (GlobalSizedDiskLocator)
 
 from pathlib import Path
@@ -37,7 +40,6 @@ import gc
 import pyqtgraph as pg
 import platform
 import subprocess
-import webbrowser
 import numpy as np
 
 pg.setConfigOptions(antialias=True, imageAxisOrder='row-major')
@@ -233,6 +235,22 @@ class QWLutzWorksheet(QWidget):
         self.progress_vl.addWidget(self.analysis_progress_bar, 0, Qt.AlignHCenter)
         self.progress_vl.addWidget(self.analysis_message_label, 0, Qt.AlignHCenter)
 
+        self.cancel_analysis_btn = QPushButton("Cancel")
+        self.cancel_analysis_btn.setToolTip("Cancel the running analysis")
+        self.cancel_analysis_btn.clicked.connect(self.cancel_analysis)
+        self.cancel_analysis_btn.hide()
+        self.progress_vl.addWidget(self.cancel_analysis_btn, 0, Qt.AlignHCenter)
+
+        # Problems found in the image headers before the analysis
+        self.header_warning_label = QLabel()
+        self.header_warning_label.setWordWrap(True)
+        self.header_warning_label.setStyleSheet("color: rgb(255, 170, 0);")
+        self.header_warning_label.hide()
+        self.progress_vl.addWidget(self.header_warning_label)
+
+        self.header_indexer = ImageHeaderIndexer(self.ui.imageListWidget, self)
+        self.header_indexer.headers_updated.connect(self.update_header_warnings)
+
         self.ui.analysisInfoVL.addLayout(self.progress_vl)
 
         # connect slots
@@ -243,12 +261,14 @@ class QWLutzWorksheet(QWidget):
         self.ui.advancedViewBtn.clicked.connect(self.show_advanced_results_view)
         self.ui.genReportBtn.clicked.connect(self.generate_report)
         self.ui.imageListWidget.itemChanged.connect(self.update_marked_images)
+        self.ui.useFilenameSCheckBox.toggled.connect(lambda: self.update_header_warnings())
         self.ui.toleranceDSB.valueChanged.connect(self.set_analysis_outcome)
         self.ui.toleranceDSB.valueChanged.connect(lambda: self.show_advanced_results_view(True))
 
         self.marked_images = []
         self.imageView_windows = []
         self.analysis_in_progress = False
+        self.job = None
         self.maxLocError = None
         self.current_results = None
         self.advanced_results_view = None
@@ -266,6 +286,7 @@ class QWLutzWorksheet(QWidget):
         self.report_date = QDate.currentDate()
         self.save_path = ""
         self.save_comment = ""
+        self.report_treatment_unit = ""
 
     def add_files(self, files: tuple | list | None = None):
         if not files:
@@ -288,6 +309,8 @@ class QWLutzWorksheet(QWidget):
                 listItemWidget.setIcon(self.image_icon)
                 listItemWidget.setCheckState(Qt.Unchecked)
                 listItemWidget.setData(Qt.UserRole, itemData)
+
+            self.header_indexer.index(files)
             
             if self.ui.stackedWidget.currentIndex() == 0:
                 self.ui.stackedWidget.setCurrentIndex(1)
@@ -405,6 +428,17 @@ class QWLutzWorksheet(QWidget):
             self.ui.analyzeBtn.setText(f"Analyze images")
             self.ui.analyzeBtn.setEnabled(False)
 
+        self.update_header_warnings()
+
+    def update_header_warnings(self):
+        # Without the file names, the axes must come from the DICOM headers
+        warnings = self.header_indexer.warnings(
+            self.marked_images,
+            require_axes = not self.ui.useFilenameSCheckBox.isChecked(),
+            same_size = True)
+        self.header_warning_label.setText("\n".join(warnings))
+        self.header_warning_label.setVisible(len(warnings) > 0)
+
     def on_analysis_failed(self, error_message: str = "Unknown Error"):
         self.analysis_info_signal.emit({"state": AnalysisInfoLabel.FAILED,
                                         "message": None})
@@ -418,6 +452,7 @@ class QWLutzWorksheet(QWidget):
         self.ui.addImgBtn.setEnabled(True)
     
         self.analysis_progress_bar.hide()
+        self.cancel_analysis_btn.hide()
         self.analysis_message_label.hide()
 
         self.error_dialog = QMessageBox()
@@ -434,6 +469,28 @@ class QWLutzWorksheet(QWidget):
 
         self.error_dialog.exec()
     
+    def cancel_analysis(self):
+        if self.analysis_in_progress and self.job is not None:
+            self.cancel_analysis_btn.setEnabled(False)
+            self.analysis_message_label.setText("Cancelling analysis...")
+            analysis_scheduler().cancel(self.job)
+
+    def on_analysis_cancelled(self):
+        self.analysis_info_signal.emit({"state": AnalysisInfoLabel.CANCELLED,
+                                        "message": None})
+        self.analysis_state =  AnalysisInfoLabel.CANCELLED
+        self.analysis_message = None
+
+        self.analysis_in_progress = False
+        self.restore_list_checkmarks()
+
+        self.ui.analyzeBtn.setText(f"Analyze images")
+        self.ui.addImgBtn.setEnabled(True)
+
+        self.analysis_progress_bar.hide()
+        self.analysis_message_label.hide()
+        self.cancel_analysis_btn.hide()
+
     def start_analysis(self):
         self.analysis_info_signal.emit({"state": AnalysisInfoLabel.IN_PROGRESS,
                                         "message": None})
@@ -458,27 +515,27 @@ class QWLutzWorksheet(QWidget):
 
         self.worker = QWinstonLutzWorker(self.marked_images,
                                          self.ui.bb_size_dsb.value(),
-                                         self.ui.useFilenameSCheckBox.isChecked())
+                                         self.ui.useFilenameSCheckBox.isChecked(),
+                                         self.ui.virtualShiftCheckBox.isChecked())
     
-        self.qthread = QThread()
-        self.worker.moveToThread(self.qthread)
-        self.worker.analysis_failed.connect(self.qthread.quit)
         self.worker.analysis_failed.connect(self.on_analysis_failed)
         self.worker.images_analyzed.connect(self.analysis_progress_bar.setValue)
         self.worker.images_analyzed.connect(lambda counter: self.analysis_message_label.setText(
             f"Analyzing images ({counter} of {len(self.marked_images)} complete)"))
         self.worker.analysis_results_changed.connect(self.show_analysis_results)
         self.worker.bb_shift_info_changed.connect(self.update_bb_shift)
-        self.worker.thread_finished.connect(self.qthread.quit)
         self.worker.thread_finished.connect(self.worker.deleteLater)
-        self.qthread.started.connect(self.worker.analyze)
-        self.qthread.finished.connect(self.qthread.deleteLater)
 
         self.analysis_progress_bar.setRange(0, len(self.marked_images))
         self.analysis_progress_bar.setValue(0)
         self.analysis_message_label.setText("Starting analysis...")
 
-        self.qthread.start()
+        self.worker.analysis_cancelled.connect(self.on_analysis_cancelled)
+
+        self.cancel_analysis_btn.setEnabled(True)
+        self.cancel_analysis_btn.show()
+
+        self.job = analysis_scheduler().submit(self.worker, f"Winston-Lutz ({len(self.marked_images)} images)")
 
     def show_analysis_results(self, results: dict):
         self.current_results = results
@@ -494,6 +551,7 @@ class QWLutzWorksheet(QWidget):
         self.analysis_message = None
 
         self.analysis_progress_bar.hide()
+        self.cancel_analysis_btn.hide()
         self.analysis_message_label.hide()
 
         # Analyze button is auto-enabled by update_marked_images() on item data change
@@ -583,7 +641,7 @@ class QWLutzWorksheet(QWidget):
         if len(self.ui.imageListWidget.selectedItems()) > 0:
             image_short_name = self.ui.imageListWidget.currentItem().text()
             image_path = self.ui.imageListWidget.selectedItems()[0].data(Qt.UserRole)["file_path"]
-            image = LinacDicomImage(image_path)
+            image = load_dicom_image(image_path)
 
             imgView = pg.ImageView()
             imgView.setImage(image.array)
@@ -694,6 +752,7 @@ class QWLutzWorksheet(QWidget):
         # get linac devices
         linac_devices = DeviceManager.device_list["linacs"]
         treatment_unit_le.addItems([linac.name for linac in linac_devices])
+        treatment_unit_le.setCurrentText(self.report_treatment_unit)
 
         user_details_layout = QFormLayout()
         user_details_layout.addRow("Physicist:", physicist_name_le)
@@ -760,6 +819,7 @@ class QWLutzWorksheet(QWidget):
             self.report_institution = institution_name_le.text()
             self.save_comment = comments_te.toPlainText()
             self.report_date = analysis_date.date()
+            self.report_treatment_unit = treatment_unit_le.currentText()
 
             physicist_name = "N/A" if physicist_name_le.text() == "" else physicist_name_le.text()
             institution_name = "N/A" if institution_name_le.text() == "" else institution_name_le.text()
@@ -771,23 +831,29 @@ class QWLutzWorksheet(QWidget):
             else:
                 patient_info = None
 
-            report = WinstonLutzReport(save_path_le.text(),
-                                   author = physicist_name,
-                                   institution = institution_name,
-                                   treatment_unit_name = treatment_unit,
-                                   analysis_date = self.report_date.toString("dd MMMM yyyy"),
-                                   summary_plot = self.current_results["summary_plot"],
-                                   analysis_summary = self.analysis_summary,
-                                   report_status = self.ui.outcomeLE.text(),
-                                   patient_info = patient_info,
-                                   tolerance = self.ui.toleranceDSB.value(),
-                                   comments = comments_te.toPlainText()
-                                   )
-        
-            report.save_report()
-
-            if show_report_checkbox.isChecked():
-                webbrowser.open(save_path_le.text())
+            runner = self.report_runner(save_path_le.text(), physicist_name, institution_name,
+                                        treatment_unit, self.report_date.toString("dd MMMM yyyy"),
+                                        comments_te.toPlainText(), patient_info)
+            submit_report(QReportWorker(runner), "Winston-Lutz report", show_report_checkbox.isChecked(), self)
+
+    def report_runner(self, filename: str, author: str, institution: str, treatment_unit: str,
+                      analysis_date: str, comments: str,
+                      patient_info: dict | None = None) -> ReportRunner:
+        """
+        Report of the current analysis, built by a QReportWorker or with a batch of reports.
+        """
+        return ReportRunner(WinstonLutzReport, filename,
+                            author = author,
+                            institution = institution,
+                            treatment_unit_name = treatment_unit,
+                            analysis_date = analysis_date,
+                            plots = self.current_results["publishable_plots"],
+                            analysis_summary = self.analysis_summary,
+                            report_status = self.ui.outcomeLE.text(),
+                            patient_info = patient_info,
+                            tolerance = self.ui.toleranceDSB.value(),
+                            comments = comments
+                            )
 
     def toggle_patient_info(self, button: QPushButton, layout_group: QGroupBox, dialog: QDialog):
         if self.patient_info_toggled:
@@ -955,7 +1021,7 @@ class AnalysedImageViewer(QMainWindow):
 
         image_path = self.list_item.data(Qt.UserRole)["file_path"]
         image_data = self.list_item.data(Qt.UserRole)["analysis_data"]
-        image = LinacDicomImage(image_path)
+        image = load_dicom_image(image_path)
 
         self.image_dim = image.array.shape
         self.mm_per_dot = 1/image.dpmm
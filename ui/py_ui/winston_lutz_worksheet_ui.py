@@ -201,6 +201,16 @@ class Ui_QWLutzWorksheet(object):
 
         self.formLayout.setWidget(4, QFormLayout.FieldRole, self.useFilenameSCheckBox)
 
+        self.virtualShiftLabel = QLabel(self.frame_2)
+        self.virtualShiftLabel.setObjectName(u"virtualShiftLabel")
+
+        self.formLayout.setWidget(5, QFormLayout.LabelRole, self.virtualShiftLabel)
+
+        self.virtualShiftCheckBox = QCheckBox(self.frame_2)
+        self.virtualShiftCheckBox.setObjectName(u"virtualShiftCheckBox")
+
+        self.formLayout.setWidget(5, QFormLayout.FieldRole, self.virtualShiftCheckBox)
+
         self.bb_size_label = QLabel(self.frame_2)
         self.bb_size_label.setObjectName(u"bb_size_label")
 
@@ -521,6 +531,10 @@ class Ui_QWLutzWorksheet(object):
         self.label_3.setText(QCoreApplication.translate("QWLutzWorksheet", u"Coordinate system:", None))
         self.lowDensityBBLabel.setText(QCoreApplication.translate("QWLutzWorksheet", u"Low density BB:", None))
         self.useFilenameSLabel.setText(QCoreApplication.translate("QWLutzWorksheet", u"Use filename(s):", None))
+        self.virtualShiftLabel.setText(QCoreApplication.translate("QWLutzWorksheet", u"Apply virtual shift:", None))
+#if QT_CONFIG(tooltip)
+        self.virtualShiftCheckBox.setToolTip(QCoreApplication.translate("QWLutzWorksheet", u"Report the results as if the BB had been moved by the suggested shift", None))
+#endif // QT_CONFIG(tooltip)
         self.bb_size_label.setText(QCoreApplication.translate("QWLutzWorksheet", u"Ball bearing size:", None))
         self.bb_size_dsb.setSuffix(QCoreApplication.translate("QWLutzWorksheet", u" mm", None))
         self.label_2.setText(QCoreApplication.translate("QWLutzWorksheet", u"<html><head/><body><p><span style=\" font-weight:700;\">Analysis Outcome</span></p></body></html>", None))
@@ -1,4 +1,11 @@
-from PySide6.QtWidgets import QWidget, QFileDialog
+from PySide6.QtWidgets import QWidget, QFileDialog, QDialogButtonBox
+
+import webbrowser
+
+from core.analysis.compute.plotting import PublishablePlots
+from core.analysis.report import QBatchReportWorker, QPlotWorker, QReportWorker
+from core.analysis.scheduler import AnalysisJob, AnalysisScheduler, analysis_scheduler
+from ui.util_widgets.dialogs import MessageDialog
 
 def worksheet_save_report(parent: QWidget = None):
     file_path = QFileDialog.getSaveFileName(caption="Save To File...", 
@@ -14,4 +21,40 @@ def worksheet_save_report(parent: QWidget = None):
         return "/".join(path)
 
     else:
-        return ""
\ No newline at end of file
+        return ""
+
+def prepare_plots(plots: PublishablePlots, name: str) -> AnalysisJob | None:
+    """
+    Render the report plots of an analysis at batch priority, unless their policy is
+    lazy or they are already rendered. Returns the job, if any.
+    """
+    if plots.policy == "lazy" or plots.ready:
+        return None
+
+    return analysis_scheduler().submit(QPlotWorker(plots), name, AnalysisScheduler.BATCH)
+
+def submit_report(worker: QReportWorker | QBatchReportWorker, name: str, open_report: bool = False,
+                  parent: QWidget | None = None) -> AnalysisJob:
+    """
+    Save a report in the background through the analysis scheduler, so the window stays
+    responsive. The PDF is opened once saved if ``open_report`` is set.
+    """
+    job = analysis_scheduler().submit(worker, name)
+
+    # The job emits its state changes in the GUI thread
+    def on_state_changed(state: int):
+        if state == AnalysisJob.COMPLETE and open_report:
+            webbrowser.open(worker.filename)
+
+        elif state == AnalysisJob.FAILED:
+            error_dialog = MessageDialog(parent)
+            error_dialog.set_title("Report Error")
+            error_dialog.set_header_text("The report could not be saved")
+            error_dialog.set_info_text(job.error_message)
+            error_dialog.set_standard_buttons(QDialogButtonBox.StandardButton.Ok)
+            error_dialog.set_icon(MessageDialog.CRITICAL_ICON)
+            error_dialog.exec()
+
+    job.state_changed.connect(on_state_changed)
+
+    return job
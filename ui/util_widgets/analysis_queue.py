@@ -0,0 +1,113 @@
+from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QTreeWidget, QTreeWidgetItem,
+                               QPushButton, QSpacerItem, QSizePolicy)
+from PySide6.QtCore import QTimer
+
+import time
+
+from core.analysis.compute.memory import format_bytes
+from core.analysis.scheduler import AnalysisJob, AnalysisScheduler
+
+class AnalysisQueueWidget(QWidget):
+    """
+    Shows the jobs of the analysis scheduler and their state.
+    """
+
+    STATE_TEXT = {AnalysisJob.QUEUED: "Queued",
+                  AnalysisJob.RUNNING: "Running",
+                  AnalysisJob.COMPLETE: "Complete",
+                  AnalysisJob.FAILED: "Failed",
+                  AnalysisJob.CANCELLED: "Cancelled"}
+    
+    PRIORITY_TEXT = {AnalysisScheduler.INTERACTIVE: "Interactive",
+                     AnalysisScheduler.BATCH: "Batch"}
+
+    def __init__(self, scheduler: AnalysisScheduler, parent: QWidget | None = None):
+        super().__init__(parent)
+
+        self.scheduler = scheduler
+        self.job_items: dict[int, QTreeWidgetItem] = {}
+
+        self.jobs_tree_widget = QTreeWidget()
+        self.jobs_tree_widget.setColumnCount(5)
+        self.jobs_tree_widget.setHeaderLabels(["Analysis", "Priority", "State", "Time", "Peak memory"])
+        self.jobs_tree_widget.setRootIsDecorated(False)
+        self.jobs_tree_widget.setColumnWidth(0, 200)
+        self.jobs_tree_widget.setSelectionMode(QTreeWidget.SelectionMode.ExtendedSelection)
+
+        self.cancel_btn = QPushButton("Cancel")
+        self.cancel_btn.setToolTip("Cancel the selected analyses")
+        self.cancel_btn.clicked.connect(self.cancel_selected)
+
+        self.clear_btn = QPushButton("Clear finished")
+        self.clear_btn.clicked.connect(self.clear_finished)
+
+        btn_layout = QHBoxLayout()
+        btn_layout.addItem(QSpacerItem(10, 10, QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Fixed))
+        btn_layout.addWidget(self.cancel_btn)
+        btn_layout.addWidget(self.clear_btn)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.jobs_tree_widget)
+        layout.addLayout(btn_layout)
+        self.setLayout(layout)
+
+        for job in scheduler.jobs:
+            self.add_job(job)
+
+        scheduler.job_added.connect(self.add_job)
+        scheduler.job_state_changed.connect(self.update_job)
+
+        # Refresh the elapsed time of running jobs
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.update_running_jobs)
+        self.timer.start(1000)
+
+    def add_job(self, job: AnalysisJob):
+        item = QTreeWidgetItem([job.name, self.PRIORITY_TEXT.get(job.priority, str(job.priority)), "", "", ""])
+        self.job_items[job.job_id] = item
+        self.jobs_tree_widget.addTopLevelItem(item)
+
+        self.update_job(job)
+
+    def update_job(self, job: AnalysisJob):
+        item = self.job_items.get(job.job_id)
+
+        if item is None:
+            return
+
+        if job.cancel_requested and not job.is_finished:
+            item.setText(2, "Cancelling...")
+        else:
+            item.setText(2, self.STATE_TEXT[job.state])
+
+        item.setToolTip(2, job.error_message or "")
+
+        if job.started_at is None:
+            item.setText(3, "")
+        else:
+            end = job.finished_at if job.finished_at is not None else time.time()
+            item.setText(3, f"{end - job.started_at:.1f} s")
+
+        item.setText(4, format_bytes(job.peak_rss))
+        item.setToolTip(4, "Peak resident memory of the process that ran the analysis")
+
+    def update_running_jobs(self):
+        for job in self.scheduler.jobs:
+            if job.state == AnalysisJob.RUNNING:
+                self.update_job(job)
+
+    def cancel_selected(self):
+        selected_ids = {job_id for job_id, item in self.job_items.items() if item.isSelected()}
+
+        for job in self.scheduler.jobs:
+            if job.job_id in selected_ids:
+                self.scheduler.cancel(job)
+
+    def clear_finished(self):
+        self.scheduler.clear_finished()
+        remaining = {job.job_id for job in self.scheduler.jobs}
+
+        for job_id in list(self.job_items):
+            if job_id not in remaining:
+                item = self.job_items.pop(job_id)
+                self.jobs_tree_widget.takeTopLevelItem(self.jobs_tree_widget.indexOfTopLevelItem(item))
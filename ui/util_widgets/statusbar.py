@@ -9,6 +9,7 @@ class AnalysisInfoLabel(QWidget):
     IN_PROGRESS = 0
     COMPLETE = 1
     FAILED = 2
+    CANCELLED = 3
 
     def __init__(self) -> None:
         super().__init__()
@@ -54,5 +55,9 @@ class AnalysisInfoLabel(QWidget):
             icon_pixmap = icon_pixmap.scaled(16, 16, mode = Qt.TransformationMode.SmoothTransformation)
             self.icon.setPixmap(icon_pixmap)
 
+        elif state == self.CANCELLED:
+            self.label.setText("Analysis cancelled")
+            self.icon.clear()
+
         else:
             raise ValueError("Unknown message state passed in")
\ No newline at end of file